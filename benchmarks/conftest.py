@@ -0,0 +1,93 @@
+from pathlib import Path
+
+import pytest
+from pytest_benchmark.utils import get_machine_id
+from superlesson.standins import Behavior, StandIns
+from superlesson.steps import Merge, Replace
+from superlesson.steps.step import Step
+from superlesson.storage import Slides
+
+from .synthetic import Sizes, generate
+
+# runs are compared against the latest baseline saved for the same platform and python
+baselines = Path(__file__).parent / "baselines"
+# timings of a few rounds vary by 20% or more between runs on the same machine, so
+# each benchmark runs at least this many, and is compared by its fastest round
+min_rounds = 10
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config):
+    """Show how runs compare to the baselines in the repo, before benchmarks run.
+
+    Runs only fail when they're slower than the baseline with --benchmark-compare-fail,
+    e.g. on a pinned CI runner, since baselines saved on another machine of the same
+    platform may be faster or slower by more than any regression.
+    """
+    option = config.option
+    option.benchmark_min_rounds = max(option.benchmark_min_rounds, min_rounds)
+    if option.benchmark_storage != "file://./.benchmarks":
+        return
+    option.benchmark_storage = f"file://{baselines}"
+    # there's nothing to compare against on platforms without a baseline yet
+    if option.benchmark_save or not any((baselines / get_machine_id()).glob("*.json")):
+        return
+    if not option.benchmark_compare:
+        option.benchmark_compare = True
+
+
+@pytest.fixture(scope="session")
+def sizes():
+    return Sizes()
+
+
+@pytest.fixture(scope="session")
+def lesson(tmp_path_factory, sizes):
+    """A lesson merged, replaced and enumerated once, shared by every benchmark."""
+    root = generate(tmp_path_factory.mktemp("lesson"), sizes)
+    Merge(Slides(root)).segments()
+    Replace(Slides(root)).bogus_words()
+
+    slides = Slides(root)
+    slides.load_step(Step.replace)
+    for i, slide in enumerate(slides):
+        # the first page is left out of annotations, see Slides.as_pages
+        slide.number = i % (sizes.pages - 1) + 1
+    slides.save(Step.enumerate)
+    return root
+
+
+@pytest.fixture()
+def load():
+    def load(root, step):
+        slides = Slides(root)
+        assert slides.load_step(step)
+        return list(slides)
+
+    return load
+
+
+@pytest.fixture(scope="session")
+def _tiktoken():
+    import tiktoken
+
+    try:
+        tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        pytest.skip(f"tiktoken's encoding isn't available: {e}")
+
+
+@pytest.fixture(scope="session")
+def stand_ins(tmp_path_factory):
+    """Services about as slow as the real ones, throttling now and then."""
+    with StandIns(
+        openai=Behavior(
+            latency=0.2, jitter=0.5, throttle=0.05, retry_after=0.2, concurrency=16
+        ),
+        replicate=Behavior(latency=1, concurrency=4),
+        s3=Behavior(latency=0.05, bandwidth=50e6),
+    ) as stand_ins, pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path_factory.mktemp("cache")))
+        for name, value in stand_ins.environment().items():
+            monkeypatch.setenv(name, value)
+        yield stand_ins
@@ -0,0 +1,142 @@
+"""Synthetic lessons of any size, to benchmark and profile steps without real ones.
+
+A lesson has the transcription Transcribe would have saved, transition frames named
+after when they were taken, a presentation and replacements, all made up from a seed,
+so the same arguments always make the same lesson. To profile the CLI on one, run
+
+    python -m benchmarks.synthetic lessons/big --words 50000 --tframes 200
+"""
+
+import random
+import struct
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+
+import click
+from superlesson.steps.step import Step
+from superlesson.storage import Slide, Slides
+from superlesson.storage.slide import TimeFrame
+
+_syllables = [
+    "ma", "te", "ri", "ca", "lo", "fun", "ção", "de", "ri", "va", "da", "in", "te",
+    "gral", "li", "mi", "te", "se", "rie", "ve", "tor", "ma", "triz", "con", "ti",
+    "nu", "a", "pro", "va", "ex", "em", "plo", "res", "pos", "ta", "que", "s",
+]  # fmt: skip
+
+
+@dataclass
+class Sizes:
+    words: int = 12_000
+    tframes: int = 60
+    pages: int = 60
+    rules: int = 200
+
+
+def _vocabulary(rng: random.Random, size: int = 2000) -> list[str]:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choices(_syllables, k=rng.randint(1, 4))))
+    return sorted(words)
+
+
+def make_words(count: int, seed: int = 0) -> list[Slide]:
+    """Words of sentences with 4 to 25 words, and pauses of up to 2s between them."""
+    rng = random.Random(seed)
+    vocabulary = _vocabulary(rng)
+    words = []
+    time = 0.0
+    sentence_left = 0
+    while len(words) < count:
+        if sentence_left == 0:
+            sentence_left = rng.randint(4, 25)
+            time += rng.uniform(0.3, 2.0)
+        text = rng.choice(vocabulary)
+        sentence_left -= 1
+        if sentence_left == 0:
+            text += rng.choice(".....?!")
+        duration = rng.uniform(0.15, 0.6)
+        words.append(Slide(text, TimeFrame(round(time, 2), round(time + duration, 2))))
+        time += duration + rng.uniform(0.0, 0.15)
+    return words
+
+
+def _png() -> bytes:
+    """A valid 1x1 grey PNG, since steps only care about their names."""
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 0, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(b"\x00\x80"))
+        + chunk(b"IEND", b"")
+    )
+
+
+def write_tframes(directory: Path, count: int, duration: float, seed: int = 0):
+    """Frames at distinct seconds spread over the lesson, like slide transitions."""
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    seconds = rng.sample(range(1, max(int(duration), count + 1)), count)
+    png = _png()
+    for second in seconds:
+        hours, minutes = divmod(second // 60, 60)
+        name = f"{hours:02}-{minutes:02}-{second % 60:02}.png"
+        (directory / name).write_bytes(png)
+
+
+def write_presentation(path: Path, pages: int):
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for _ in range(pages):
+        # 16:9 at 72 dpi, like slides exported from most presentations
+        writer.add_blank_page(width=960, height=540)
+    with path.open("wb") as f:
+        writer.write(f)
+
+
+def write_replacements(path: Path, count: int, seed: int = 0):
+    """Rules replacing words of the lesson, and some which never match."""
+    rng = random.Random(seed)
+    vocabulary = _vocabulary(rng)
+    lines = [
+        f"{word} -> {word.upper()}" if i % 2 else f"{word}xyz -> {word}"
+        for i, word in enumerate(rng.sample(vocabulary, count))
+    ]
+    path.write_text("\n".join(lines) + "\n")
+
+
+def generate(root: Path, sizes: Sizes | None = None, seed: int = 0) -> Path:
+    """Make a lesson with its transcription saved, ready to be merged."""
+    sizes = sizes or Sizes()
+    root.mkdir(parents=True, exist_ok=True)
+    words = make_words(sizes.words, seed)
+    slides = Slides(root)
+    slides.extend(words)
+    slides.save(Step.transcribe)
+    write_tframes(root / "tframes", sizes.tframes, words[-1].timeframe.end, seed)
+    write_presentation(root / "presentation.pdf", sizes.pages)
+    write_replacements(root / "replacements.txt", sizes.rules, seed)
+    return root
+
+
+@click.command()
+@click.argument("root", type=click.Path(file_okay=False, path_type=Path))
+@click.option("--words", default=Sizes.words, show_default=True)
+@click.option("--tframes", default=Sizes.tframes, show_default=True)
+@click.option("--pages", default=Sizes.pages, show_default=True)
+@click.option("--rules", default=Sizes.rules, show_default=True)
+@click.option("--seed", default=0, show_default=True)
+def main(root: Path, words: int, tframes: int, pages: int, rules: int, seed: int):
+    """Make a synthetic lesson at ROOT."""
+    generate(root, Sizes(words, tframes, pages, rules), seed)
+    click.echo(f"Generated {root}")
+
+
+if __name__ == "__main__":
+    main()
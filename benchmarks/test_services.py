@@ -0,0 +1,29 @@
+import wave
+
+import pytest
+from superlesson.steps import Improve, Transcribe
+from superlesson.storage import Slides
+
+
+@pytest.mark.usefixtures("_tiktoken", "stand_ins")
+def test_improve_punctuation(benchmark, lesson):
+    benchmark.pedantic(
+        lambda: Improve(Slides(lesson, force=True)).punctuation(), rounds=3
+    )
+
+
+def test_transcribe(benchmark, tmp_path, stand_ins):
+    # about 10 minutes of audio, uploaded in parts
+    audio = tmp_path / "audio.wav"
+    with wave.open(str(audio), "wb") as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(16000)
+        file.writeframes(b"\0\0" * 16000 * 600)
+
+    def transcribe():
+        stand_ins.s3.state.objects.clear()
+        return Transcribe._transcribe_file(audio)
+
+    segments = benchmark.pedantic(transcribe, rounds=3)
+    assert segments[-1].end > 590
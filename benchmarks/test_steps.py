@@ -0,0 +1,60 @@
+import shutil
+
+import pytest
+from superlesson.diff import align
+from superlesson.steps import Annotate, Improve, Merge, Replace
+from superlesson.steps.step import Step
+from superlesson.storage import Slides
+
+from .synthetic import make_words
+
+
+def test_merge_segments(benchmark, lesson):
+    benchmark(lambda: Merge(Slides(lesson, force=True)).segments())
+
+
+def test_replace_bogus_words(benchmark, lesson):
+    benchmark(lambda: Replace(Slides(lesson, force=True)).bogus_words())
+
+
+@pytest.mark.usefixtures("_tiktoken")
+def test_split_into_prompts(benchmark, lesson, load):
+    texts = [slide.transcription for slide in load(lesson, Step.replace)]
+
+    benchmark(Improve._split_into_prompts, texts, Improve._max_input_tokens)
+
+
+def test_store_save(benchmark, tmp_path, sizes):
+    slides = Slides(tmp_path)
+    slides.extend(make_words(sizes.words))
+
+    benchmark(slides.save, Step.transcribe)
+
+
+def test_store_load(benchmark, lesson, load):
+    benchmark(load, lesson, Step.transcribe)
+
+
+def test_annotate(benchmark, lesson):
+    def compile_from_scratch():
+        shutil.rmtree(lesson / ".data" / "typst", ignore_errors=True)
+        return (Annotate(Slides(lesson, force=True), lesson / "presentation.pdf"),), {}
+
+    benchmark.pedantic(
+        lambda annotate: annotate.to_pdf(), setup=compile_from_scratch, rounds=10
+    )
+
+
+def test_annotate_cached(benchmark, lesson):
+    def annotate():
+        Annotate(Slides(lesson, force=True), lesson / "presentation.pdf").to_pdf()
+
+    annotate()
+    benchmark(annotate)
+
+
+def test_diff(benchmark, lesson, load):
+    merged = load(lesson, Step.merge)
+    replaced = load(lesson, Step.replace)
+
+    benchmark(lambda: list(align(merged, replaced)))
@@ -1,7 +1,15 @@
-from .cli import cli
+import sys
 
 
 def main():
+    # before importing the CLI, which is what sl serve saves
+    from .serve import forward
+
+    if (code := forward(sys.argv[1:])) is not None:
+        sys.exit(code)
+
+    from .cli import cli
+
     cli(prog_name="SuperLesson")
 
 
@@ -0,0 +1,209 @@
+"""Run the steps of many lessons at once.
+
+Lessons run concurrently, each going through its steps in order. Steps waiting on the
+network, like transcription and LLM calls, take one of a bounded number of slots and
+run in a thread, while CPU-bound steps run in a process pool sized to the cores.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections.abc import AsyncIterator, Callable, Iterable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from . import metrics, trace
+from .collection import Lesson
+from .steps import Annotate
+from .steps.step import Step, dependencies, registry
+from .storage import Slides
+
+logger = logging.getLogger("superlesson")
+
+# steps that spend most of their time waiting for a remote service
+network_steps = {Step.transcribe, Step.improve}
+
+
+@dataclass
+class LessonProgress:
+    root: Path
+    step: Step | None = None  # running, or where it failed
+    done: list[Step] = field(default_factory=list)
+    skipped: list[Step] = field(default_factory=list)
+    error: str | None = None
+    elapsed: float = 0
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None
+
+
+def unattended_steps() -> list[Step]:
+    """Steps that don't need someone at the terminal, in the order they run."""
+    return [
+        step for step in Step if step in registry and not registry[step].interactive
+    ]
+
+
+def ready(root: Path, step: Step) -> bool:
+    """Whether the interactive steps a step depends on were already run."""
+    if not any(registry[dep].interactive for dep in dependencies(step)):
+        return True
+    depends_on = registry[step].depends_on
+    assert depends_on is not None
+    return Slides(root).load_from_dependencies(step, depends_on) is not None
+
+
+def run_step(root: Path, step: Step):
+    """Run a step of the lesson at root, loading its dependencies from storage."""
+    from .pipeline import step_runners
+
+    lesson = Lesson(str(root))
+    slides = Slides(lesson.root)
+    # lessons already run in parallel, so annotations are compiled by a single process
+    annotate = Annotate(slides, lesson.presentation, workers=1)
+    step_runners(lesson, slides, annotate)[step]()
+
+
+def _run_step_timed(run: Callable[[Path, Step], None], root: Path, step: Step) -> float:
+    start = time.perf_counter()
+    run(root, step)
+    return time.perf_counter() - start
+
+
+def _run_step_in_worker(
+    run: Callable[[Path, Step], None], root: Path, step: Step
+) -> tuple[float, dict[str, Any]]:
+    """Run a step in a worker process, returning the metrics it updated too."""
+    elapsed = _run_step_timed(run, root, step)
+    return elapsed, metrics.registry.snapshot(reset=True)
+
+
+class Batch:
+    def __init__(
+        self,
+        roots: Iterable[Path] = (),
+        cpu_workers: int | None = None,
+        network_slots: int = 4,
+        run: Callable[[Path, Step], None] = run_step,
+    ):
+        """Prepare to run every non-interactive step of each lesson.
+
+        Args:
+            roots: Lesson roots
+            cpu_workers: Processes for CPU-bound steps. Defaults to the number of cores
+            network_slots: How many network-bound steps may run at the same time
+            run: What runs a step of a lesson. It must be picklable, since CPU-bound
+                steps run in other processes
+        """
+        self._roots = list(roots)
+        self._cpu_workers = cpu_workers or os.cpu_count() or 1
+        self._network_slots = network_slots
+        self._run = run
+        # interactive steps need someone at the terminal, so they're run per lesson
+        self.steps = unattended_steps()
+        self._pool: Executor | None = None
+        self._threads: Executor | None = None
+        self._network: asyncio.Semaphore | None = None
+
+    def run(
+        self, on_progress: Callable[[LessonProgress], None] | None = None
+    ) -> list[LessonProgress]:
+        """Run the steps of every lesson, even when some of them fail.
+
+        Args:
+            on_progress: Called whenever a lesson starts, finishes or fails a step
+
+        Returns:
+            The progress of each lesson, in the order they were given
+        """
+        return asyncio.run(self._run_all(on_progress or (lambda _: None)))
+
+    async def _run_all(
+        self, on_progress: Callable[[LessonProgress], None]
+    ) -> list[LessonProgress]:
+        async with self.pools():
+            return await asyncio.gather(
+                *(self.lesson(root, on_progress) for root in self._roots)
+            )
+
+    @asynccontextmanager
+    async def pools(self) -> AsyncIterator[None]:
+        """Start the pools lessons run in, shutting them down on exit."""
+        self._network = asyncio.Semaphore(self._network_slots)
+        # workers are forked, and would report the metrics they inherited again
+        with ProcessPoolExecutor(
+            self._cpu_workers, initializer=metrics.registry.reset
+        ) as pool:
+            # start the workers before any thread does, since they're forked
+            pool.submit(int).result()
+            with ThreadPoolExecutor(self._network_slots) as threads:
+                self._pool, self._threads = pool, threads
+                try:
+                    yield
+                finally:
+                    self._pool = self._threads = self._network = None
+
+    async def lesson(
+        self,
+        root: Path,
+        on_progress: Callable[[LessonProgress], None],
+        steps: Iterable[Step] | None = None,
+    ) -> LessonProgress:
+        """Run the steps of a lesson in order, stopping at the first failure.
+
+        Must be called within pools().
+
+        Args:
+            root: The lesson's root
+            on_progress: Called whenever the lesson starts, finishes or fails a step
+            steps: Which of the steps to run. Defaults to all of them
+        """
+        assert self._network is not None, "Pools not started"
+        wanted = self.steps if steps is None else set(steps)
+        progress = LessonProgress(root)
+        for step in self.steps:
+            if step not in wanted:
+                continue
+            if not ready(root, step):
+                logger.info(f"{root.name}: skipping {step.name}")
+                progress.skipped.append(step)
+                continue
+
+            progress.step = step
+            on_progress(progress)
+            try:
+                if step in network_steps:
+                    async with self._network:
+                        elapsed = await self._run_in(self._threads, root, step)
+                else:
+                    elapsed = await self._run_in(self._pool, root, step)
+            except Exception as e:
+                logger.debug(f"{root.name}: {step.name} failed", exc_info=True)
+                progress.error = str(e) or type(e).__name__
+                on_progress(progress)
+                return progress
+
+            progress.done.append(step)
+            progress.elapsed += elapsed
+            progress.step = None
+            on_progress(progress)
+        return progress
+
+    async def _run_in(self, executor: Executor | None, root: Path, step: Step) -> float:
+        loop = asyncio.get_running_loop()
+        # spans within steps run in the pool aren't traced, since it's another process
+        with trace.span("batch step", step=step.name, lesson=root.name):
+            if executor is not self._pool:
+                return await loop.run_in_executor(
+                    executor, _run_step_timed, self._run, root, step
+                )
+            elapsed, snapshot = await loop.run_in_executor(
+                executor, _run_step_in_worker, self._run, root, step
+            )
+        metrics.registry.merge(snapshot)
+        return elapsed
@@ -1,12 +1,16 @@
+import contextlib
+import json
 import logging
-import subprocess
+import sys
 from dataclasses import dataclass
+from pathlib import Path
 
 import click
 
 from .collection import Lesson
 from .steps.step import Step
-from .storage import Slides
+from .storage import Library, Slides
+from .storage.utils import seconds_to_timestamp
 
 logging.basicConfig(
     format="%(asctime)s.%(msecs)03d - %(name)s:%(levelname)s: %(message)s",
@@ -20,9 +24,123 @@ logger = logging.getLogger("superlesson")
 class Context:
     lesson: Lesson
     slides: Slides
+    library: Library | None = None
+
+
+def _diagnostics_options(func):
+    """Options to see where a command's time goes, shared by every group."""
+    func = click.option(
+        "--trace",
+        "trace_path",
+        type=click.Path(dir_okay=False, path_type=Path),
+        help="Save the time spent in steps and in calls to services, in Chrome's "
+        "trace event format.",
+    )(func)
+    func = click.option(
+        "--profile",
+        "profile_path",
+        type=click.Path(dir_okay=False, path_type=Path),
+        help="Profile the command with cProfile, saving the stats to a file.",
+    )(func)
+    func = click.option(
+        "--metrics",
+        "metrics_path",
+        type=click.Path(dir_okay=False, path_type=Path),
+        help="Save latencies, tokens, bytes and cache hits as a Prometheus textfile, "
+        "or as JSON if the file ends in .json.",
+    )(func)
+    return click.option(
+        "--metrics-interval",
+        type=click.FloatRange(min=0, min_open=True),
+        default=60,
+        show_default=True,
+        help="Seconds between saves of the metrics, besides once the command is done.",
+    )(func)
+
+
+def _start_diagnostics(
+    ctx: click.Context,
+    trace_path: Path | None,
+    profile_path: Path | None,
+    metrics_path: Path | None,
+    metrics_interval: float,
+):
+    """Trace, profile or save metrics until the command is done."""
+    if metrics_path is not None:
+        from .metrics import Exporter
+
+        ctx.call_on_close(Exporter(metrics_path, metrics_interval).start().stop)
+    if trace_path is not None:
+        from . import trace
+
+        tracer = trace.start()
+        ctx.call_on_close(lambda: tracer.save(trace_path))
+    if profile_path is not None:
+        import cProfile
+
+        profiler = cProfile.Profile()
+
+        def save_profile():
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+
+        ctx.call_on_close(save_profile)
+        profiler.enable()
+
+
+@click.group()
+@click.option("--verbose", "-v", is_flag=True, help="Enables verbose mode.")
+@click.option("--debug", is_flag=True, help="Enables verbose mode.")
+@_diagnostics_options
+@click.pass_context
+def library(
+    ctx, verbose, debug, trace_path, profile_path, metrics_path, metrics_interval
+):
+    """Commands for every lesson in a library."""
+    _start_diagnostics(ctx, trace_path, profile_path, metrics_path, metrics_interval)
+    if debug:
+        logger.setLevel(logging.DEBUG)
+    elif verbose:
+        logger.setLevel(logging.INFO)
 
 
-@click.group(invoke_without_command=True)
+class LessonGroup(click.Group):
+    """Commands for a LESSON, that also runs library commands, which take no LESSON."""
+
+    def main(self, args=None, **kwargs):
+        if args is None:
+            args = sys.argv[1:]
+        if self._runs_library_command(args):
+            return library.main(args, **kwargs)
+        return super().main(args, **kwargs)
+
+    def _runs_library_command(self, args) -> bool:
+        """Whether the LESSON in args, after any options, names a library command.
+
+        Lessons named like library commands are still lessons, if they exist.
+        """
+        parser = self.make_parser(click.Context(self))
+        try:
+            opts, _, _ = parser.parse_args(list(args))
+        except click.UsageError:
+            # reported by the group, when parsing args again
+            return False
+        lesson = opts.get("lesson")
+        return lesson in library.commands and not Path(lesson).exists()
+
+    def format_commands(self, ctx, formatter):
+        super().format_commands(ctx, formatter)
+        limit = formatter.width - 6 - max(len(name) for name in library.commands)
+        with formatter.section("Library commands"):
+            formatter.write_dl(
+                [
+                    (name, command.get_short_help_str(limit))
+                    for name, command in library.commands.items()
+                ]
+            )
+
+
+@click.group(cls=LessonGroup, invoke_without_command=True)
 @click.argument("lesson")
 @click.option(
     "--transcribe-with",
@@ -35,14 +153,50 @@ class Context:
 )
 @click.option("--verbose", "-v", is_flag=True, help="Enables verbose mode.")
 @click.option("--debug", is_flag=True, help="Enables verbose mode.")
+@click.option(
+    "--export-json", is_flag=True, help="Also save step data as JSON in .data."
+)
+@click.option(
+    "--force",
+    "-f",
+    is_flag=True,
+    help="Run steps even if their inputs didn't change.",
+)
+@click.option(
+    "--library",
+    "-l",
+    type=click.Path(dir_okay=False, path_type=Path),
+    envvar="SUPERLESSON_LIBRARY",
+    help="Keep step data in a SQLite library shared by every lesson.",
+)
+@_diagnostics_options
 @click.version_option()
 @click.pass_context
-def cli(ctx, lesson, transcribe_with, annotate_with, verbose, debug):
+def cli(
+    ctx,
+    lesson,
+    transcribe_with,
+    annotate_with,
+    verbose,
+    debug,
+    export_json,
+    force,
+    library,
+    trace_path,
+    profile_path,
+    metrics_path,
+    metrics_interval,
+):
     """Your CLI application for processing lessons."""
+    _start_diagnostics(ctx, trace_path, profile_path, metrics_path, metrics_interval)
     lesson = Lesson(lesson, transcribe_with, annotate_with)
+    if library is not None:
+        library = Library(library)
+        ctx.call_on_close(library.close)
     ctx.obj = Context(
         lesson,
-        Slides(lesson.root, verbose),
+        Slides(lesson.root, verbose, export_json, force, library),
+        library,
     )
 
     if debug:
@@ -112,15 +266,97 @@ def enumerate(ctx):
 
 
 @cli.command()
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    help="Number of processes compiling annotations. Defaults to the number of cores.",
+)
 @click.pass_context
-def annotate(ctx):
+def annotate(ctx, jobs):
     """Annotate to PDF."""
     from .steps import Annotate
 
-    annotate = Annotate(ctx.obj.slides, ctx.obj.lesson.presentation)
+    annotate = Annotate(ctx.obj.slides, ctx.obj.lesson.presentation, workers=jobs)
     annotate.to_pdf()
 
 
+@cli.command()
+@click.option("--yes", "-y", is_flag=True, help="Don't ask before running.")
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Number of tasks running at the same time.",
+)
+@click.option(
+    "--stream",
+    is_flag=True,
+    help="Merge, replace and improve slides while the lesson is transcribed.",
+)
+@click.pass_context
+def run(ctx, yes, jobs, stream):
+    """Run every step, running independent work concurrently.
+
+    Interactive steps run last, and are skipped if there's no terminal to ask in.
+    """
+    from .pipeline import Pipeline, Task, step_runners, step_tasks
+    from .steps import Annotate
+
+    lesson, slides = ctx.obj.lesson, ctx.obj.slides
+    annotate = Annotate(slides, lesson.presentation)
+    tasks = step_tasks(step_runners(lesson, slides, annotate))
+    if stream:
+        from .stream import Stream, steps
+
+        # a single task runs the streamed steps
+        streamed = {step.name for step in steps}
+        tasks = [task for task in tasks if task.name not in streamed]
+        for task in tasks:
+            task.after = sorted(
+                {"stream" if dep in streamed else dep for dep in task.after}
+            )
+        tasks.insert(0, Task("stream", Stream(lesson, slides).run))
+    # doesn't depend on any step, so it runs alongside transcription
+    tasks.append(Task("rescale presentation", annotate.prepare))
+    for task in tasks:
+        if task.name == Step.annotate.name:
+            task.after.append("rescale presentation")
+
+    if not yes:
+        names = ", ".join(task.name for task in tasks)
+        click.confirm(f"Run {names}?", abort=True)
+
+    report = Pipeline(tasks).run(jobs, interactive=sys.stdin.isatty())
+    for name, timing in sorted(report.timings.items(), key=lambda t: t[1].start):
+        click.echo(f"{name}: {timing.start:.1f}s - {timing.end:.1f}s")
+    path = " -> ".join(report.critical_path)
+    click.echo(f"Critical path: {path} ({report.critical_path_time:.1f}s)")
+    click.echo(f"Wall time: {report.wall_time:.1f}s")
+    if report.skipped:
+        click.echo(f"Skipped: {', '.join(report.skipped)}")
+    if report.failed:
+        failed = ", ".join(report.failed)
+        msg = f"Failed: {failed}"
+        raise click.ClickException(msg)
+
+
+@cli.command("import")
+@click.pass_context
+def import_data(ctx):
+    """Copy a LESSON's data directory into the library."""
+    library = ctx.obj.library
+    if library is None:
+        msg = "Pass the library to import into with --library"
+        raise click.UsageError(msg)
+
+    filenames = [step.value.filename for step in Step if step.value.in_storage()]
+    imported = library.import_lesson(ctx.obj.lesson.root, filenames)
+    click.echo(f"Imported {len(imported)} steps into {library.path}")
+
+
 @cli.command()
 @click.argument(
     "previous",
@@ -129,28 +365,282 @@ def annotate(ctx):
 @click.argument(
     "next", type=click.Choice([step.name for step in Step if step.value.in_storage()])
 )
+@click.option(
+    "--json",
+    "as_json",
+    is_flag=True,
+    help="Print one JSON object per slide, with change statistics.",
+)
+@click.option("--all", "show_all", is_flag=True, help="Also show unchanged slides.")
 @click.pass_context
-def diff(ctx, previous, next):
-    """Show differences in a LESSON from ."""
+def diff(ctx, previous, next, as_json, show_all):
+    """Show word differences between two steps of a LESSON."""
+    from .diff import align, render_slide
+
     root = ctx.obj.lesson.root
-    prev_slides = Slides(root)
-    prev_slides.load_step(Step[previous])
-    prev_file = prev_slides.save_temp_txt()
-
-    next_slides = Slides(root)
-    next_slides.load_step(Step[next])
-    next_file = next_slides.save_temp_txt()
-
-    logger.debug("Running wdiff")
-
-    subprocess.run(
-        " ".join(
-            [
-                "wdiff",
-                "-n -w $'\033[30;41m' -x $'\033[0m' -y $'\033[30;42m' -z $'\033[0m'",
-                str(prev_file),
-                str(next_file),
-            ]
-        ),
-        shell=True,
-    )
+    loaded = []
+    for name in (previous, next):
+        slides = Slides(root, library=ctx.obj.library)
+        if not slides.load_step(Step[name]):
+            msg = f'Step "{Step[name].value.name}" has not been run yet.'
+            raise click.ClickException(msg)
+        loaded.append(slides)
+
+    color = sys.stdout.isatty()
+    changed = total = inserted = deleted = 0
+    for slide_diff in align(loaded[0].stream(), loaded[1].stream()):
+        if as_json:
+            click.echo(json.dumps(slide_diff.to_dict(), ensure_ascii=False))
+            continue
+        total += 1
+        if slide_diff.changed:
+            changed += 1
+            inserted += slide_diff.stats["inserted"]
+            deleted += slide_diff.stats["deleted"]
+        if show_all or slide_diff.changed:
+            click.echo(render_slide(slide_diff, color))
+
+    if not as_json:
+        click.echo(f"{changed} of {total} slides changed, +{inserted} -{deleted} words")
+
+
+@library.command()
+@click.argument("query", nargs=-1, required=True)
+@click.option(
+    "--lessons",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    default="lessons",
+    show_default=True,
+    help="Directory with the lessons to search.",
+)
+@click.option(
+    "--window",
+    type=click.FloatRange(min=0),
+    default=10,
+    show_default=True,
+    help="Seconds within which every word of QUERY must be said.",
+)
+@click.option(
+    "--limit",
+    "-n",
+    type=click.IntRange(min=1),
+    default=100,
+    show_default=True,
+    help="Maximum number of hits to show.",
+)
+@click.option(
+    "--library",
+    "-l",
+    type=click.Path(dir_okay=False, path_type=Path),
+    envvar="SUPERLESSON_LIBRARY",
+    help="Also search lessons keeping their step data in this library.",
+)
+def search(query, lessons, window, limit, library):
+    """Find where QUERY was said, across every lesson."""
+    from .storage.index import SearchIndex
+
+    lessons = lessons.resolve()
+    roots = {path for path in lessons.iterdir() if (path / ".data").is_dir()}
+    with contextlib.ExitStack() as stack:
+        if library is not None:
+            library = Library(library)
+            stack.callback(library.close)
+            roots |= {root for root in library.roots() if root.parent == lessons}
+        index = SearchIndex(lessons / ".search.db")
+        stack.callback(index.close)
+        if count := index.update(sorted(roots), library):
+            logger.info(f"Indexed {count} lessons")
+
+        for hit in index.search(" ".join(query), window, limit):
+            slide = "?" if hit.slide is None else hit.slide
+            timestamp = seconds_to_timestamp(hit.time / 1000)
+            click.echo(f"{hit.lesson.name}\tslide {slide}\t{hit.time} ms ({timestamp})")
+
+
+def _show_progress(progress):
+    name = progress.root.name
+    if progress.failed:
+        click.echo(f"{name}: {progress.step.name} failed: {progress.error}")
+    elif progress.step is not None:
+        click.echo(f"{name}: running {progress.step.name}")
+    elif progress.done:
+        click.echo(f"{name}: finished {progress.done[-1].name}")
+
+
+_cpu_jobs_option = click.option(
+    "--cpu-jobs",
+    type=click.IntRange(min=1),
+    help="Processes for CPU-bound steps. Defaults to the number of cores.",
+)
+_network_jobs_option = click.option(
+    "--network-jobs",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Transcriptions and LLM calls running at the same time.",
+)
+
+
+@library.command()
+@click.argument(
+    "lessons",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    default="lessons",
+)
+@_cpu_jobs_option
+@_network_jobs_option
+@click.option("--verbose", "-v", is_flag=True, help="Enables verbose mode.")
+def batch(lessons, cpu_jobs, network_jobs, verbose):
+    """Run every non-interactive step on each lesson in LESSONS.
+
+    Steps depending on interactive ones, like annotate, only run on lessons that were
+    already enumerated.
+    """
+    from .batch import Batch
+
+    if verbose:
+        logger.setLevel(logging.INFO)
+
+    roots = Lesson.find_lessons(lessons)
+    if not roots:
+        msg = f"No lessons found in {lessons}"
+        raise click.UsageError(msg)
+
+    results = Batch(roots, cpu_jobs, network_jobs).run(_show_progress)
+    failed = [progress for progress in results if progress.failed]
+    click.echo(f"{len(results) - len(failed)} of {len(results)} lessons done")
+    if failed:
+        names = ", ".join(progress.root.name for progress in failed)
+        msg = f"Failed: {names}"
+        raise click.ClickException(msg)
+
+
+def _queue_path(lessons: Path, queue: Path | None) -> Path:
+    return queue if queue is not None else lessons / ".queue.db"
+
+
+_queue_option = click.option(
+    "--queue",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Job queue shared by the workers. Defaults to .queue.db in LESSONS.",
+)
+
+
+@library.command()
+@click.argument(
+    "lessons",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    default="lessons",
+)
+@_queue_option
+def submit(lessons, queue):
+    """Queue the non-interactive steps of each lesson in LESSONS for workers."""
+    from .jobs import JobQueue
+
+    roots = Lesson.find_lessons(lessons)
+    if not roots:
+        msg = f"No lessons found in {lessons}"
+        raise click.UsageError(msg)
+
+    job_queue = JobQueue(_queue_path(lessons, queue))
+    count = job_queue.submit(roots)
+    job_queue.close()
+    click.echo(f"Queued {count} jobs from {len(roots)} lessons")
+
+
+@library.command()
+@click.argument(
+    "lessons",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    default="lessons",
+)
+@_queue_option
+@click.option(
+    "--lease",
+    type=click.FloatRange(min=1),
+    default=60,
+    show_default=True,
+    help="Seconds before a job whose worker stopped responding is run again.",
+)
+@click.option("--drain", is_flag=True, help="Exit once no job is left.")
+@click.option("--verbose", "-v", is_flag=True, help="Enables verbose mode.")
+def worker(lessons, queue, lease, drain, verbose):
+    """Work on the jobs queued for LESSONS, which may be shared with other machines."""
+    from .jobs import JobQueue, Worker
+
+    if verbose:
+        logger.setLevel(logging.INFO)
+
+    job_queue = JobQueue(_queue_path(lessons, queue))
+    try:
+        done = Worker(job_queue, lease=lease).run(drain)
+        click.echo(f"Done {done} jobs")
+        for root, step, error in job_queue.failures():
+            click.echo(f"{root.name}: {step.name} failed: {error}")
+    finally:
+        job_queue.close()
+
+
+@library.command()
+@click.argument(
+    "lessons",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    default="lessons",
+)
+@_cpu_jobs_option
+@_network_jobs_option
+@click.option(
+    "--settle",
+    type=click.FloatRange(min=0),
+    default=5,
+    show_default=True,
+    help="Seconds a file must stay the same before it's considered complete.",
+)
+@click.option("--poll", is_flag=True, help="Poll for changes instead of using inotify.")
+@click.option("--verbose", "-v", is_flag=True, help="Enables verbose mode.")
+def watch(lessons, cpu_jobs, network_jobs, settle, poll, verbose):
+    """Run non-interactive steps on lessons in LESSONS as their files arrive."""
+    import asyncio
+
+    from .batch import Batch
+    from .watch import Watch, watcher
+
+    if verbose:
+        logger.setLevel(logging.INFO)
+
+    lessons_watcher = watcher(lessons, poll)
+    interval = 5 if poll else 1
+    daemon = Watch(Batch((), cpu_jobs, network_jobs), lessons_watcher, settle, interval)
+    click.echo(f"Watching {lessons}, press Ctrl-C to stop")
+    try:
+        asyncio.run(daemon.run(_show_progress))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        lessons_watcher.close()
+
+
+@library.command()
+@click.option(
+    "--socket",
+    "path",
+    type=click.Path(dir_okay=False, path_type=Path),
+    envvar="SUPERLESSON_SOCKET",
+    help="Where to listen. Defaults to superlesson.sock in $XDG_RUNTIME_DIR.",
+)
+@click.option("--verbose", "-v", is_flag=True, help="Enables verbose mode.")
+def serve(path, verbose):
+    """Keep sl warm, running the commands sl sends it until stopped."""
+    from .serve import Server, running, socket_path, warm_up
+
+    path = path or socket_path()
+    if running(path):
+        msg = f"sl serve is already running at {path}"
+        raise click.UsageError(msg)
+    if verbose:
+        logger.setLevel(logging.INFO)
+
+    warm_up()
+    click.echo(f"Serving at {path}")
+    with contextlib.suppress(KeyboardInterrupt):
+        Server(path).serve_forever()
@@ -1,22 +1,161 @@
+import json
 import logging
 import mimetypes
+import os
+import time
 from collections.abc import Generator
+from dataclasses import asdict, dataclass
 from enum import Enum, unique
+from hashlib import sha256
 from pathlib import Path
 
+from . import metrics
+
 logger = logging.getLogger("superlesson")
 
+_cache_requests = metrics.counter(
+    "cache_requests_total", "Lookups in caches, by cache and whether they hit."
+)
+
 
 @unique
 class FileType(Enum):
     video = "video"
     audio = "audio"
     slides = "slides"
+    tframes = "tframes"  # the folder of transition frames
 
 
 PathIterator = Generator[Path, None, None]
 
 
+@dataclass
+class ManifestEntry:
+    type: FileType | None  # None for files that aren't videos or presentations
+    size: int
+    mtime: int
+    hash: str | None = None
+
+
+class Manifest:
+    """The files in a lesson folder, kept in .data/manifest.json between runs.
+
+    The folder is only listed again when its mtime changes, which it does whenever files
+    are added, removed or renamed. A file's stat data is only checked when its hash is
+    asked for, and it's only hashed again if its size or mtime changed.
+    """
+
+    _version = 1
+    # files changed this recently may change again within the same mtime tick
+    _racy_ns = 2_000_000_000
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._path = root / ".data" / "manifest.json"
+        self._mtime: int | None = None
+        self.entries: dict[str, ManifestEntry] = {}
+        self._changed = False
+        self._load()
+
+    def refresh(self) -> "Manifest":
+        """Bring entries up to date with the folder, saving them if they changed."""
+        mtime = os.stat(self.root).st_mtime_ns
+        if mtime != self._mtime or self._racy(mtime):
+            self._rescan()
+            self._changed |= mtime != self._mtime
+            self._mtime = mtime
+        if self._changed:
+            self._save()
+        return self
+
+    def hash(self, name: str) -> str:
+        """The SHA-256 of a file's contents, computed once per change."""
+        path = self.root / name
+        self._update(name, path.stat())
+        entry = self.entries[name]
+        if entry.hash is not None:
+            _cache_requests.inc(cache="file hashes", result="hit")
+            return entry.hash
+
+        _cache_requests.inc(cache="file hashes", result="miss")
+        logger.debug(f"Hashing {name}")
+        digest = sha256()
+        with path.open("rb") as f:
+            while chunk := f.read(1024 * 1024):
+                digest.update(chunk)
+        # the file could still change without its stat data changing
+        if not self._racy(entry.mtime):
+            entry.hash = digest.hexdigest()
+        if self._changed or entry.hash is not None:
+            self._save()
+        return digest.hexdigest()
+
+    def first(self, type: FileType) -> Path | None:
+        return next(
+            (self.root / name for name, e in self.entries.items() if e.type is type),
+            None,
+        )
+
+    def _racy(self, mtime: int) -> bool:
+        return time.time_ns() - mtime < self._racy_ns
+
+    def _rescan(self):
+        names = []
+        for path in Lesson.get_files(self.root):
+            names.append(path.name)
+            self._update(path.name, path.stat())
+        for name in set(self.entries) - set(names):
+            del self.entries[name]
+            self._changed = True
+        self.entries = {name: self.entries[name] for name in sorted(names)}
+
+    def _update(self, name: str, stat: os.stat_result):
+        entry = self.entries.get(name)
+        if entry is not None and (entry.size, entry.mtime) == (
+            stat.st_size,
+            stat.st_mtime_ns,
+        ):
+            return
+        try:
+            type = Lesson.guess_type(name)
+        except ValueError:
+            type = None
+        self.entries[name] = ManifestEntry(type, stat.st_size, stat.st_mtime_ns)
+        self._changed = True
+
+    def _load(self):
+        try:
+            data = json.loads(self._path.read_text())
+        except (FileNotFoundError, ValueError):
+            return
+        if data.get("version") != self._version:
+            return
+        self._mtime = data["mtime"]
+        for name, entry in data["files"].items():
+            type = None if entry["type"] is None else FileType(entry["type"])
+            self.entries[name] = ManifestEntry(
+                type, entry["size"], entry["mtime"], entry["hash"]
+            )
+
+    def _save(self):
+        # storage imports this module, for Slides to fingerprint lesson files
+        from .storage.utils import write_atomic
+
+        self._changed = False
+        # folders without lesson files aren't lessons, so leave them untouched
+        if not self._path.parent.exists():
+            if all(entry.type is None for entry in self.entries.values()):
+                return
+            self._path.parent.mkdir()
+
+        files = {
+            name: asdict(entry) | {"type": entry.type and entry.type.value}
+            for name, entry in self.entries.items()
+        }
+        data = {"version": self._version, "mtime": self._mtime, "files": files}
+        write_atomic(self._path, json.dumps(data, indent=2))
+
+
 class Lesson:
     """User lesson"""
 
@@ -53,7 +192,7 @@ class Lesson:
         else:
             self._presentation = None
 
-        self._files: list[Path] = []
+        self._manifest: Manifest | None = None
 
     @staticmethod
     def find_root(lesson: str) -> Path:
@@ -69,11 +208,15 @@ class Lesson:
         return lesson_root
 
     @property
-    def files(self) -> list[Path]:
-        if not self._files:
-            self._files = list(self.get_files(self.root))
+    def manifest(self) -> Manifest:
+        if self._manifest is None:
+            self._manifest = Manifest(self.root).refresh()
+
+        return self._manifest
 
-        return self._files
+    @property
+    def files(self) -> list[Path]:
+        return [self.root / name for name in self.manifest.entries]
 
     @staticmethod
     def guess_type(name: str) -> FileType | None:
@@ -89,16 +232,21 @@ class Lesson:
             return FileType.video
         return None
 
+    @staticmethod
+    def ignored(path: Path) -> bool:
+        """Whether a path in a lesson folder is hidden or written by a step."""
+        return (
+            path.name.startswith(".")
+            or path.suffix == ".txt"
+            or path.name == "annotations.pdf"
+        )
+
     @classmethod
     def get_files(cls, root: Path, max_depth: int = 0) -> PathIterator:
         """All usable files in lesson folder."""
         logger.info(f"Searching for files on {root}")
         for path in root.iterdir():
-            if (
-                path.name.startswith(".")
-                or path.suffix == ".txt"
-                or path.name == "annotations.pdf"
-            ):
+            if cls.ignored(path):
                 continue
             if path.is_dir():
                 if max_depth > 0:
@@ -106,6 +254,17 @@ class Lesson:
             else:
                 yield path
 
+    @classmethod
+    def find_lessons(cls, directory: Path) -> list[Path]:
+        """Roots of the lessons in a directory, i.e. its folders with a video."""
+        return sorted(
+            path
+            for path in directory.iterdir()
+            if path.is_dir()
+            and not cls.ignored(path)
+            and Manifest(path).refresh().first(FileType.video) is not None
+        )
+
     @property
     def video(self) -> Path:
         if self._video is None:
@@ -129,9 +288,4 @@ class Lesson:
         return self._presentation
 
     def _find_first(self, type: FileType) -> Path | None:
-        try:
-            return next(
-                file for file in self.files if self.guess_type(file.name) == type
-            )
-        except StopIteration:
-            return None
+        return self.manifest.first(type)
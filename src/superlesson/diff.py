@@ -0,0 +1,255 @@
+"""Word diffs between the slides of two steps.
+
+Slides are paired by their timeframes, and the words of each pair are compared with
+Myers' O(ND) algorithm, in its linear space variant. Words are interned into integers
+first, so comparing them is cheap.
+"""
+
+from collections.abc import Hashable, Iterable, Iterator, Sequence
+from dataclasses import dataclass, field
+from typing import Any
+
+import click
+
+from .storage import Slide
+from .storage.txt import header
+
+# timeframes are only kept to the millisecond in .txt files
+_tolerance = 0.002
+
+
+@dataclass
+class Change:
+    tag: str  # equal, delete, insert or replace
+    before: list[str]
+    after: list[str]
+
+
+@dataclass
+class SlideDiff:
+    number: int | None
+    start: float
+    end: float
+    changes: list[Change] = field(default_factory=list)
+
+    @property
+    def stats(self) -> dict[str, int]:
+        stats = {"equal": 0, "deleted": 0, "inserted": 0}
+        for change in self.changes:
+            if change.tag == "equal":
+                stats["equal"] += len(change.before)
+            else:
+                stats["deleted"] += len(change.before)
+                stats["inserted"] += len(change.after)
+        return stats
+
+    @property
+    def changed(self) -> bool:
+        return any(change.tag != "equal" for change in self.changes)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "number": self.number,
+            "timeframe": {"start": self.start, "end": self.end},
+            "stats": self.stats,
+            "changes": [
+                {"tag": change.tag, "before": change.before, "after": change.after}
+                for change in self.changes
+                if change.tag != "equal"
+            ],
+        }
+
+
+def _furthest(v: list[int], i: int, k: int, d: int) -> int:
+    """Where a path on diagonal k starts, extending the furthest path next to it."""
+    if k == -d or (k != d and v[i - 1] < v[i + 1]):
+        return v[i + 1]
+    return v[i - 1] + 1
+
+
+def _middle_snake(
+    a: Sequence[int], alo: int, ahi: int, b: Sequence[int], blo: int, bhi: int
+) -> tuple[int, int, int, int]:
+    """Find the middle snake of an optimal edit script, from (x, y) to (u, v)."""
+    n, m = ahi - alo, bhi - blo
+    delta = n - m
+    odd = delta & 1
+    offset = n + m + 1
+    forward = [0] * (2 * offset + 1)
+    backward = [0] * (2 * offset + 1)
+
+    for d in range((n + m + 1) // 2 + 1):
+        for k in range(-d, d + 1, 2):
+            x = _furthest(forward, offset + k, k, d)
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            forward[offset + k] = x
+            if (
+                odd
+                and -(d - 1) <= delta - k <= d - 1
+                and x + backward[offset + delta - k] >= n
+            ):
+                return start_x, start_y, x, y
+
+        for k in range(-d, d + 1, 2):
+            x = _furthest(backward, offset + k, k, d)
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                x += 1
+                y += 1
+            backward[offset + k] = x
+            if (
+                not odd
+                and -d <= delta - k <= d
+                and x + forward[offset + delta - k] >= n
+            ):
+                return n - x, m - y, n - start_x, m - start_y
+
+    msg = "No middle snake found"
+    raise AssertionError(msg)
+
+
+def _matching_blocks(
+    a: Sequence[int],
+    alo: int,
+    ahi: int,
+    b: Sequence[int],
+    blo: int,
+    bhi: int,
+    blocks: list[tuple[int, int, int]],
+):
+    prefix = 0
+    while (
+        alo + prefix < ahi and blo + prefix < bhi and a[alo + prefix] == b[blo + prefix]
+    ):
+        prefix += 1
+    if prefix:
+        blocks.append((alo, blo, prefix))
+        alo, blo = alo + prefix, blo + prefix
+
+    suffix = 0
+    while (
+        alo < ahi - suffix
+        and blo < bhi - suffix
+        and a[ahi - 1 - suffix] == b[bhi - 1 - suffix]
+    ):
+        suffix += 1
+
+    # without a common prefix or suffix, there are at least 2 differences
+    if alo < ahi - suffix and blo < bhi - suffix:
+        x, y, u, v = _middle_snake(a, alo, ahi - suffix, b, blo, bhi - suffix)
+        _matching_blocks(a, alo, alo + x, b, blo, blo + y, blocks)
+        if u > x:
+            blocks.append((alo + x, blo + y, u - x))
+        _matching_blocks(a, alo + u, ahi - suffix, b, blo + v, bhi - suffix, blocks)
+
+    if suffix:
+        blocks.append((ahi - suffix, bhi - suffix, suffix))
+
+
+def diff(before: Sequence[Hashable], after: Sequence[Hashable]) -> list[Change]:
+    """Find the shortest edit script turning one sequence of words into the other."""
+    interned: dict[Hashable, int] = {}
+    a = [interned.setdefault(word, len(interned)) for word in before]
+    b = [interned.setdefault(word, len(interned)) for word in after]
+    blocks: list[tuple[int, int, int]] = []
+    _matching_blocks(a, 0, len(a), b, 0, len(b), blocks)
+    blocks.append((len(a), len(b), 0))
+
+    changes = []
+    x = y = 0
+    for i, j, size in blocks:
+        if x < i and y < j:
+            changes.append(Change("replace", list(before[x:i]), list(after[y:j])))
+        elif x < i:
+            changes.append(Change("delete", list(before[x:i]), []))
+        elif y < j:
+            changes.append(Change("insert", [], list(after[y:j])))
+        if size:
+            words = list(before[i : i + size])
+            if changes and changes[-1].tag == "equal":
+                changes[-1].before += words
+                changes[-1].after += words
+            else:
+                changes.append(Change("equal", words, list(words)))
+        x, y = i + size, j + size
+    return changes
+
+
+def align(before: Iterable[Slide], after: Iterable[Slide]) -> Iterator[SlideDiff]:
+    """Pair slides covering the same time, and diff their words.
+
+    Groups of slides are closed whenever both steps have a slide ending at the same
+    time, so a slide merged from several others is compared against all of them.
+    """
+    before, after = iter(before), iter(after)
+    a, b = next(before, None), next(after, None)
+    while a is not None or b is not None:
+        group_a, group_b = [], []
+        while a is not None or b is not None:
+            if b is None or (
+                a is not None and a.timeframe.end < b.timeframe.end - _tolerance
+            ):
+                group_a.append(a)
+                a = next(before, None)
+                continue
+            if a is None or b.timeframe.end < a.timeframe.end - _tolerance:
+                group_b.append(b)
+                b = next(after, None)
+                continue
+            # both end at the same time
+            group_a.append(a)
+            group_b.append(b)
+            a, b = next(before, None), next(after, None)
+            break
+        yield _diff_group(group_a, group_b)
+
+
+def _diff_group(group_a: list[Slide], group_b: list[Slide]) -> SlideDiff:
+    first, last = (group_b or group_a)[0], (group_b or group_a)[-1]
+    words_a = [word for slide in group_a for word in slide.transcription.split()]
+    words_b = [word for slide in group_b for word in slide.transcription.split()]
+    return SlideDiff(
+        first.number,
+        min(slide.timeframe.start for slide in group_a + group_b),
+        last.timeframe.end,
+        diff(words_a, words_b),
+    )
+
+
+def render(changes: Iterable[Change], color: bool = True) -> str:
+    """Show changes inline, like wdiff.
+
+    Without color, deletions are marked with [-...-] and insertions with {+...+}.
+    """
+    parts = []
+    for change in changes:
+        if change.tag == "equal":
+            parts.append(" ".join(change.before))
+            continue
+        if change.before:
+            deleted = " ".join(change.before)
+            parts.append(
+                click.style(deleted, fg="black", bg="red")
+                if color
+                else f"[-{deleted}-]"
+            )
+        if change.after:
+            inserted = " ".join(change.after)
+            parts.append(
+                click.style(inserted, fg="black", bg="green")
+                if color
+                else f"{{+{inserted}+}}"
+            )
+    return " ".join(parts)
+
+
+def render_slide(slide_diff: SlideDiff, color: bool = True) -> str:
+    stats = slide_diff.stats
+    title = header(slide_diff.number, slide_diff.start, slide_diff.end)
+    summary = f"+{stats['inserted']} -{stats['deleted']}"
+    return f"{title} {summary}\n\n{render(slide_diff.changes, color)}\n"
@@ -0,0 +1,277 @@
+"""Durable queue of step jobs, shared by workers on several machines.
+
+Jobs are a step of a lesson, kept in a SQLite database next to the lessons, so any
+machine mounting the lessons directory can work on them. The database uses a rollback
+journal, since WAL needs shared memory, which network filesystems don't provide.
+
+A worker claims a job by leasing it for some seconds, and keeps extending the lease
+while it works. Jobs whose lease expired, e.g. because their worker died, are claimed
+again, up to a number of attempts. Steps of a lesson run in order, so a job can only
+be claimed once the lesson's previous steps are done. Results are written by the steps
+themselves, through the lesson's store.
+
+Lesson roots are kept relative to the database, since machines may mount the shared
+directory at different paths. Lease times come from each worker's clock, so those
+should be kept in sync.
+"""
+
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+from .batch import ready, run_step, unattended_steps
+from .steps.step import Step
+
+logger = logging.getLogger("superlesson")
+
+_schema = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    root TEXT NOT NULL,
+    step TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    error TEXT,
+    UNIQUE (root, step)
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+"""
+
+# later steps of a lesson whose previous step won't ever be done
+_skip_blocked = """
+UPDATE jobs SET state = 'skipped'
+WHERE state = 'queued' AND EXISTS (
+    SELECT 1 FROM jobs AS previous
+    WHERE previous.root = jobs.root
+    AND previous.position < jobs.position
+    AND previous.state IN ('failed', 'skipped')
+)
+"""
+
+
+@dataclass
+class Job:
+    id: int
+    root: Path
+    step: Step
+    attempt: int
+
+
+class JobQueue:
+    def __init__(self, path: Path, max_attempts: int = 3):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._connection.executescript(_schema)
+
+    def close(self):
+        self._connection.close()
+
+    def submit(self, roots: Iterable[Path]) -> int:
+        """Queue the unattended steps of lessons, again if they were run before.
+
+        Steps depending on interactive ones are only queued for lessons where those
+        were already run. Jobs being worked on are left alone.
+
+        Returns:
+            How many jobs were queued
+        """
+        rows = [
+            (self._relative(root), step.name, position)
+            for root in roots
+            for position, step in enumerate(unattended_steps())
+            if ready(root, step)
+        ]
+        with self._transaction() as connection:
+            before = connection.total_changes
+            connection.executemany(
+                "INSERT INTO jobs (root, step, position) VALUES (?, ?, ?)"
+                " ON CONFLICT (root, step) DO UPDATE"
+                " SET state = 'queued', attempts = 0, worker = NULL, error = NULL"
+                " WHERE state != 'running'",
+                rows,
+            )
+            return connection.total_changes - before
+
+    def claim(self, worker: str, lease: float) -> Job | None:
+        """Lease the next job whose lesson's previous steps are done.
+
+        Returns:
+            The job, or None if no job can be worked on right now
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET state = 'failed', error = 'Lease expired'"
+                " WHERE state = 'running' AND lease_until < ? AND attempts >= ?",
+                (now, self.max_attempts),
+            )
+            connection.execute(_skip_blocked)
+            row = connection.execute(
+                "SELECT id, root, step, attempts FROM jobs AS job"
+                " WHERE (state = 'queued' OR (state = 'running' AND lease_until < ?))"
+                " AND NOT EXISTS ("
+                "  SELECT 1 FROM jobs AS previous WHERE previous.root = job.root"
+                "  AND previous.position < job.position AND previous.state != 'done'"
+                " ) ORDER BY id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+
+            job_id, root, step, attempts = row
+            if attempts:
+                logger.warning(f"Retrying {step} of {root}, attempt {attempts + 1}")
+            connection.execute(
+                "UPDATE jobs SET state = 'running', attempts = attempts + 1,"
+                " worker = ?, lease_until = ? WHERE id = ?",
+                (worker, now + lease, job_id),
+            )
+        return Job(job_id, self.path.parent / root, Step[step], attempts + 1)
+
+    def heartbeat(self, job: Job, worker: str, lease: float) -> bool:
+        """Extend the lease of a job, returning whether the worker still holds it."""
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET lease_until = ?"
+                " WHERE id = ? AND worker = ? AND state = 'running'",
+                (time.time() + lease, job.id, worker),
+            )
+            return cursor.rowcount == 1
+
+    def finish(self, job: Job, worker: str):
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET state = 'done', lease_until = NULL, error = NULL"
+                " WHERE id = ? AND worker = ?",
+                (job.id, worker),
+            )
+
+    def fail(self, job: Job, worker: str, error: str):
+        """Give the job back to the queue, or fail it once it ran out of attempts."""
+        state = "failed" if job.attempt >= self.max_attempts else "queued"
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET state = ?, lease_until = NULL, error = ?"
+                " WHERE id = ? AND worker = ?",
+                (state, error, job.id, worker),
+            )
+            connection.execute(_skip_blocked)
+
+    def counts(self) -> dict[str, int]:
+        """How many jobs are in each state."""
+        return dict(
+            self._connection.execute(
+                "SELECT state, count(*) FROM jobs GROUP BY state"
+            ).fetchall()
+        )
+
+    def failures(self) -> list[tuple[Path, Step, str]]:
+        rows = self._connection.execute(
+            "SELECT root, step, error FROM jobs WHERE state = 'failed' ORDER BY id"
+        ).fetchall()
+        return [
+            (self.path.parent / root, Step[step], error) for root, step, error in rows
+        ]
+
+    def pending(self) -> bool:
+        """Whether some job is still queued or being worked on."""
+        row = self._connection.execute(
+            "SELECT 1 FROM jobs WHERE state IN ('queued', 'running') LIMIT 1"
+        ).fetchone()
+        return row is not None
+
+    def _relative(self, root: Path) -> str:
+        return os.path.relpath(root.resolve(), self.path.resolve().parent)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        # take the write lock up front, so claims don't race each other
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._connection
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+
+
+class Worker:
+    def __init__(
+        self,
+        queue: JobQueue,
+        name: str | None = None,
+        lease: float = 60,
+        poll: float = 5,
+        run: Callable[[Path, Step], None] = run_step,
+    ):
+        """Work on the jobs of a queue, one at a time.
+
+        Args:
+            queue: Where jobs are claimed from
+            name: How the worker is known in the queue. Defaults to host:pid
+            lease: Seconds a job is held for without a heartbeat
+            poll: Seconds to wait for jobs when none can be claimed
+            run: What runs a step of a lesson
+        """
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self._queue = queue
+        self._lease = lease
+        self._poll = poll
+        self._run = run
+
+    def run(self, drain: bool = False) -> int:
+        """Work on jobs until stopped, or until no job is left if draining.
+
+        Returns:
+            How many jobs were done
+        """
+        done = 0
+        while True:
+            job = self._queue.claim(self.name, self._lease)
+            if job is None:
+                if drain and not self._queue.pending():
+                    return done
+                time.sleep(self._poll)
+                continue
+            done += self._work(job)
+
+    def _work(self, job: Job) -> bool:
+        logger.info(f"{self.name}: running {job.step.name} of {job.root}")
+        stop = threading.Event()
+        heart = threading.Thread(target=self._beat, args=(job, stop), daemon=True)
+        heart.start()
+        try:
+            self._run(job.root, job.step)
+        except Exception as e:
+            logger.error(f"{self.name}: {job.step.name} of {job.root} failed: {e}")
+            self._queue.fail(job, self.name, str(e) or type(e).__name__)
+            return False
+        finally:
+            stop.set()
+            heart.join()
+
+        self._queue.finish(job, self.name)
+        logger.info(f"{self.name}: finished {job.step.name} of {job.root}")
+        return True
+
+    def _beat(self, job: Job, stop: threading.Event):
+        # sqlite connections can't be shared between threads
+        queue = JobQueue(self._queue.path, self._queue.max_attempts)
+        try:
+            while not stop.wait(self._lease / 3):
+                if not queue.heartbeat(job, self.name, self._lease):
+                    logger.warning(f"{self.name}: lost the lease of {job.step.name}")
+                    return
+        finally:
+            queue.close()
@@ -0,0 +1,318 @@
+"""Counters and histograms of a process's work, for fleets of runs.
+
+Metrics are updated from the hot paths, e.g. each ChatGPT request observes its latency
+and counts its tokens, and every traced span observes its duration. They're kept in
+memory, and written as a Prometheus textfile (for node_exporter's textfile collector)
+or as JSON, at the end of a command or at intervals while it runs.
+
+Histograms have fixed buckets, so they're cheap to update and can be added up across
+processes and runs. Quantiles are estimated by interpolating within buckets.
+"""
+
+import json
+import logging
+import threading
+from bisect import bisect_left
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger("superlesson")
+
+# from 1ms to 40min, which is how long a long lesson may take to transcribe
+seconds_buckets = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    25,
+    50,
+    100,
+    250,
+    500,
+    1000,
+    2500,
+)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _labels(labels: dict[str, Any]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: dict[str, str] | None = None) -> str:
+    pairs = [*labels, *(extra or {}).items()]
+    if not pairs:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, lock: threading.Lock):
+        self.name = name
+        self.help = help
+        self._lock = lock
+        self.values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any):
+        key = _labels(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self.values.get(_labels(labels), 0)
+
+    def merge(self, values: dict[Labels, float]):
+        with self._lock:
+            for key, value in values.items():
+                self.values[key] = self.values.get(key, 0) + value
+
+    def snapshot(self) -> dict[Labels, float]:
+        return dict(self.values)
+
+    def reset(self):
+        self.values = {}
+
+    def lines(self) -> Iterable[str]:
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{_format_labels(labels)} {value:g}"
+
+    def to_dict(self) -> list[dict[str, Any]]:
+        return [
+            {"labels": dict(labels), "value": value}
+            for labels, value in sorted(self.values.items())
+        ]
+
+
+class _Series:
+    def __init__(self, buckets: int):
+        # the last bucket is +Inf
+        self.counts = [0] * (buckets + 1)
+        self.sum = 0.0
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        lock: threading.Lock,
+        buckets: tuple[float, ...] = seconds_buckets,
+    ):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._lock = lock
+        self.series: dict[Labels, _Series] = {}
+
+    def observe(self, value: float, **labels: Any):
+        key = _labels(labels)
+        # the first bucket whose upper bound is at least the value
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            if (series := self.series.get(key)) is None:
+                series = self.series[key] = _Series(len(self.buckets))
+            series.counts[i] += 1
+            series.sum += value
+
+    def quantile(self, q: float, **labels: Any) -> float | None:
+        """Estimate a quantile, assuming values are spread evenly within buckets.
+
+        Values in the last bucket, above every bound, are estimated as that bound.
+        """
+        series = self.series.get(_labels(labels))
+        if series is None or series.count == 0:
+            return None
+        rank = q * series.count
+        seen = 0
+        for i, count in enumerate(series.counts):
+            if count and seen + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def merge(self, series: dict[Labels, tuple[list[int], float]]):
+        with self._lock:
+            for key, (counts, total) in series.items():
+                if (current := self.series.get(key)) is None:
+                    current = self.series[key] = _Series(len(self.buckets))
+                current.counts = [
+                    a + b for a, b in zip(current.counts, counts, strict=True)
+                ]
+                current.sum += total
+
+    def snapshot(self) -> dict[Labels, tuple[list[int], float]]:
+        return {key: (list(s.counts), s.sum) for key, s in self.series.items()}
+
+    def reset(self):
+        self.series = {}
+
+    def lines(self) -> Iterable[str]:
+        for labels, series in sorted(self.series.items()):
+            cumulative = 0
+            bounds = [*(f"{bound:g}" for bound in self.buckets), "+Inf"]
+            for bound, count in zip(bounds, series.counts, strict=True):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket{_format_labels(labels, {'le': bound})} "
+                    f"{cumulative}"
+                )
+            yield f"{self.name}_sum{_format_labels(labels)} {series.sum:g}"
+            yield f"{self.name}_count{_format_labels(labels)} {series.count}"
+
+    def to_dict(self) -> list[dict[str, Any]]:
+        return [
+            {
+                "labels": dict(labels),
+                "count": series.count,
+                "sum": series.sum,
+                "p50": self.quantile(0.5, **dict(labels)),
+                "p95": self.quantile(0.95, **dict(labels)),
+                "p99": self.quantile(0.99, **dict(labels)),
+            }
+            for labels, series in sorted(self.series.items())
+        ]
+
+
+class Registry:
+    def __init__(self, prefix: str = "superlesson"):
+        """Metrics by name, each created the first time it's asked for."""
+        self._prefix = prefix
+        self._lock = threading.Lock()
+        self._metrics: dict[str, Counter | Histogram] = {}
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._get(Counter, name, help)
+
+    def histogram(self, name: str, help: str) -> Histogram:
+        return self._get(Histogram, name, help)
+
+    def _get(self, kind: type, name: str, help: str) -> Any:
+        name = f"{self._prefix}_{name}"
+        with self._lock:
+            if (metric := self._metrics.get(name)) is None:
+                metric = self._metrics[name] = kind(name, help, self._lock)
+        if not isinstance(metric, kind):
+            msg = f"{name} is a {metric.kind}, not a {kind.kind}"
+            raise TypeError(msg)
+        return metric
+
+    def snapshot(self, reset: bool = False) -> dict[str, Any]:
+        """The values of every metric, to be merged into another process' registry."""
+        with self._lock:
+            snapshot = {
+                name: (metric.kind, metric.help, metric.snapshot())
+                for name, metric in self._metrics.items()
+            }
+            if reset:
+                for metric in self._metrics.values():
+                    metric.reset()
+        return snapshot
+
+    def reset(self):
+        """Forget every value, e.g. those a forked process inherited."""
+        with self._lock:
+            for metric in self._metrics.values():
+                metric.reset()
+
+    def merge(self, snapshot: dict[str, Any]):
+        for name, (kind, help, values) in snapshot.items():
+            metric = self._get(
+                Counter if kind == Counter.kind else Histogram,
+                name.removeprefix(f"{self._prefix}_"),
+                help,
+            )
+            metric.merge(values)
+
+    def prometheus(self) -> str:
+        """The metrics in Prometheus' text exposition format."""
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.lines())
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            name: {"type": metric.kind, "help": metric.help, "values": metric.to_dict()}
+            for name, metric in sorted(self._metrics.items())
+        }
+
+    def write(self, path: Path):
+        """Write the metrics, as JSON if the path ends in .json, or as a textfile."""
+        from .storage.utils import write_atomic
+
+        if path.suffix == ".json":
+            data = json.dumps(self.to_dict(), indent=2, allow_nan=False)
+        else:
+            data = self.prometheus()
+        write_atomic(path, data)
+        logger.debug(f"Saved metrics to {path}")
+
+
+# the registry of this process
+registry = Registry()
+
+
+def counter(name: str, help: str) -> Counter:
+    return registry.counter(name, help)
+
+
+def histogram(name: str, help: str) -> Histogram:
+    return registry.histogram(name, help)
+
+
+class Exporter:
+    def __init__(self, path: Path, interval: float | None = None):
+        """Write the registry to a file when stopped, and every interval seconds."""
+        self._path = path
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> "Exporter":
+        if self._interval is not None:
+            self._thread = threading.Thread(
+                target=self._run, name="metrics exporter", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        registry.write(self._path)
+
+    def _run(self):
+        assert self._interval is not None
+        while not self._stopped.wait(self._interval):
+            try:
+                registry.write(self._path)
+            except OSError as e:
+                logger.warning(f"Couldn't save metrics: {e}")
@@ -0,0 +1,184 @@
+"""Run the tasks of a lesson as a DAG, with independent tasks running concurrently."""
+
+import logging
+import time
+from collections.abc import Callable, Iterable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any
+
+from .collection import Lesson
+from .steps import Annotate, Enumerate, Improve, Merge, Replace, Transcribe
+from .steps.step import Step, dependencies, registry
+from .storage import Slides
+
+logger = logging.getLogger("superlesson")
+
+
+@dataclass
+class Task:
+    name: str
+    run: Callable[[], Any]
+    after: list[str] = field(default_factory=list)
+    # needs someone at the terminal, so it runs in the main thread, after other tasks
+    interactive: bool = False
+
+
+@dataclass
+class Timing:
+    start: float
+    end: float
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+@dataclass
+class Report:
+    timings: dict[str, Timing] = field(default_factory=dict)
+    failed: dict[str, BaseException] = field(default_factory=dict)
+    skipped: list[str] = field(default_factory=list)
+    wall_time: float = 0
+    critical_path: list[str] = field(default_factory=list)
+
+    @property
+    def critical_path_time(self) -> float:
+        return sum(self.timings[name].duration for name in self.critical_path)
+
+
+def step_runners(
+    lesson: Lesson, slides: Slides, annotate: Annotate
+) -> dict[Step, Callable[[], Any]]:
+    """What runs each step of a lesson."""
+    return {
+        Step.transcribe: lambda: Transcribe(slides, lesson.video).single_file(),
+        Step.merge: Merge(slides).segments,
+        Step.replace: Replace(slides).bogus_words,
+        Step.improve: Improve(slides).punctuation,
+        Step.enumerate: lambda: Enumerate(slides, lesson.presentation).using_tframes(),
+        Step.annotate: annotate.to_pdf,
+    }
+
+
+def step_tasks(runners: dict[Step, Callable[[], Any]]) -> list[Task]:
+    """Tasks for steps, ordered by the dependencies in their step decorators."""
+    return [
+        Task(
+            step.name,
+            run,
+            [dep.name for dep in dependencies(step) if dep in runners],
+            registry[step].interactive,
+        )
+        for step, run in runners.items()
+    ]
+
+
+class Pipeline:
+    def __init__(self, tasks: Iterable[Task]):
+        self._tasks = {task.name: task for task in tasks}
+        for task in self._tasks.values():
+            for dep in task.after:
+                if dep not in self._tasks:
+                    msg = f'Task "{task.name}" depends on unknown task "{dep}"'
+                    raise ValueError(msg)
+
+    def run(self, workers: int = 4, interactive: bool = True) -> Report:
+        """Run every task once the tasks it depends on succeeded.
+
+        Args:
+            workers: How many tasks may run at the same time
+            interactive: Whether to run interactive tasks, they're skipped otherwise
+
+        Returns:
+            What ran, how long it took, and what failed or was skipped
+        """
+        report = Report()
+        pending = dict(self._tasks)
+        start = time.perf_counter()
+
+        def timed(task: Task) -> Timing:
+            task_start = time.perf_counter() - start
+            task.run()
+            return Timing(task_start, time.perf_counter() - start)
+
+        with ThreadPoolExecutor(workers) as pool:
+            running: dict[Future, Task] = {}
+            while pending or running:
+                self._skip_blocked(pending, report, interactive)
+                ready = [
+                    task
+                    for task in pending.values()
+                    if all(dep in report.timings for dep in task.after)
+                ]
+                for task in ready:
+                    if not task.interactive:
+                        logger.info(f'Starting "{task.name}"')
+                        running[pool.submit(timed, task)] = pending.pop(task.name)
+
+                if running:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._finish(running.pop(future), future, report)
+                elif ready:
+                    # interactive tasks wait until nothing else can run
+                    task = pending.pop(ready[0].name)
+                    self._finish(task, self._run_here(timed, task), report)
+                elif pending:
+                    # the remaining tasks depend on each other
+                    report.skipped += list(pending)
+                    break
+
+        report.wall_time = time.perf_counter() - start
+        report.critical_path = self._critical_path(report)
+        return report
+
+    def _skip_blocked(
+        self, pending: dict[str, Task], report: Report, interactive: bool
+    ):
+        blocked = set(report.failed) | set(report.skipped)
+        skipping = True
+        while skipping:
+            skipping = False
+            for task in list(pending.values()):
+                if (task.interactive and not interactive) or blocked & set(task.after):
+                    logger.warning(f'Skipping "{task.name}"')
+                    report.skipped.append(pending.pop(task.name).name)
+                    blocked.add(task.name)
+                    skipping = True
+
+    @staticmethod
+    def _run_here(timed: Callable[[Task], Timing], task: Task) -> Future:
+        future: Future = Future()
+        try:
+            future.set_result(timed(task))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    @staticmethod
+    def _finish(task: Task, future: Future, report: Report):
+        if (error := future.exception()) is not None:
+            logger.error(f'"{task.name}" failed: {error}')
+            report.failed[task.name] = error
+            return
+        logger.info(f'Finished "{task.name}"')
+        report.timings[task.name] = future.result()
+
+    def _critical_path(self, report: Report) -> list[str]:
+        """The chain of tasks that took longest, from first to last."""
+        longest: dict[str, tuple[float, list[str]]] = {}
+
+        def visit(name: str) -> tuple[float, list[str]]:
+            if name not in longest:
+                before = max(
+                    (visit(dep) for dep in self._tasks[name].after),
+                    default=(0.0, []),
+                    key=lambda path: path[0],
+                )
+                duration = report.timings[name].duration
+                longest[name] = (before[0] + duration, [*before[1], name])
+            return longest[name]
+
+        paths = [visit(name) for name in report.timings]
+        return max(paths, default=(0.0, []), key=lambda path: path[0])[1]
@@ -0,0 +1,130 @@
+"""Request and token quotas of remote services, shared by every process on a host.
+
+Each quota is a token bucket kept in a SQLite database in the user's cache directory,
+so concurrent runs split the account's quota instead of each assuming it owns all of
+it. Callers reserve capacity before each call, taking the bucket into debt if it's
+short, and then wait until the debt is paid back at the quota's rate. Callers are then
+served in the order they asked, without polling.
+
+Quotas default to those of the lowest paid tiers, and can be changed through the
+SUPERLESSON_<SERVICE>_RPM and SUPERLESSON_<SERVICE>_TPM environment variables, for
+requests and tokens per minute.
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+logger = logging.getLogger("superlesson")
+
+_schema = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    level REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+# requests and tokens per minute
+_quotas: dict[str, tuple[float, float | None]] = {
+    "openai": (3_500, 60_000),
+    "replicate": (600, None),
+}
+
+
+def _default_path() -> Path:
+    cache = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache) / "superlesson" / "ratelimit.db"
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        service: str,
+        requests_per_minute: float,
+        tokens_per_minute: float | None = None,
+        burst: float = 10,
+        path: Path | None = None,
+    ):
+        """Limit the calls to a service, together with other processes.
+
+        Args:
+            service: Name of the service, shared by limiters of the same quota
+            requests_per_minute: How many calls can be made per minute
+            tokens_per_minute: How many tokens calls can use per minute, if limited
+            burst: Seconds of unused quota that can be used at once
+            path: Where the buckets are kept. Defaults to the user's cache directory
+        """
+        self.service = service
+        self._rates = {"requests": requests_per_minute / 60}
+        if tokens_per_minute is not None:
+            self._rates["tokens"] = tokens_per_minute / 60
+        self._burst = burst
+        path = path or _default_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._connection.executescript(_schema)
+
+    def close(self):
+        self._connection.close()
+
+    def reserve(self, tokens: float = 0) -> float:
+        """Take capacity for a call, returning how many seconds to wait before it."""
+        return self._take({"requests": 1, "tokens": tokens})
+
+    def acquire(self, tokens: float = 0):
+        """Wait until a call using tokens can be made."""
+        if (wait := self.reserve(tokens)) > 0:
+            logger.debug(f"Waiting {wait:.2f}s for {self.service} quota")
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: float = 0):
+        if (wait := self.reserve(tokens)) > 0:
+            logger.debug(f"Waiting {wait:.2f}s for {self.service} quota")
+            await asyncio.sleep(wait)
+
+    def refund(self, tokens: float):
+        """Give back tokens reserved but not used by a call, or take more if negative."""
+        self._take({"tokens": -tokens})
+
+    def _take(self, amounts: dict[str, float]) -> float:
+        wait = 0.0
+        now = time.time()
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            for kind, amount in amounts.items():
+                if kind not in self._rates:
+                    continue
+                rate = self._rates[kind]
+                capacity = max(rate * self._burst, 1)
+                name = f"{self.service}.{kind}"
+                row = self._connection.execute(
+                    "SELECT level, updated FROM buckets WHERE name = ?", (name,)
+                ).fetchone()
+                level, updated = row if row is not None else (capacity, now)
+                level = min(capacity, level + (now - updated) * rate) - amount
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO buckets (name, level, updated)"
+                    " VALUES (?, ?, ?)",
+                    (name, level, now),
+                )
+                if level < 0:
+                    wait = max(wait, -level / rate)
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+        return wait
+
+
+def limiter(service: str) -> RateLimiter:
+    """The limiter of a service's quota, see the module's docstring."""
+    requests, tokens = _quotas[service]
+    prefix = f"SUPERLESSON_{service.upper()}"
+    requests = float(os.environ.get(f"{prefix}_RPM", requests))
+    if tokens is not None:
+        tokens = float(os.environ.get(f"{prefix}_TPM", tokens))
+    return RateLimiter(service, requests, tokens)
@@ -0,0 +1,342 @@
+"""A daemon keeping sl warm, so commands don't pay for starting up.
+
+Each sl process imports click, pypdf, typst, tiktoken, openai and boto3, and loads
+tiktoken's encoding, which takes longer than e.g. diffing two steps. `sl serve` does
+that once, then runs the commands sent to its Unix socket, keeping what they parsed,
+like presentations and step data, in memory for the next ones. While it's running,
+sl forwards commands to it, along with the working directory and environment, and
+prints their output.
+
+Commands run one at a time. Commands that ask questions or keep running aren't
+forwarded, and neither are commands sent while another one runs, so they run in
+their own process as usual. This module is imported before sl decides where to run
+a command, so it only imports the standard library.
+"""
+
+import contextlib
+import io
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from collections.abc import Iterator
+from pathlib import Path
+from typing import IO, Any
+
+from . import __version__
+
+logger = logging.getLogger("superlesson")
+
+# commands that may be forwarded. Others ask questions or keep running
+_forwarded = {
+    "transcribe",
+    "merge",
+    "replace",
+    "improve",
+    "annotate",
+    "diff",
+    "import",
+    "search",
+    "run",
+}
+_library_commands = {"search", "batch", "submit", "worker", "watch", "serve"}
+# options before LESSON or a library command taking a value, see cli
+_valued = {
+    "--transcribe-with",
+    "-t",
+    "--annotate-with",
+    "-a",
+    "--library",
+    "-l",
+    "--trace",
+    "--profile",
+    "--metrics",
+    "--metrics-interval",
+}
+
+# imported before serving, so commands don't import them
+_modules = [
+    "click",
+    "dotenv",
+    "pypdf",
+    "typst",
+    "tiktoken",
+    "openai",
+    "boto3",
+    "replicate",
+    "superlesson.cli",
+    "superlesson.diff",
+    "superlesson.pipeline",
+    "superlesson.steps",
+    "superlesson.stream",
+]
+
+
+def socket_path() -> Path:
+    if path := os.environ.get("SUPERLESSON_SOCKET"):
+        return Path(path)
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return Path(runtime) / "superlesson.sock"
+    cache = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache) / "superlesson" / "serve.sock"
+
+
+def _connect(path: Path) -> socket.socket | None:
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(str(path))
+    except OSError:
+        client.close()
+        return None
+    return client
+
+
+def running(path: Path) -> bool:
+    if (client := _connect(path)) is None:
+        return False
+    client.close()
+    return True
+
+
+def _command(args: list[str]) -> str | None:
+    """The command args run, found like cli does, without importing click.
+
+    Options come first, then LESSON and its command, unless the first argument names
+    a library command and isn't a path.
+    """
+    positional = []
+    i = 0
+    while i < len(args) and len(positional) < 2:
+        arg = args[i]
+        i += 1
+        if positional or not arg.startswith("-"):
+            positional.append(arg)
+        elif arg in _valued:
+            # its value
+            i += 1
+    library_command = positional and positional[0] in _library_commands
+    if library_command and not Path(positional[0]).exists():
+        return positional[0]
+    # a LESSON alone runs every step, asking before each one
+    return positional[1] if len(positional) == 2 else None
+
+
+def _should_forward(args: list[str]) -> bool:
+    command = _command(args)
+    if command not in _forwarded:
+        return False
+    # run asks before running, unless told not to
+    return command != "run" or "--yes" in args or "-y" in args
+
+
+def forward(args: list[str]) -> int | None:
+    """Run a command in the server, if it's running and can run it.
+
+    Returns:
+        The command's exit code, or None if it should run in this process
+    """
+    if not _should_forward(args):
+        return None
+    path = socket_path()
+    if not path.exists() or (client := _connect(path)) is None:
+        return None
+    request = {
+        "args": args,
+        "cwd": os.getcwd(),
+        "env": dict(os.environ),
+        "version": __version__,
+        "tty": sys.stdout.isatty(),
+    }
+    with client, client.makefile("rwb") as stream:
+        stream.write(json.dumps(request).encode() + b"\n")
+        stream.flush()
+        for line in stream:
+            message = json.loads(line)
+            if "exit" in message:
+                return message["exit"]
+            if "declined" in message:
+                return None
+            out = sys.stdout if "out" in message else sys.stderr
+            out.write(message.get("out", message.get("err", "")))
+            out.flush()
+    print(f"sl serve stopped while running {' '.join(args)}", file=sys.stderr)
+    return 1
+
+
+class _Forwarded(io.TextIOBase):
+    def __init__(self, send, name: str, tty: bool):
+        """Output sent to the client, as messages named name."""
+        self._send = send
+        self._name = name
+        self._tty = tty
+
+    def writable(self) -> bool:
+        return True
+
+    def isatty(self) -> bool:
+        return self._tty
+
+    def write(self, text: str) -> int:
+        self._send({self._name: text})
+        return len(text)
+
+
+@contextlib.contextmanager
+def _environment(cwd: str, env: dict[str, str]) -> Iterator[None]:
+    """Run in the client's directory and environment, logging as a new process would."""
+    previous_cwd, previous_env = os.getcwd(), dict(os.environ)
+    level = logger.level
+    logger.setLevel(logging.NOTSET)
+    os.chdir(cwd)
+    os.environ.clear()
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        os.chdir(previous_cwd)
+        os.environ.clear()
+        os.environ.update(previous_env)
+        logger.setLevel(level)
+
+
+@contextlib.contextmanager
+def _redirected(stdout: IO[str], stderr: IO[str]) -> Iterator[None]:
+    """Send output and logs to the client, and give input() nothing to read."""
+    streams = sys.stdin, sys.stdout, sys.stderr
+    handlers = [
+        (handler, handler.setStream(stderr))
+        for handler in logging.getLogger().handlers
+        if isinstance(handler, logging.StreamHandler)
+    ]
+    sys.stdin, sys.stdout, sys.stderr = io.StringIO(), stdout, stderr
+    try:
+        yield
+    finally:
+        sys.stdin, sys.stdout, sys.stderr = streams
+        for handler, stream in handlers:
+            handler.setStream(stream)
+
+
+def warm_up():
+    """Import what commands use, and load tiktoken's encoding."""
+    import importlib
+
+    start = time.perf_counter()
+    for module in _modules:
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            logger.warning(f"Couldn't import {module}: {e}")
+    try:
+        import tiktoken
+
+        tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # it's downloaded the first time, which may not work offline
+        logger.warning(f"Couldn't load tiktoken's encoding: {e}")
+    logger.info(f"Warmed up in {time.perf_counter() - start:.2f}s")
+
+
+class Server:
+    def __init__(self, path: Path):
+        """Run commands sent to a Unix socket at path, see the module's docstring."""
+        self.path = path
+        self._socket: socket.socket | None = None
+        self._busy = threading.Lock()
+        self._stopped = threading.Event()
+
+    def serve_forever(self):
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # left behind by a server that didn't stop cleanly
+        self.path.unlink(missing_ok=True)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(str(self.path))
+        # commands run as whoever started the server
+        self.path.chmod(0o600)
+        self._socket.listen()
+        try:
+            while not self._stopped.is_set():
+                try:
+                    connection, _ = self._socket.accept()
+                except OSError:
+                    break
+                threading.Thread(
+                    target=self._handle, args=(connection,), daemon=True
+                ).start()
+        finally:
+            self._socket.close()
+            self.path.unlink(missing_ok=True)
+
+    def stop(self):
+        self._stopped.set()
+        if self._socket is not None:
+            # wakes up accept
+            self._socket.shutdown(socket.SHUT_RDWR)
+
+    def _handle(self, connection: socket.socket):
+        # the client may go away, e.g. interrupted, but the command goes on
+        with connection, contextlib.suppress(OSError), connection.makefile(
+            "rwb"
+        ) as stream:
+            lock = threading.Lock()
+            closed = False
+
+            def send(message: dict[str, Any]):
+                nonlocal closed
+                if closed:
+                    return
+                try:
+                    with lock:
+                        stream.write(json.dumps(message).encode() + b"\n")
+                        stream.flush()
+                except OSError:
+                    closed = True
+
+            if not (line := stream.readline()):
+                # checking whether the server is running
+                return
+            request = json.loads(line)
+            if request.get("version") != __version__:
+                logger.warning("Declined a command from another version of sl")
+                send({"declined": "version"})
+                return
+            if not self._busy.acquire(blocking=False):
+                send({"declined": "busy"})
+                return
+            try:
+                send({"exit": self._run(request, send)})
+            finally:
+                self._busy.release()
+
+    @staticmethod
+    def _run(request: dict[str, Any], send) -> int:
+        from . import metrics, trace
+        from .cli import cli
+
+        logger.info(f"Running {' '.join(request['args'])} in {request['cwd']}")
+        stdout = _Forwarded(send, "out", request["tty"])
+        stderr = _Forwarded(send, "err", request["tty"])
+        # metrics and traces are of this command alone, like in its own process
+        metrics.registry.reset()
+        try:
+            with _environment(request["cwd"], request["env"]), _redirected(
+                stdout, stderr
+            ):
+                try:
+                    cli.main(request["args"], prog_name="SuperLesson")
+                except SystemExit as e:
+                    return e.code if isinstance(e.code, int) else int(bool(e.code))
+                except Exception:
+                    traceback.print_exc(file=stderr)
+                    return 1
+                return 0
+        finally:
+            trace.stop()
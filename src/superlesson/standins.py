@@ -0,0 +1,652 @@
+"""Local stand-ins for OpenAI, Replicate and S3, to run sl without them.
+
+Each stand-in is a small HTTP server speaking just enough of its service's API for the
+clients sl uses: chat completions, which echo the prompt back, predictions of
+WhisperX, which return canned word segments, and S3 objects, kept in memory. They're
+pointed at with the same environment variables as the real services, see
+StandIns.environment, so whole runs can be load tested offline and reproducibly.
+
+Every request goes through a Behavior, which adds latency, rejects requests over a
+rate with 429s, and fails a share of them at random, from a seed. To run them all
+until interrupted, printing the variables to export:
+
+    python -m superlesson.standins --openai latency=2,jitter=0.5,throttle=0.05
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+import wave
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import suppress
+from dataclasses import dataclass, field, fields
+from datetime import datetime, timezone
+from hashlib import md5
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import Any, ClassVar
+from urllib.parse import parse_qs, urlsplit
+
+import click
+
+logger = logging.getLogger("superlesson")
+
+
+@dataclass
+class Behavior:
+    """How a stand-in responds.
+
+    Attributes:
+        latency: Median seconds a request takes, or a prediction runs on Replicate
+        jitter: Spread of latencies, as the sigma of a log-normal around the median
+        errors: Share of requests failing with a server error
+        throttle: Share of requests rejected as if over the account's limits
+        rate: Requests per second accepted, after which they're rejected too
+        concurrency: Requests, or predictions, handled at once. Others wait for a slot
+        bandwidth: Bytes per second of request bodies, e.g. uploads to S3
+        retry_after: Seconds rejected requests are told to wait
+        seed: Seed of the random choices, so runs can be repeated
+    """
+
+    latency: float = 0.0
+    jitter: float = 0.0
+    errors: float = 0.0
+    throttle: float = 0.0
+    rate: float | None = None
+    concurrency: int | None = None
+    bandwidth: float | None = None
+    retry_after: float = 1.0
+    seed: int = 0
+
+    @classmethod
+    def parse(cls, spec: str) -> "Behavior":
+        """Parse a behavior from comma separated assignments, e.g. latency=2,errors=0.1."""
+        types = {f.name: f.type for f in fields(cls)}
+        values: dict[str, Any] = {}
+        for assignment in filter(None, spec.split(",")):
+            name, _, value = assignment.partition("=")
+            name = name.strip()
+            if name not in types:
+                msg = f"Unknown setting {name!r}, expected one of {', '.join(types)}"
+                raise ValueError(msg)
+            values[name] = (
+                int(value) if name in ("concurrency", "seed") else float(value)
+            )
+        return cls(**values)
+
+
+class _Injector:
+    def __init__(self, behavior: Behavior):
+        """Make the random choices of a behavior, from any thread."""
+        self.behavior = behavior
+        self._random = random.Random(behavior.seed)
+        self._lock = threading.Lock()
+        self._tokens = behavior.rate or 0.0
+        self._refilled = time.monotonic()
+        self._slots = (
+            threading.BoundedSemaphore(behavior.concurrency)
+            if behavior.concurrency
+            else None
+        )
+
+    def latency(self) -> float:
+        behavior = self.behavior
+        with self._lock:
+            spread = self._random.gauss(0, behavior.jitter) if behavior.jitter else 0
+        return behavior.latency * math.exp(spread)
+
+    def reject(self, errors: bool = True) -> int | None:
+        """The status to reject a request with, if it is."""
+        behavior = self.behavior
+        with self._lock:
+            if not self._take_token():
+                return 429
+            choice = self._random.random()
+        if errors and choice < behavior.errors:
+            return 500
+        if choice < behavior.errors + behavior.throttle:
+            return 429
+        return None
+
+    def fails(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.behavior.errors
+
+    def _take_token(self) -> bool:
+        rate = self.behavior.rate
+        if rate is None:
+            return True
+        now = time.monotonic()
+        # bursts of up to a second's worth of requests
+        self._tokens = min(rate, self._tokens + (now - self._refilled) * rate)
+        self._refilled = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def handle(self, size: int = 0):
+        """Take as long as a request with a body of size bytes does."""
+        if self._slots is not None:
+            self._slots.acquire()
+        try:
+            seconds = self.latency()
+            if self.behavior.bandwidth:
+                seconds += size / self.behavior.bandwidth
+            time.sleep(seconds)
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler: type["_Handler"], behavior: Behavior, port: int):
+        super().__init__(("127.0.0.1", port), handler)
+        self.injector = _Injector(behavior)
+        self.requests: Counter[tuple[str, int]] = Counter()
+        self.state: Any = None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: _Server
+    protocol_version = "HTTP/1.1"
+    service = ""
+
+    def log_message(self, format: str, *args: Any):
+        logger.debug(f"{self.service} stand-in: {format % args}")
+
+    def _send(
+        self, status: int, body: bytes = b"", headers: dict[str, str] | None = None
+    ):
+        self.server.requests[(self.command, status)] += 1
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _send_json(self, status: int, data: Any, headers: dict[str, str] | None = None):
+        body = json.dumps(data).encode()
+        self._send(
+            status, body, {"Content-Type": "application/json", **(headers or {})}
+        )
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _admit(self, wait: bool = True, size: int = 0, errors: bool = True) -> bool:
+        """Reject the request as the behavior says, or take as long as it should."""
+        injector = self.server.injector
+        if (status := injector.reject(errors)) is not None:
+            retry_after = injector.behavior.retry_after
+            headers = {
+                "Retry-After": str(math.ceil(retry_after)),
+                "Retry-After-Ms": str(int(retry_after * 1000)),
+            }
+            self._send_error(status, headers)
+            return False
+        if wait:
+            injector.handle(size)
+        return True
+
+    def _send_error(self, status: int, headers: dict[str, str]):
+        self._send_json(status, {"detail": f"injected {status}"}, headers)
+
+
+class _OpenAIHandler(_Handler):
+    service = "openai"
+
+    def do_POST(self):
+        request = json.loads(self._read_body() or b"{}")
+        if not urlsplit(self.path).path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"No route for {self.path}"}})
+            return
+        if not self._admit():
+            return
+        messages = request.get("messages", [])
+        # an improvement which changes nothing, so every completion is kept
+        content = messages[-1]["content"] if messages else ""
+        prompt_tokens = sum(_tokens(message["content"]) for message in messages)
+        completion_tokens = _tokens(content)
+        self._send_json(
+            200,
+            {
+                "id": f"chatcmpl-{next(self.server.state)}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", ""),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+        )
+
+    def _send_error(self, status: int, headers: dict[str, str]):
+        kind = "rate_limit_exceeded" if status == 429 else "server_error"
+        error = {"message": f"Injected {kind}", "type": kind, "code": kind}
+        self._send_json(status, {"error": error}, headers)
+
+
+def _tokens(text: str) -> int:
+    # about what tiktoken counts for Portuguese
+    return 4 + len(text.split()) * 4 // 3
+
+
+def _timestamp(seconds: float) -> str:
+    moment = datetime.fromtimestamp(seconds, tz=timezone.utc)
+    return moment.isoformat(timespec="microseconds").replace("+00:00", "Z")
+
+
+@dataclass
+class _Prediction:
+    id: str
+    version: str
+    input: dict[str, Any]
+    created: float
+    started: float
+    completed: float
+    failed: bool
+
+
+@dataclass
+class _Predictions:
+    by_id: dict[str, _Prediction] = field(default_factory=dict)
+    # when each of the slots running predictions is free again
+    slots: list[float] = field(default_factory=list)
+    ids: Iterator[int] = field(default_factory=itertools.count)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    segments: list[dict[str, Any]] | None = None
+    objects: dict[tuple[str, str], bytes] = field(default_factory=dict)
+
+
+class _ReplicateHandler(_Handler):
+    service = "replicate"
+    _route = re.compile(r"/v1/predictions(?:/(\w+))?$")
+
+    def do_POST(self):
+        request = json.loads(self._read_body() or b"{}")
+        if self._route.match(urlsplit(self.path).path) is None:
+            self._send_json(404, {"detail": "Not found."})
+            return
+        if not self._admit(wait=False, errors=False):
+            return
+        predictions: _Predictions = self.server.state
+        injector = self.server.injector
+        now = time.time()
+        with predictions.lock:
+            prediction_id = f"standin{next(predictions.ids)}"
+            # predictions wait for a free slot, like they do for a GPU
+            started = now
+            concurrency = injector.behavior.concurrency
+            if concurrency and len(predictions.slots) >= concurrency:
+                started = max(now, heapq.heappop(predictions.slots))
+            completed = started + injector.latency()
+            if concurrency:
+                heapq.heappush(predictions.slots, completed)
+            prediction = predictions.by_id[prediction_id] = _Prediction(
+                prediction_id,
+                request.get("version", ""),
+                request.get("input") or {},
+                now,
+                started,
+                completed,
+                # predictions fail rather than their requests
+                failed=injector.fails(),
+            )
+        self._send_json(201, self._describe(prediction))
+
+    def do_GET(self):
+        match = self._route.match(urlsplit(self.path).path)
+        predictions: _Predictions = self.server.state
+        if match is None or (prediction := predictions.by_id.get(match[1])) is None:
+            self._send_json(404, {"detail": "Not found."})
+            return
+        # polls don't take long, but count against the rate
+        if not self._admit(wait=False, errors=False):
+            return
+        self._send_json(200, self._describe(prediction))
+
+    def _describe(self, prediction: _Prediction) -> dict[str, Any]:
+        now = time.time()
+        description = {
+            "id": prediction.id,
+            "model": "standins/whisperx",
+            "version": prediction.version,
+            "status": "starting",
+            "input": prediction.input,
+            "output": None,
+            "logs": "",
+            "error": None,
+            "metrics": {},
+            "created_at": _timestamp(prediction.created),
+            "started_at": None,
+            "completed_at": None,
+            "urls": {
+                "get": f"{self._base_url()}/v1/predictions/{prediction.id}",
+                "cancel": f"{self._base_url()}/v1/predictions/{prediction.id}/cancel",
+            },
+        }
+        if now < prediction.started:
+            return description
+        description.update(
+            status="processing", started_at=_timestamp(prediction.started)
+        )
+        if now < prediction.completed:
+            return description
+        description.update(
+            completed_at=_timestamp(prediction.completed),
+            metrics={"predict_time": prediction.completed - prediction.started},
+        )
+        if prediction.failed:
+            description.update(status="failed", error="Injected failure")
+        else:
+            description.update(
+                status="succeeded",
+                output={"word_segments": self._segments(prediction.input)},
+            )
+        return description
+
+    def _base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _segments(self, input: dict[str, Any]) -> list[dict[str, Any]]:
+        predictions: _Predictions = self.server.state
+        if predictions.segments is not None:
+            return predictions.segments
+        # as long as the audio, if it was uploaded to the S3 stand-in
+        bucket, _, key = urlsplit(input.get("audio", "")).path.strip("/").partition("/")
+        return make_segments(_duration(predictions.objects.get((bucket, key))), key)
+
+
+def _duration(audio: bytes | None) -> float:
+    if audio is None:
+        return 60.0
+    try:
+        with wave.open(BytesIO(audio)) as file:
+            return file.getnframes() / file.getframerate()
+    except (wave.Error, EOFError):
+        return 60.0
+
+
+def make_segments(seconds: float, seed: str = "") -> list[dict[str, Any]]:
+    """Word segments like WhisperX's for audio this long, about 2.5 words a second.
+
+    Like WhisperX's, some words, e.g. numbers, aren't aligned, so they have no times.
+    """
+    rng = random.Random(seed)
+    words = ["então", "vamos", "ver", "a", "derivada", "da", "função", "no", "ponto"]
+    segments: list[dict[str, Any]] = []
+    time = rng.uniform(0, 0.5)
+    while time + 0.4 < seconds:
+        word = rng.choice(words)
+        if rng.random() < 0.1:
+            word += "."
+        if rng.random() < 0.02:
+            segments.append({"word": str(rng.randint(2, 99))})
+        else:
+            end = time + rng.uniform(0.15, 0.35)
+            segments.append(
+                {
+                    "word": word,
+                    "start": round(time, 3),
+                    "end": round(end, 3),
+                    "score": 0.9,
+                }
+            )
+        time += 0.4
+    return segments
+
+
+@dataclass
+class _Objects:
+    objects: dict[tuple[str, str], bytes] = field(default_factory=dict)
+    # parts of multipart uploads, by upload id
+    uploads: dict[str, dict[int, bytes]] = field(default_factory=dict)
+    ids: Iterator[int] = field(default_factory=itertools.count)
+
+
+class _S3Handler(_Handler):
+    service = "s3"
+
+    def _location(self) -> tuple[str, str, dict[str, list[str]]]:
+        url = urlsplit(self.path)
+        bucket, _, key = url.path.lstrip("/").partition("/")
+        return bucket, key, parse_qs(url.query, keep_blank_values=True)
+
+    def do_HEAD(self):
+        self._get()
+
+    def do_GET(self):
+        self._get()
+
+    def _get(self):
+        bucket, key, _ = self._location()
+        if not self._admit():
+            return
+        objects: _Objects = self.server.state
+        if (data := objects.objects.get((bucket, key))) is None:
+            self._send_error(404, {})
+            return
+        self._send(200, data, {"ETag": _etag(data)})
+
+    def do_PUT(self):
+        bucket, key, query = self._location()
+        data = self._read_object()
+        if not self._admit(size=len(data)):
+            return
+        objects: _Objects = self.server.state
+        if "uploadId" in query:
+            parts = objects.uploads[query["uploadId"][0]]
+            parts[int(query["partNumber"][0])] = data
+        elif key:
+            objects.objects[(bucket, key)] = data
+        self._send(200, headers={"ETag": _etag(data)})
+
+    def do_POST(self):
+        bucket, key, query = self._location()
+        self._read_body()
+        if not self._admit():
+            return
+        objects: _Objects = self.server.state
+        if "uploads" in query:
+            upload_id = f"upload{next(objects.ids)}"
+            objects.uploads[upload_id] = {}
+            self._send_xml(
+                "InitiateMultipartUploadResult",
+                f"<Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                f"<UploadId>{upload_id}</UploadId>",
+            )
+            return
+        parts = objects.uploads.pop(query["uploadId"][0])
+        data = b"".join(part for _, part in sorted(parts.items()))
+        objects.objects[(bucket, key)] = data
+        self._send_xml(
+            "CompleteMultipartUploadResult",
+            f"<Bucket>{bucket}</Bucket><Key>{key}</Key><ETag>{_etag(data)}</ETag>",
+        )
+
+    def do_DELETE(self):
+        bucket, key, query = self._location()
+        objects: _Objects = self.server.state
+        if "uploadId" in query:
+            objects.uploads.pop(query["uploadId"][0], None)
+        else:
+            objects.objects.pop((bucket, key), None)
+        self._send(204)
+
+    def _read_object(self) -> bytes:
+        body = self._read_body()
+        # botocore may send bodies in signed chunks, with checksums as trailers
+        if "aws-chunked" not in self.headers.get("Content-Encoding", ""):
+            return body
+        data = BytesIO()
+        stream = BytesIO(body)
+        while size := int(stream.readline().split(b";")[0].strip() or b"0", 16):
+            data.write(stream.read(size))
+            stream.readline()
+        return data.getvalue()
+
+    def _send_xml(self, root: str, content: str):
+        body = f'<?xml version="1.0" encoding="UTF-8"?><{root}>{content}</{root}>'
+        self._send(200, body.encode(), {"Content-Type": "application/xml"})
+
+    def _send_error(self, status: int, headers: dict[str, str]):
+        # S3 throttles with 503s
+        codes = {404: "NoSuchKey", 429: "SlowDown", 500: "InternalError"}
+        body = f"<Error><Code>{codes[status]}</Code></Error>".encode()
+        status = 503 if status == 429 else status
+        self._send(status, body, {"Content-Type": "application/xml", **headers})
+
+
+def _etag(data: bytes) -> str:
+    return f'"{md5(data).hexdigest()}"'  # noqa: S324
+
+
+class StandIn:
+    _handlers: ClassVar[dict[str, type[_Handler]]] = {
+        "openai": _OpenAIHandler,
+        "replicate": _ReplicateHandler,
+        "s3": _S3Handler,
+    }
+
+    def __init__(self, service: str, behavior: Behavior | None = None, port: int = 0):
+        """A stand-in for a service, served from a thread once started.
+
+        Args:
+            service: openai, replicate or s3
+            behavior: How it responds, by default right away and without errors
+            port: Where it listens, any free port by default
+        """
+        self.service = service
+        self._server = _Server(self._handlers[service], behavior or Behavior(), port)
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def requests(self) -> Counter[tuple[str, int]]:
+        """Requests served, by method and status."""
+        return self._server.requests
+
+    @property
+    def state(self) -> Any:
+        return self._server.state
+
+    @state.setter
+    def state(self, state: Any):
+        self._server.state = state
+
+    def start(self) -> "StandIn":
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            # how often it checks whether it was stopped
+            kwargs={"poll_interval": 0.05},
+            name=f"{self.service} stand-in",
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class StandIns:
+    def __init__(
+        self,
+        openai: Behavior | None = None,
+        replicate: Behavior | None = None,
+        s3: Behavior | None = None,
+        segments: list[dict[str, Any]] | None = None,
+    ):
+        """Stand-ins for every service sl uses.
+
+        Args:
+            openai: How the OpenAI stand-in responds
+            replicate: How the Replicate stand-in responds
+            s3: How the S3 stand-in responds
+            segments: The word segments every prediction returns. By default, they're
+                made up as long as the audio uploaded to the S3 stand-in
+        """
+        self.openai = StandIn("openai", openai)
+        self.openai.state = itertools.count()
+        self.s3 = StandIn("s3", s3)
+        self.s3.state = _Objects()
+        self.replicate = StandIn("replicate", replicate)
+        self.replicate.state = _Predictions(
+            segments=segments, objects=self.s3.state.objects
+        )
+
+    def environment(self) -> dict[str, str]:
+        """The variables pointing sl at the stand-ins, with credentials they take."""
+        return {
+            "OPENAI_BASE_URL": f"{self.openai.url}/v1",
+            "OPENAI_API_KEY": "standin",
+            "REPLICATE_BASE_URL": self.replicate.url,
+            "REPLICATE_API_TOKEN": "standin",
+            "REPLICATE_POLL_INTERVAL": "0.1",
+            "AWS_ENDPOINT_URL_S3": self.s3.url,
+            "AWS_ACCESS_KEY_ID": "standin",
+            "AWS_SECRET_ACCESS_KEY": "standin",
+            "AWS_DEFAULT_REGION": "us-east-1",
+        }
+
+    def __enter__(self) -> "StandIns":
+        for stand_in in (self.openai, self.replicate, self.s3):
+            stand_in.start()
+        return self
+
+    def __exit__(self, *exc_info: Any):
+        for stand_in in (self.openai, self.replicate, self.s3):
+            stand_in.stop()
+
+
+def _behavior(ctx: click.Context, param: click.Parameter, value: str) -> Behavior:
+    try:
+        return Behavior.parse(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e)) from e
+
+
+@click.command()
+@click.option("--openai", default="", callback=_behavior, help="e.g. latency=2")
+@click.option("--replicate", default="", callback=_behavior, help="e.g. latency=60")
+@click.option("--s3", default="", callback=_behavior, help="e.g. bandwidth=1e7")
+def main(openai: Behavior, replicate: Behavior, s3: Behavior):
+    """Serve stand-ins for OpenAI, Replicate and S3 until interrupted."""
+    with StandIns(openai, replicate, s3) as stand_ins:
+        for name, value in stand_ins.environment().items():
+            click.echo(f"export {name}={value}")
+        with suppress(KeyboardInterrupt):
+            threading.Event().wait()
+
+
+if __name__ == "__main__":
+    main()
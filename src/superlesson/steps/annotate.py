@@ -1,48 +1,95 @@
+from __future__ import annotations
+
+import json
 import logging
+import os
 from collections.abc import Sequence
+from functools import lru_cache
+from io import BytesIO
+from itertools import repeat
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-from superlesson.storage import Slides
+from superlesson import metrics, trace
+from superlesson.storage import Cache, Slides
 from superlesson.storage.slide import Page
-from superlesson.storage.utils import mktemp
+from superlesson.storage.utils import file_version, scratch_dir
 
 from .step import Step, step
 
+if TYPE_CHECKING:
+    from pypdf import PageObject
+
 logger = logging.getLogger("superlesson")
 
+_cache_requests = metrics.counter(
+    "cache_requests_total", "Lookups in caches, by cache and whether they hit."
+)
+
 
 class Annotate:
-    def __init__(self, slides: Slides, presentation: Path):
+    _index_key = "index"
+    # spawning a worker isn't worth it for fewer pages than this
+    _min_shard_pages = 20
+
+    def __init__(self, slides: Slides, presentation: Path, workers: int | None = None):
         self._presentation = presentation
+        self._output = presentation.parent / "annotations.pdf"
+        self._workers = workers or os.cpu_count() or 1
+        self._scaled: list[PageObject] | None = None
         self.slides = slides
 
+    def inputs(self) -> list[Path | str]:
+        return [self._presentation]
+
+    def outputs(self) -> list[Path]:
+        return [self._output]
+
+    def prepare(self) -> None:
+        """Rescale the presentation ahead of time, e.g. while other steps run."""
+        if self._scaled is None:
+            with trace.span("rescale presentation"):
+                self._scaled = _rescaled(
+                    self._presentation, file_version(self._presentation)
+                )
+
     @step(Step.annotate, Step.enumerate)
     def to_pdf(self):
-        from pypdf import PdfReader, PdfWriter
+        from pypdf import PdfWriter
 
         pages = self.slides.as_pages()
-        small_pdf = self._resize_and_scale(self._presentation, scale=0.7)
-
-        page_width = int(PdfReader(small_pdf).pages[0].mediabox.width / 72)
-        transcription_pdf = self._compile_with_typst(pages, width=page_width)
-
-        merger = PdfWriter()
-        for i, page in enumerate(pages):
-            number = page.number
-            logger.debug(f"Adding slide {number} to annotated PDF")
-            merger.append(small_pdf, pages=(number, number + 1))
-            logger.debug(f"Adding transcription to slide {i}")
-            merger.append(transcription_pdf, pages=(i, i + 1))
+        self.prepare()
+        slides = self._scaled
+        assert slides is not None
+
+        page_width = int(slides[0].mediabox.width / 72)
+        transcription = self._compile_with_typst(
+            pages,
+            Cache(self.slides.lesson_root, "typst"),
+            width=page_width,
+            workers=self._workers,
+        )
 
-        output = self._presentation.parent / "annotations.pdf"
-        merger.write(output)
-        logger.info(f"Annotated PDF saved as {output}")
+        # slides come from a single reader, so resources shared between them (e.g. fonts
+        # and images) are only copied once
+        with trace.span("pdf merge", pages=2 * len(pages)) as span:
+            merger = PdfWriter()
+            for i, page in enumerate(pages):
+                number = page.number
+                logger.debug(f"Adding slide {number} to annotated PDF")
+                merger.add_page(slides[number])
+                logger.debug(f"Adding transcription to slide {i}")
+                merger.add_page(transcription[i])
+
+            merger.write(self._output)
+            span.set(bytes=self._output.stat().st_size)
+        logger.info(f"Annotated PDF saved as {self._output}")
 
     @classmethod
     def _resize_and_scale(
         cls, pdf_path: Path, width: int = 10, scale: float = 1
-    ) -> Path:
-        from pypdf import PdfReader, PdfWriter, Transformation
+    ) -> list[PageObject]:
+        from pypdf import PdfReader, Transformation
 
         pdf = PdfReader(pdf_path)
 
@@ -81,19 +128,16 @@ class Annotate:
             .translate(tx=x_translation, ty=0)
         )
 
-        temp_pdf = PdfWriter()
-        for page in pdf.pages:
+        pages = list(pdf.pages)
+        for page in pages:
             page.mediabox.upper_right = (
                 page.mediabox.right * ratio,
                 page.mediabox.top * scale * ratio,  # cut top margin
             )
             page.add_transformation(op)
-            temp_pdf.add_page(page)
 
-        rescaled_pdf = mktemp(suffix=".pdf")
-        temp_pdf.write(rescaled_pdf)
-        logger.debug(f"scaled PDF saved as {rescaled_pdf}")
-        return rescaled_pdf
+        logger.debug(f"Scaled {len(pages)} pages from {pdf_path}")
+        return pages
 
     # FIXME: (#110) typst complains about invalid syntax in some documents
     @classmethod
@@ -138,10 +182,139 @@ class Annotate:
         return current, next
 
     @classmethod
-    def _compile_with_typst(cls, pages: Sequence[Page], width: int = 10) -> Path:
+    def _compile_with_typst(
+        cls, pages: Sequence[Page], cache: Cache, width: int = 10, workers: int = 1
+    ) -> list[PageObject]:
+        """Compile the transcription of each page, reusing cached pages.
+
+        Each page is keyed by its full typst source, so only pages whose text (or the
+        page layout) changed since the last run are compiled again. Those are sharded
+        into chunks compiled by up to `workers` processes, and the cache index maps each
+        page to its chunk.
+        """
+        from pypdf import PdfReader
+
+        preamble = cls._typst_preamble(width)
+        # continuation markers are added to each page on its own, so that editing a page
+        # doesn't change its neighbors
+        texts = [
+            ("" if i == 0 else " \u21E2")
+            + page.text
+            + ("" if i == len(pages) - 1 else "\u21E2 \n")
+            for i, page in enumerate(pages)
+        ]
+        keys = [cache.key(preamble, str(width), text) for text in texts]
+
+        index = cls._load_index(cache, keys)
+        # identical pages are only compiled once
+        missing = {}
+        for key, text in zip(keys, texts, strict=True):
+            if key not in index and key not in missing:
+                missing[key] = text
+        logger.info(f"Compiling {len(missing)} of {len(pages)} pages with typst")
+        _cache_requests.inc(len(pages) - len(missing), cache="typst", result="hit")
+        _cache_requests.inc(len(missing), cache="typst", result="miss")
+        if missing:
+            with trace.span(
+                "typst", pages=len(missing), cached=len(pages) - len(missing)
+            ):
+                index |= cls._compile_shards(preamble, missing, cache, workers)
+
+        cache.put(cls._index_key, json.dumps(index).encode("utf-8"))
+        chunks = {chunk for chunk, _ in index.values()}
+        cache.prune([cls._index_key, *chunks])
+
+        readers = {chunk: PdfReader(BytesIO(cache.get(chunk))) for chunk in chunks}
+        return [readers[chunk].pages[i] for chunk, i in (index[key] for key in keys)]
+
+    @classmethod
+    def _compile_shards(
+        cls, preamble: str, texts: dict[str, str], cache: Cache, workers: int
+    ) -> dict[str, tuple[str, int]]:
+        """Compile pages in contiguous shards, one per worker process.
+
+        Each worker compiles its whole shard at once, so typst only loads fonts once
+        per worker.
+
+        Returns:
+            The chunk and page index of each compiled page
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        items = list(texts.items())
+        shards = max(1, min(workers, len(items) // cls._min_shard_pages))
+        size = -(-len(items) // shards)
+        groups = [items[i : i + size] for i in range(0, len(items), size)]
+
+        sources = [[text for _, text in group] for group in groups]
+        if len(groups) == 1:
+            compiled = [cls._compile_pages(preamble, sources[0])]
+        else:
+            logger.debug(f"Compiling {len(groups)} shards of {size} pages")
+            with ProcessPoolExecutor(max_workers=len(groups)) as executor:
+                compiled = list(
+                    executor.map(cls._compile_pages, repeat(preamble), sources)
+                )
+
+        index = {}
+        for group, pdf in zip(groups, compiled, strict=True):
+            chunk = cache.key(*(key for key, _ in group))
+            cache.put(chunk, pdf)
+            for i, (key, _) in enumerate(group):
+                index[key] = (chunk, i)
+        return index
+
+    @classmethod
+    def _load_index(cls, cache: Cache, keys: list[str]) -> dict[str, tuple[str, int]]:
+        """Load which chunk holds each of the given pages.
+
+        Pages that are no longer used are dropped, and when chunks hold more unused pages
+        than used ones, the index is discarded so that every page is compiled again.
+        """
+        if (data := cache.get(cls._index_key)) is None:
+            return {}
+        old_index = json.loads(data)
+
+        index = {}
+        for key in keys:
+            if key in old_index:
+                chunk, i = old_index[key]
+                if chunk in cache:
+                    index[key] = (chunk, i)
+
+        chunks = {chunk for chunk, _ in index.values()}
+        stored = sum(1 for chunk, _ in old_index.values() if chunk in chunks)
+        if stored > 2 * len(index):
+            logger.debug("Typst cache is too fragmented, compiling all pages")
+            return {}
+        return index
+
+    @staticmethod
+    def _compile_pages(preamble: str, texts: list[str]) -> bytes:
+        """Compile texts into a PDF with one page each."""
         import typst
+        from pypdf import PdfReader
 
-        preamble = f"""
+        # typst can only compile from a file
+        with scratch_dir() as scratch:
+            typ_out = scratch / "pages.typ"
+            typ_out.write_text(
+                preamble + "\n#pagebreak()\n".join(texts), encoding="utf-8"
+            )
+            logger.debug(f"Typst temp file saved as {typ_out}")
+
+            with trace.span("typst compile", pages=len(texts)):
+                compiled = typst.compile(str(typ_out))
+        # pages have automatic height, so they never overflow into a new page
+        if (count := len(PdfReader(BytesIO(compiled)).pages)) != len(texts):
+            msg = f"Typst compiled {count} pages, expected {len(texts)}"
+            raise ValueError(msg)
+
+        return compiled
+
+    @staticmethod
+    def _typst_preamble(width: int) -> str:
+        return f"""
 #set page(
     width: {width}in,
     height: auto,
@@ -175,17 +348,12 @@ class Annotate:
 
 """
 
-        with (typ_out := mktemp(suffix=".typ")).open("wb") as f:
-            f.write(preamble.encode("utf-8"))
-            f.write(
-                "\u21E2 \n#pagebreak()\n \u21E2".join(
-                    [page.text for page in pages]
-                ).encode("utf-8")
-            )
-        logger.debug(f"Typst temp file saved as {typ_out}")
 
-        temp_output = mktemp(suffix=".pdf")
-        typst.compile(typ_out, output=temp_output)
-        logger.debug(f"Typst temp pdf saved as {temp_output}")
+@lru_cache(maxsize=4)
+def _rescaled(presentation: Path, version: tuple[int, ...]) -> list[PageObject]:
+    """Rescale a presentation, again only once it changes, see file_version.
 
-        return temp_output
+    Pages are copied into the annotated PDF, so they're kept as they are, e.g. for the
+    next annotate sl serve runs.
+    """
+    return Annotate._resize_and_scale(presentation, scale=0.7)
@@ -32,9 +32,13 @@ class Enumerate:
     def __init__(self, slides: Slides, presentation: Path):
         from pypdf import PdfReader
 
+        self._presentation = presentation
         self.presentation_len = len(PdfReader(presentation).pages)
         self.slides = slides
 
+    def inputs(self) -> list[Path | str]:
+        return [self._presentation]
+
     def _get_slide_number_from_user(self, slide_idx: int, default: int) -> Answer:
         if (path := self.slides[slide_idx].tframe) is not None:
             self._sys_open(path)
@@ -85,10 +89,9 @@ class Enumerate:
         msg = f"Invalid slide number: {number + 1} (should be between 1 and {self.presentation_len})"
         raise InvalidInputError(msg)
 
-    @step(Step.enumerate, Step.merge)
+    @step(Step.enumerate, Step.merge, journal=True, interactive=True)
     def using_tframes(self):
-        i = 0
-        last_answer = -1
+        i, last_answer = self._find_unanswered()
         while i < len(self.slides):
             if last_answer < self.presentation_len - 1:
                 suggestion = last_answer + 1
@@ -108,7 +111,7 @@ class Enumerate:
                 case Command.none:
                     logger.info("Slide will be hidden")
                     # keep the default value for the next slide
-                    self.slides[i].number = -1
+                    self.slides.update(i, number=-1)
                     i += 1
                 case Command.append:
                     logger.info(f"Appending slide {i + 1} to previous slide")
@@ -127,9 +130,26 @@ class Enumerate:
                         logger.info("Reached last slide on presentation")
                     last_answer = number
                     logger.debug("slide number: %d", last_answer)
-                    self.slides[i].number = last_answer
+                    self.slides.update(i, number=last_answer)
                     i += 1
 
+    def _find_unanswered(self) -> tuple[int, int]:
+        """Find where to start, keeping answers from an interrupted run.
+
+        Returns:
+            The first slide without a number, and the last slide number given before it
+        """
+        i = 0
+        last_answer = -1
+        while i < len(self.slides) and (number := self.slides[i].number) is not None:
+            if number >= 0:
+                last_answer = number
+            i += 1
+
+        if i > 0:
+            logger.info(f"Resuming from slide {i + 1}")
+        return i, last_answer
+
     @staticmethod
     def _sys_open(path: Path) -> int:
         import subprocess
@@ -1,18 +1,23 @@
 import asyncio
+import dataclasses
 import logging
 import re
-import time
+from collections.abc import AsyncIterable, AsyncIterator
 from dataclasses import dataclass
+from pathlib import Path
 from typing import cast
 
-from superlesson.storage import Slides
-from superlesson.storage.store import Store
-from superlesson.storage.utils import diff_words
+from superlesson import metrics, ratelimit, trace
+from superlesson.diff import diff, render
+from superlesson.storage import Slide, Slides
 
 from .step import Step, step
 
 logger = logging.getLogger("superlesson")
 
+_requests = metrics.counter("openai_requests_total", "ChatGPT requests, by result.")
+_tokens = metrics.counter("openai_tokens_total", "Tokens used by ChatGPT requests.")
+
 
 @dataclass
 class Prompt:
@@ -25,16 +30,33 @@ class Replace:
         self._replacements_path = slides.lesson_root / "replacements.txt"
         self.slides = slides
 
+    def inputs(self) -> list[Path | str]:
+        return [self._replacements_path]
+
     @step(Step.replace, Step.merge)
     def bogus_words(self):
+        if not (replacements := self._load_replacements()):
+            return
+        for slide in self.slides:
+            slide.transcription = self._replace(slide.transcription, replacements)
+
+    async def stream(self, slides: AsyncIterable[Slide]) -> AsyncIterator[Slide]:
+        """Replace words in slides as they arrive, like bogus_words does."""
+        replacements = self._load_replacements()
+        async for slide in slides:
+            text = self._replace(slide.transcription, replacements)
+            yield dataclasses.replace(slide, transcription=text)
+
+    def _load_replacements(self) -> list[tuple[re.Pattern, str]]:
         if not self._replacements_path.exists():
             logger.warning(
                 f"{self._replacements_path} doesn't exist, so no replacements will be done"
             )
-            return
+            return []
 
         pattern = re.compile(r'\s*([^"]*[^"\s])')
 
+        replacements = []
         lines = self._replacements_path.read_text().split("\n")
         for line in lines:
             if line.strip() == "":
@@ -46,16 +68,34 @@ class Replace:
             word = cast(re.Match, pattern.search(words[0])).group(1)
             rep = cast(re.Match, pattern.search(words[1])).group(1)
             logger.debug("Replacing %s with %s", word, rep)
-            for slide in self.slides:
-                slide.transcription = re.sub(
-                    r"\b%s\b" % re.escape(word),
-                    rep,
-                    slide.transcription,
-                    flags=re.IGNORECASE,
-                )
+            replacements.append(
+                (re.compile(r"\b%s\b" % re.escape(word), flags=re.IGNORECASE), rep)
+            )
+        return replacements
+
+    @staticmethod
+    def _replace(text: str, replacements: list[tuple[re.Pattern, str]]) -> str:
+        for word, rep in replacements:
+            text = word.sub(rep, text)
+        return text
 
 
 class Improve:
+    _model = "gpt-3.5-turbo-1106"
+    _context = """O texto a seguir precisa ser preparado para impressão.
+        - formate o texto, sem fazer modificações de conteúdo.
+        - corrija qualquer erro de digitação ou de grafia.
+        - faça as quebras de paragrafação que forem necessárias.
+        - coloque as pontuações adequadas.
+        - a saída deve ser somente a resposta, sem frases como
+        - "aqui está o texto revisado e formatado".
+        - NÃO FAÇA NENHUMA MODIFICAÇÃO DE CONTEÚDO, SOMENTE DE FORMATAÇÃO.
+        """
+    # margin = 20  # to avoid errors
+    # GPT-3.5-turbo-1106 takes in at most 16k tokens, but it only outputs 4k tokens, so we use
+    # it as the maximum and ignore margin and context size for now
+    _max_input_tokens = 2**12  # - self._count_tokens(context)) // 2 - margin
+
     def __init__(self, slides: Slides):
         from dotenv import load_dotenv
 
@@ -63,62 +103,107 @@ class Improve:
 
         self.slides = slides
 
+    def inputs(self) -> list[Path | str]:
+        return [self._model, self._context, str(self._max_input_tokens)]
+
     @staticmethod
     def _diff_gpt(before: str, after: str):
-        file1 = Store.temp_save(before)
-        file2 = Store.temp_save(after)
-
-        diff_words(file1, file2)
+        logger.debug(render(diff(before.split(), after.split())))
 
     @step(Step.improve, Step.merge)
     def punctuation(self):
-        context = """O texto a seguir precisa ser preparado para impressão.
-        - formate o texto, sem fazer modificações de conteúdo.
-        - corrija qualquer erro de digitação ou de grafia.
-        - faça as quebras de paragrafação que forem necessárias.
-        - coloque as pontuações adequadas.
-        - a saída deve ser somente a resposta, sem frases como
-        - "aqui está o texto revisado e formatado".
-        - NÃO FAÇA NENHUMA MODIFICAÇÃO DE CONTEÚDO, SOMENTE DE FORMATAÇÃO.
-        """
+        logger.debug(f"Max input tokens: {self._max_input_tokens}")
+
+        texts = asyncio.run(
+            self._improve_all([slide.transcription for slide in self.slides])
+        )
 
-        # margin = 20  # to avoid errors
-        # GPT-3.5-turbo-1106 takes in at most 16k tokens, but it only outputs 4k tokens, so we use
-        # it as the maximum and ignore margin and context size for now
-        max_input_tokens = 2**12  # - self._count_tokens(context)) // 2 - margin
-        logger.debug(f"Max input tokens: {max_input_tokens}")
+        for slide, text in zip(self.slides, texts, strict=True):
+            slide.transcription = text
 
-        logger.debug("Splitting into prompts")
-        prompts = self._split_into_prompts(
-            [slide.transcription for slide in self.slides],
-            max_input_tokens,
+    async def stream(
+        self, slides: AsyncIterable[Slide], concurrency: int = 8
+    ) -> AsyncIterator[Slide]:
+        """Improve slides as they arrive, like punctuation does.
+
+        Args:
+            slides: The slides to improve, in order
+            concurrency: How many slides may be waiting for ChatGPT at once. Slides
+                are yielded in order, so a slow one holds back the ones after it
+        """
+        client = self._openai_client()
+        limiter = ratelimit.limiter("openai")
+        running: asyncio.Queue[tuple[Slide, asyncio.Task] | None] = asyncio.Queue(
+            concurrency
         )
 
-        bench_start = time.time()
+        async def submit():
+            try:
+                async for slide in slides:
+                    task = asyncio.create_task(
+                        self._improve_text(client, limiter, slide.transcription)
+                    )
+                    await running.put((slide, task))
+            finally:
+                await running.put(None)
+
+        submitter = asyncio.create_task(submit())
+        try:
+            while (item := await running.get()) is not None:
+                slide, task = item
+                yield dataclasses.replace(slide, transcription=await task)
+            # raises what went wrong before the slides ended, if anything
+            await submitter
+        finally:
+            submitter.cancel()
+            while not running.empty():
+                if (item := running.get_nowait()) is not None:
+                    item[1].cancel()
+            limiter.close()
+
+    async def _improve_all(self, texts: list[str]) -> list[str]:
+        client = self._openai_client()
+        limiter = ratelimit.limiter("openai")
+        try:
+            return await asyncio.gather(
+                *(self._improve_text(client, limiter, text) for text in texts)
+            )
+        finally:
+            limiter.close()
 
-        completions = asyncio.run(self._complete_with_chatgpt(prompts, context))
+    @classmethod
+    async def _improve_text(
+        cls, client, limiter: ratelimit.RateLimiter, text: str
+    ) -> str:
+        """Improve the text of a slide, prompt by prompt.
 
-        bench_duration = time.time() - bench_start
-        logger.info(f"ChatGPT requests took {bench_duration} to finish")
+        Prompts that ChatGPT didn't complete, or changed too much, are kept as they
+        were.
+        """
+        prompts = cls._split_into_prompts([text], cls._max_input_tokens)
+        completions = await asyncio.gather(
+            *(
+                cls._complete_prompt(client, limiter, prompt.body, cls._context)
+                for prompt in prompts
+            )
+        )
 
-        last_slide = 0
-        improved_transcription = []
+        improved = []
         for prompt, completion in zip(prompts, completions, strict=True):
-            text = prompt.body
-            similarity_ratio = self._calculate_difference(text, completion)
+            if completion is None:
+                improved.append(prompt.body)
+                continue
+            similarity_ratio = cls._calculate_difference(prompt.body, completion)
             # different = 0 < similarity_ratio < 1 = same
             if similarity_ratio < 0.40:
                 logger.info("The text was not improved by ChatGPT-3.5-turbo.")
                 logger.debug(f"Similarity: {similarity_ratio}")
-                logger.debug(f"Diffing GPT output for slide {prompt.slide}")
                 if logger.isEnabledFor(logging.DEBUG):
-                    self._diff_gpt(text, completion)
+                    cls._diff_gpt(prompt.body, completion)
+                improved.append(prompt.body)
                 continue
-            if prompt.slide != last_slide:
-                self.slides[last_slide].transcription = " ".join(improved_transcription)
-                improved_transcription = []
-                last_slide = prompt.slide
-            improved_transcription.append(completion)
+            improved.append(completion)
+        return " ".join(improved)
 
     @staticmethod
     def _count_tokens(text: str) -> int:
@@ -133,6 +218,13 @@ class Improve:
     def _split_into_prompts(
         cls, transcriptions: list[str], max_tokens: int
     ) -> list[Prompt]:
+        with trace.span("tokenize", texts=len(transcriptions)) as span:
+            prompts = cls._split_texts(transcriptions, max_tokens)
+            span.set(prompts=len(prompts))
+        return prompts
+
+    @classmethod
+    def _split_texts(cls, transcriptions: list[str], max_tokens: int) -> list[Prompt]:
         prompts = []
         for i, transcription in enumerate(transcriptions):
             chunks = []
@@ -196,55 +288,58 @@ class Improve:
 
         return merged
 
-    @classmethod
-    async def _complete_with_chatgpt(
-        cls, prompts: list[Prompt], context: str
-    ) -> list[str]:
+    @staticmethod
+    def _openai_client():
         from openai import AsyncOpenAI, OpenAIError
 
         try:
-            client = AsyncOpenAI()
+            return AsyncOpenAI()
         except OpenAIError as e:
             msg = "Please review README.md for instructions on how to set up your OpenAI token"
             raise Exception(msg) from e
 
-        tasks = [
-            asyncio.create_task(cls._complete_prompt(client, prompt.body, context))
-            for prompt in prompts
-        ]
-
-        results = await asyncio.gather(*tasks)
-        completions = []
-        for result in results:
-            if result is None:
-                break
-            cast(str, result)
-            completions.append(result)
-        logger.debug("ChatGPT completed prompt successfully")
-
-        return completions
-
     @classmethod
-    async def _complete_prompt(cls, client, prompt: str, context: str) -> str | None:
+    async def _complete_prompt(
+        cls, client, limiter: ratelimit.RateLimiter, prompt: str, context: str
+    ) -> str | None:
         import openai
 
         messages = [
             {"role": "system", "content": context},
             {"role": "user", "content": prompt},
         ]
+        # the completion is about as long as the prompt, since it's the same text
+        estimate = cls._count_tokens(context) + 2 * cls._count_tokens(prompt)
+        with trace.span("openai quota", tokens=estimate):
+            await limiter.acquire_async(estimate)
         logger.debug("Completing prompt: %s", prompt)
-        try:
-            completion = await client.chat.completions.create(
-                model="gpt-3.5-turbo-1106",
-                # model="gpt-4",
-                messages=messages,
-                n=1,
-                temperature=0.1,
-            )
-            logger.debug("ChatGPT response: %s", completion.choices[0].message.content)
-            return completion.choices[0].message.content
-        except openai.RateLimitError:
-            return None
+        with trace.span("openai request", estimated_tokens=estimate) as span:
+            try:
+                completion = await client.chat.completions.create(
+                    model=cls._model,
+                    # model="gpt-4",
+                    messages=messages,
+                    n=1,
+                    temperature=0.1,
+                )
+            except openai.RateLimitError:
+                span.set(rate_limited=True)
+                _requests.inc(result="rate limited")
+                # rejected requests use no tokens, so others may use them
+                limiter.refund(estimate)
+                return None
+            _requests.inc(result="completed")
+            if (usage := completion.usage) is not None:
+                span.set(
+                    prompt_tokens=usage.prompt_tokens,
+                    completion_tokens=usage.completion_tokens,
+                )
+                _tokens.inc(usage.prompt_tokens, kind="prompt")
+                _tokens.inc(usage.completion_tokens, kind="completion")
+        if usage is not None:
+            limiter.refund(estimate - usage.total_tokens)
+        logger.debug("ChatGPT response: %s", completion.choices[0].message.content)
+        return completion.choices[0].message.content
 
     @staticmethod
     def _calculate_difference(paragraph1, paragraph2):
@@ -1,10 +1,14 @@
 import datetime
 import logging
 import re
-from dataclasses import dataclass
+from bisect import bisect_left
+from collections.abc import AsyncIterable, AsyncIterator
+from dataclasses import dataclass, field
+from itertools import pairwise
 from pathlib import Path
 
-from superlesson.storage import Slides
+from superlesson.storage import Slide, Slides
+from superlesson.storage.slide import TimeFrame
 from superlesson.storage.utils import seconds_to_timestamp
 
 from .step import Step, step
@@ -18,11 +22,29 @@ class TransitionFrame:
     path: Path
 
 
+@dataclass
+class _Pending:
+    """Words that weren't merged into a slide yet, see Merge.stream."""
+
+    words: list[Slide] = field(default_factory=list)
+    # end times of words ending periods
+    references: list[float] = field(default_factory=list)
+    closed_end: float = float("-inf")
+
+    def add(self, word: Slide):
+        self.words.append(word)
+        if Merge._ends_period(word.transcription):
+            self.references.append(word.timeframe.end)
+
+
 class Merge:
     def __init__(self, slides: Slides):
         self._tframes_path = slides.lesson_root / "tframes"
         self.slides = slides
 
+    def inputs(self) -> list[Path | str]:
+        return [self._tframes_path]
+
     @step(Step.merge, Step.transcribe)
     def segments(self):
         if not self._tframes_path.exists():
@@ -30,8 +52,8 @@ class Merge:
             raise FileNotFoundError(msg)
 
         if not (tframes := self._get_transition_frames(self._tframes_path)):
-            logger.warning("No transition frames found, merging all slides")
-            self.slides.merge(0, len(self.slides) - 1)
+            logger.warning("No transition frames found, segmenting by pauses")
+            self._segment_by_pauses()
             return
 
         timestamps = self._improve_transitions([frame.timestamp for frame in tframes])
@@ -65,6 +87,89 @@ class Merge:
 
         self.slides.merge(start, len(self.slides) - 1)
 
+    async def stream(
+        self, words: AsyncIterable[Slide], threshold: float = 3.0
+    ) -> AsyncIterator[Slide]:
+        """Merge words into slides as they arrive, like segments does.
+
+        A slide is yielded as soon as a word ends past its transition time and its
+        threshold, after which neither the word closing it nor its improved
+        transition time can change. Without transition frames, the words are
+        segmented by pauses once they all arrived.
+
+        Args:
+            words: The transcription, in order
+            threshold: How close a period end must be to a transition to replace it
+        """
+        if not self._tframes_path.exists():
+            msg = f"Couldn't find transition frames at {self._tframes_path}"
+            raise FileNotFoundError(msg)
+
+        if not (tframes := self._get_transition_frames(self._tframes_path)):
+            logger.warning("No transition frames found, segmenting by pauses")
+            slides = self._stream_by_pauses(words)
+        else:
+            slides = self._stream_by_tframes(words, tframes, threshold)
+        async for slide in slides:
+            yield slide
+
+    async def _stream_by_tframes(
+        self,
+        words: AsyncIterable[Slide],
+        tframes: list[TransitionFrame],
+        threshold: float,
+    ) -> AsyncIterator[Slide]:
+        pending = _Pending()
+        next_tframe = 0
+        async for word in words:
+            pending.add(word)
+            while (
+                next_tframe < len(tframes)
+                and word.timeframe.end > tframes[next_tframe].timestamp + threshold
+            ):
+                if slide := self._close(pending, tframes[next_tframe], threshold):
+                    yield slide
+                next_tframe += 1
+
+        for tframe in tframes[next_tframe:]:
+            if slide := self._close(pending, tframe, threshold):
+                yield slide
+        if pending.words:
+            yield self._join(pending.words, None)
+
+    async def _stream_by_pauses(
+        self, words: AsyncIterable[Slide]
+    ) -> AsyncIterator[Slide]:
+        async for word in words:
+            self.slides.append(word)
+        self._segment_by_pauses()
+        for slide in self.slides:
+            yield slide
+
+    def _close(
+        self, pending: _Pending, tframe: TransitionFrame, threshold: float
+    ) -> Slide | None:
+        """Merge the pending words up to a transition into its slide, if any."""
+        time = self._improve_transition(tframe.timestamp, pending.references, threshold)
+        end = next(
+            (i for i, word in enumerate(pending.words) if word.timeframe.end >= time),
+            None,
+        )
+        # the words up to the transition already went into the previous slide
+        if pending.closed_end >= time or end is None:
+            logger.warning(f"Skipping tframe {tframe.path}")
+            return None
+        slide = self._join(pending.words[: end + 1], tframe.path)
+        del pending.words[: end + 1]
+        pending.closed_end = slide.timeframe.end
+        return slide
+
+    @staticmethod
+    def _join(words: list[Slide], tframe: Path | None) -> Slide:
+        transcription = " ".join(word.transcription.strip() for word in words)
+        timeframe = TimeFrame(words[0].timeframe.start, words[-1].timeframe.end)
+        return Slide(transcription, timeframe, tframe=tframe)
+
     @staticmethod
     def _get_transition_frames(tframes_dir: Path) -> list[TransitionFrame]:
         def to_timedelta(h, m, s):
@@ -130,12 +235,103 @@ class Merge:
 
         return improved
 
-    def _get_period_end_times(self) -> list[float]:
-        punctuation = [".", "?", "!"]
+    @staticmethod
+    def _improve_transition(
+        time: float, references: list[float], threshold: float
+    ) -> float:
+        """Improve a transition time as _improve_transitions does."""
+        si = bisect_left(references, time, key=lambda ref: ref - threshold)
+        if si < len(references):
+            ref = references[si]
+            if ref - threshold <= time <= ref + threshold:
+                return ref
+        return time
+
+    def _segment_by_pauses(
+        self,
+        min_duration: float = 30.0,
+        max_duration: float = 120.0,
+        min_pause: float = 0.5,
+    ):
+        """Merge words into segments using pauses and punctuation.
+
+        A segment is closed at the first period end followed by a pause of at least
+        `min_pause` seconds once it lasts `min_duration`. If no such boundary shows up
+        before `max_duration`, it is closed at the longest pause seen since
+        `min_duration`, preferring period ends.
+
+        Args:
+            min_duration: The shortest segment, in seconds
+            max_duration: The longest segment, in seconds, unless a single word lasts longer
+            min_pause: The shortest silence that counts as a pause, in seconds
+        """
+        if len(self.slides) < 2:
+            return
+
+        ranges = self._pause_ranges(min_duration, max_duration, min_pause)
+        logger.info(f"Split transcription into {len(ranges)} segments")
+
+        # merging from the end keeps the remaining ranges valid
+        for start, end in reversed(ranges):
+            self.slides.merge(start, end)
+
+    def _pause_ranges(
+        self, min_duration: float, max_duration: float, min_pause: float
+    ) -> list[tuple[int, int]]:
+        starts = [slide.timeframe.start for slide in self.slides]
+        ends = [slide.timeframe.end for slide in self.slides]
+        cuts, scores = self._score_boundaries(min_pause, bonus=max_duration)
 
+        last = len(self.slides) - 1
+
+        def find_end(start: int) -> int:
+            best = None
+            for i in range(start, last):
+                if ends[i] - starts[start] >= min_duration:
+                    if cuts[i]:
+                        return i
+                    if best is None or scores[i] > scores[best]:
+                        best = i
+                if best is not None and ends[i + 1] - starts[start] > max_duration:
+                    return best
+            return last
+
+        ranges = []
+        start = 0
+        while start <= last:
+            end = find_end(start)
+            ranges.append((start, end))
+            start = end + 1
+
+        return ranges
+
+    def _score_boundaries(
+        self, min_pause: float, bonus: float
+    ) -> tuple[list[bool], list[float]]:
+        """Score the boundaries between consecutive words.
+
+        Returns:
+            Whether each boundary is a period end followed by a pause, and how good of a
+            cut it would be otherwise
+        """
+        cuts = []
+        scores = []
+        for current, next in pairwise(self.slides):
+            pause = next.timeframe.start - current.timeframe.end
+            period = self._ends_period(current.transcription)
+            cuts.append(period and pause >= min_pause)
+            # a period end always beats a pause without one
+            scores.append(pause + (bonus if period else 0))
+        return cuts, scores
+
+    @staticmethod
+    def _ends_period(text: str) -> bool:
+        return text.rstrip()[-1:] in (".", "?", "!")
+
+    def _get_period_end_times(self) -> list[float]:
         period_end_times = []
         for slide in self.slides:
-            if slide.transcription[-1] in punctuation:
+            if self._ends_period(slide.transcription):
                 period_end_times.append(slide.timeframe.end)
 
         logger.debug(
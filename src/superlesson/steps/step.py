@@ -8,9 +8,6 @@ from enum import Enum, unique
 logger = logging.getLogger("superlesson")
 
 
-RAN_STEP = False
-
-
 @dataclass
 class StepMetadata:
     name: str
@@ -37,23 +34,77 @@ class Step(Enum):
         return steps.index(self) < steps.index(other)
 
 
-def step(step: Step, depends_on: Step | None = None):
+@dataclass
+class Registration:
+    depends_on: Step | None
+    interactive: bool
+
+
+# every step defined with the step decorator
+registry: dict[Step, Registration] = {}
+
+
+def dependencies(step: Step) -> list[Step]:
+    """Registered steps whose data the step may load, see Slides.load."""
+    depends_on = registry[step].depends_on
+    if depends_on is None:
+        return []
+    return [s for s in Step if s in registry and not s < depends_on and s < step]
+
+
+def step(
+    step: Step,
+    depends_on: Step | None = None,
+    journal: bool = False,
+    interactive: bool = False,
+):
+    """Run a step only if its inputs changed since it last ran.
+
+    The decorated method's instance must have `slides` and an `inputs` method, listing
+    the files and parameters the step uses. It may also have an `outputs` method,
+    listing files the step writes other than its data.
+
+    Steps with a journal persist each change made through `Slides.merge` and
+    `Slides.update` as it happens, and start off with the changes from any run that
+    was interrupted.
+
+    Interactive steps need someone at the terminal, so pipelines run them last.
+    """
+    registry[step] = Registration(depends_on, interactive)
+
     def decorator(func: Callable):
         def wrapper(instance, *args, **kwargs):
+            from superlesson import metrics, trace
             from superlesson.storage import Slides
 
-            # HACK: to preserve behavior from Loaded.already_ran, we have to track if
-            # any step has already been run
-            global RAN_STEP
-
             slides = instance.slides
             assert isinstance(slides, Slides)
-            if not RAN_STEP and slides.load(step, depends_on) is step:
-                return None
-            logger.info(f"Running step {step.value}")
-            ret = func(instance, *args, **kwargs)
-            instance.slides.save(step)
-            RAN_STEP = True
+            runs = metrics.counter(
+                "step_runs_total", "Steps run, skipped since up to date, or failed."
+            )
+            with trace.span(step.name) as span:
+                upstream = slides.load(step, depends_on)
+                inputs = instance.inputs()
+                fingerprint = slides.fingerprint(step, upstream, inputs)
+                outputs = instance.outputs() if hasattr(instance, "outputs") else []
+                if slides.is_up_to_date(step, fingerprint, outputs):
+                    logger.info(f'"{step.value.name}" is up to date, skipping')
+                    span.set(skipped=True)
+                    runs.inc(step=step.name, result="skipped")
+                    return None
+                logger.info(f"Running step {step.value}")
+                if journal and slides.start_journal(step, fingerprint):
+                    logger.info(f'Resuming "{step.value.name}"')
+                try:
+                    ret = func(instance, *args, **kwargs)
+                except BaseException:
+                    runs.inc(step=step.name, result="failed")
+                    raise
+                slides.save(step)
+                slides.save_fingerprint(step, fingerprint)
+                span.set(skipped=False, slides=len(slides))
+                runs.inc(step=step.name, result="ran")
+            logger.info(f'"{step.value.name}" took {span.duration:.1f}s')
             return ret
 
         return wrapper
@@ -1,18 +1,36 @@
+import asyncio
 import logging
 import os
+import re
+import threading
 import time
+from collections.abc import AsyncIterator
 from dataclasses import dataclass
+from datetime import datetime, timedelta
 from hashlib import sha256
 from pathlib import Path
 
+from superlesson import metrics, ratelimit, trace
 from superlesson.storage import Slide, Slides
 from superlesson.storage.slide import TimeFrame
-from superlesson.storage.utils import extract_audio
+from superlesson.storage.utils import extract_audio, scratch_dir, split_audio
 
 from .step import Step, step
 
 logger = logging.getLogger("superlesson")
 
+_uploads = metrics.counter(
+    "s3_uploads_total", "Audio files uploaded to S3, or found there already."
+)
+_uploaded_bytes = metrics.counter("s3_uploaded_bytes_total", "Bytes uploaded to S3.")
+_upload_seconds = metrics.histogram(
+    "s3_upload_seconds", "Time spent uploading files that weren't in S3 yet."
+)
+_replicate_seconds = metrics.histogram(
+    "replicate_seconds",
+    "Time predictions spent queued on Replicate, and running once started.",
+)
+
 
 @dataclass
 class Segment:
@@ -29,68 +47,165 @@ class Prompt:
 
 class Transcribe:
     _bucket_name = "lesson-audios"
-
-    def __init__(self, slides: Slides, video: Path):
+    _model = "isinyaaa/whisperx:f2f27406afdd5f2bd8aab728e9c50eec8378dcf67381b42009051a156d83ddba"
+    _options = {
+        "language": "pt",
+        "batch_size": 13,
+        "align_output": True,
+    }
+
+    def __init__(self, slides: Slides, video: Path, chunk_seconds: float | None = None):
+        """Transcribe a lesson's video.
+
+        Args:
+            slides: Where the words are kept
+            video: The lesson's video
+            chunk_seconds: How long each chunk transcribed by stream is. It isn't
+                part of the step's inputs, so lessons transcribed either way aren't
+                transcribed again by the other
+        """
         from dotenv import load_dotenv
 
         load_dotenv()
 
         self._video = video
+        self._chunk_seconds = chunk_seconds
         self.slides = slides
 
+    def inputs(self) -> list[Path | str]:
+        return [self._video, self._model, repr(sorted(self._options.items()))]
+
     @step(Step.transcribe)
     def single_file(self):
-        bench_start = time.time()
+        with scratch_dir() as scratch:
+            audio = extract_audio(self._video, scratch / "audio.wav")
+            s3_url = self._upload_file_to_s3(audio)
 
-        s3_url = self._upload_file_to_s3(extract_audio(self._video))
-
-        bench_duration = time.time() - bench_start
-        logger.info(f"Took {bench_duration} to upload to S3")
-
-        if not os.getenv("REPLICATE_API_TOKEN"):
-            msg = "See README.md for instructions on how to set up your environment to run superlesson."
-            raise Exception(msg)
+        self._check_token()
 
         for segment in self._transcribe_with_replicate(s3_url):
             self.slides.append(
                 Slide(segment.text, TimeFrame(segment.start, segment.end))
             )
 
-        bench_duration = time.time() - bench_start
-        logger.info(f"Transcription took {bench_duration} to finish")
+    async def stream(self) -> AsyncIterator[Slide]:
+        """Transcribe the video in chunks, yielding each word once its chunk is done.
+
+        Chunks are transcribed concurrently, but words are yielded in order. The words
+        aren't added to slides, nor saved. Once the stream is closed, e.g. since a
+        later step failed, chunks that didn't start aren't transcribed.
+        """
+        assert self._chunk_seconds is not None, "Pass chunk_seconds to stream"
+        self._check_token()
+        closing = threading.Event()
+
+        def transcribe(path: Path) -> list[Segment]:
+            # threads can't be cancelled, so chunks waiting for one check instead
+            if closing.is_set():
+                return []
+            return self._transcribe_file(path)
+
+        with scratch_dir() as scratch:
+            audio = await asyncio.to_thread(
+                extract_audio, self._video, scratch / "audio.wav"
+            )
+            chunks = await asyncio.to_thread(
+                split_audio, audio, scratch, self._chunk_seconds
+            )
+            tasks = [
+                asyncio.create_task(asyncio.to_thread(transcribe, path))
+                for path, _ in chunks
+            ]
+            try:
+                for (_, offset), task in zip(chunks, tasks, strict=True):
+                    for segment in await task:
+                        yield Slide(
+                            segment.text,
+                            TimeFrame(segment.start + offset, segment.end + offset),
+                        )
+            finally:
+                closing.set()
+                # chunks being transcribed are still read from the scratch directory
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    def _check_token():
+        if not os.getenv("REPLICATE_API_TOKEN"):
+            msg = "See README.md for instructions on how to set up your environment to run superlesson."
+            raise Exception(msg)
+
+    @classmethod
+    def _transcribe_file(cls, path: Path) -> list[Segment]:
+        return cls._transcribe_with_replicate(cls._upload_file_to_s3(path))
 
     @classmethod
     def _transcribe_with_replicate(cls, url: str) -> list[Segment]:
         import replicate
+        from replicate.exceptions import ModelError
 
+        limiter = ratelimit.limiter("replicate")
+        with trace.span("replicate quota"):
+            limiter.acquire()
+        limiter.close()
         logger.info("Running replicate")
-        output = replicate.run(
-            "isinyaaa/whisperx:f2f27406afdd5f2bd8aab728e9c50eec8378dcf67381b42009051a156d83ddba",
-            input={
-                "audio": url,
-                "language": "pt",
-                "batch_size": 13,
-                "align_output": True,
-            },
-        )
-        logger.info("Replicate finished")
-        assert isinstance(output, dict), "Expected a dict"
-        segments = []
-        for segment in output["word_segments"]:
-            if "start" in segment:
-                segments.append(
-                    Segment(segment["word"], segment["start"], segment["end"])
-                )
-            elif len(segments) != 0:
-                segments[-1].text += " " + segment["word"]
+        with trace.span("replicate") as span:
+            # rather than replicate.run, to know how long the prediction was queued
+            prediction = replicate.predictions.create(
+                version=cls._model.split(":")[1],
+                input={
+                    "audio": url,
+                    **cls._options,
+                },
+            )
+            prediction.wait()
+            if prediction.status == "failed":
+                raise ModelError(prediction.error)
+            logger.info("Replicate finished")
+            cls._observe_prediction(prediction)
+            output = prediction.output
+            assert isinstance(output, dict), "Expected a dict"
+            segments = []
+            for segment in output["word_segments"]:
+                if "start" in segment:
+                    segments.append(
+                        Segment(segment["word"], segment["start"], segment["end"])
+                    )
+                elif len(segments) != 0:
+                    segments[-1].text += " " + segment["word"]
+            span.set(words=len(segments))
         return segments
 
+    @staticmethod
+    def _observe_prediction(prediction):
+        def parse(timestamp: str | None) -> datetime | None:
+            if timestamp is None:
+                return None
+            # fromisoformat only takes Z, and other than 3 or 6 decimals, from 3.11 on
+            match = re.match(r"([^.Z+]+)(\.\d+)?", timestamp)
+            if match is None:
+                return None
+            seconds = float(match.group(2) or 0)
+            return datetime.fromisoformat(match.group(1)) + timedelta(seconds=seconds)
+
+        created = parse(prediction.created_at)
+        started = parse(prediction.started_at)
+        if created is not None and started is not None:
+            _replicate_seconds.observe(
+                (started - created).total_seconds(), phase="queued"
+            )
+        if (predict_time := (prediction.metrics or {}).get("predict_time")) is not None:
+            _replicate_seconds.observe(predict_time, phase="running")
+
     @classmethod
     def _upload_file_to_s3(cls, path: Path) -> str:
         import boto3
+        from botocore.config import Config
         from botocore.exceptions import ClientError
 
-        s3 = boto3.client("s3")
+        # e.g. a stand-in, see superlesson.standins. Older botocore doesn't read it
+        endpoint = os.getenv("AWS_ENDPOINT_URL_S3")
+        config = Config(s3={"addressing_style": "path"}) if endpoint else None
+        s3 = boto3.client("s3", endpoint_url=endpoint, config=config)
 
         # TODO: we should salt it to improve privacy
         # ideally, we should also encrypt the data, or figure out a way to
@@ -99,17 +214,28 @@ class Transcribe:
             data = file.read()
             s3_name = sha256(data).hexdigest()
 
-        s3_path = f"https://{cls._bucket_name}.s3.amazonaws.com/{s3_name}"
-
-        try:
-            s3.head_object(Bucket=cls._bucket_name, Key=s3_name)
-            return s3_path
-        except ClientError:
-            pass
-
-        logger.info(f"Uploading file {file} to S3")
-
-        s3.upload_file(path, cls._bucket_name, s3_name)
+        if endpoint:
+            s3_path = f"{endpoint.rstrip('/')}/{cls._bucket_name}/{s3_name}"
+        else:
+            s3_path = f"https://{cls._bucket_name}.s3.amazonaws.com/{s3_name}"
+
+        with trace.span("s3 upload", bytes=len(data)) as span:
+            try:
+                s3.head_object(Bucket=cls._bucket_name, Key=s3_name)
+                span.set(uploaded=False)
+                _uploads.inc(result="found")
+                return s3_path
+            except ClientError:
+                pass
+
+            logger.info(f"Uploading file {file} to S3")
+
+            start = time.perf_counter()
+            s3.upload_file(path, cls._bucket_name, s3_name)
+            _upload_seconds.observe(time.perf_counter() - start)
+            _uploaded_bytes.inc(len(data))
+            _uploads.inc(result="uploaded")
+            span.set(uploaded=True)
 
         logger.info(f"{file} uploaded to S3 as {s3_name}")
         return s3_path
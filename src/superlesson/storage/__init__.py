@@ -1,7 +1,13 @@
+from .cache import Cache
+from .library import Library
 from .slide import Slide, Slides
 
 __all__ = [
     # slide classes
     "Slide",
     "Slides",
+    # caching
+    "Cache",
+    # lessons in a database
+    "Library",
 ]
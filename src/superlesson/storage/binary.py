@@ -0,0 +1,180 @@
+"""Columnar binary format for step data.
+
+The layout, in little-endian order, is:
+
+- header: magic, version and number of slides
+- timeframe starts and ends, as float64 columns
+- slide numbers, as an int32 column
+- transcription and tframe offsets, as uint64 columns
+- transcriptions and tframes, as UTF-8 blobs
+
+Columns are 8-byte aligned, so they can be read straight out of a memory map.
+"""
+
+import mmap
+import struct
+import sys
+from array import array
+from collections.abc import Iterable, Iterator, Sequence
+from pathlib import Path
+from typing import Any
+
+MAGIC = b"SLST"
+VERSION = 1
+
+_header = struct.Struct("<4sHxxQ")
+# there's no None in an int32 column
+_no_number = -(2**31)
+
+
+class FormatError(ValueError):
+    """Raised when a file isn't in the expected binary format."""
+
+
+def _pad(size: int) -> int:
+    return -size % 8
+
+
+def _column(typecode: str, values: list) -> bytes:
+    column = array(typecode, values)
+    if sys.byteorder != "little":
+        column.byteswap()
+    data = column.tobytes()
+    return data + bytes(_pad(len(data)))
+
+
+def _texts(values: list[bytes]) -> tuple[bytes, bytes]:
+    offsets = [0]
+    for value in values:
+        offsets.append(offsets[-1] + len(value))
+    return _column("Q", offsets), b"".join(values)
+
+
+def dumps(data: Iterable[dict[str, Any]]) -> bytes:
+    """Serialize slide dicts, as returned by Slide.to_dict."""
+    starts, ends, numbers = [], [], []
+    texts, tframes = [], []
+    for obj in data:
+        starts.append(obj["timeframe"]["start"])
+        ends.append(obj["timeframe"]["end"])
+        numbers.append(_no_number if (n := obj["number"]) is None else n)
+        texts.append(obj["transcription"].encode("utf-8"))
+        tframe = obj.get("tframe")
+        tframes.append(b"" if tframe in (None, "None") else tframe.encode("utf-8"))
+
+    text_offsets, text_blob = _texts(texts)
+    tframe_offsets, tframe_blob = _texts(tframes)
+    return b"".join(
+        [
+            _header.pack(MAGIC, VERSION, len(starts)),
+            _column("d", starts),
+            _column("d", ends),
+            _column("i", numbers),
+            text_offsets,
+            tframe_offsets,
+            text_blob,
+            tframe_blob,
+        ]
+    )
+
+
+class SlideTable(Sequence[dict[str, Any]]):
+    """Read-only view over slides in the binary format.
+
+    Slides are only decoded when accessed.
+    """
+
+    def __init__(self, buffer: bytes | mmap.mmap):
+        view = memoryview(buffer)
+        if len(view) < _header.size:
+            msg = "File is too short to be a slide table"
+            raise FormatError(msg)
+        magic, version, count = _header.unpack_from(view)
+        if magic != MAGIC:
+            msg = f"Invalid magic number: {magic!r}"
+            raise FormatError(msg)
+        if version != VERSION:
+            msg = f"Unsupported version: {version}"
+            raise FormatError(msg)
+
+        self._buffer = buffer
+        self._count = count
+        offset = _header.size
+
+        def take(typecode: str, length: int) -> Sequence:
+            nonlocal offset
+            size = length * array(typecode).itemsize
+            column = view[offset : offset + size]
+            offset += size + _pad(size)
+            if sys.byteorder == "little":
+                return column.cast(typecode)
+            swapped = array(typecode, column.tobytes())
+            swapped.byteswap()
+            return swapped
+
+        self._starts = take("d", count)
+        self._ends = take("d", count)
+        self._numbers = take("i", count)
+        self._text_offsets = take("Q", count + 1)
+        self._tframe_offsets = take("Q", count + 1)
+        self._texts = view[offset : offset + self._text_offsets[-1]]
+        offset += self._text_offsets[-1]
+        self._tframes = view[offset : offset + self._tframe_offsets[-1]]
+        if len(self._tframes) != self._tframe_offsets[-1]:
+            msg = "File is truncated"
+            raise FormatError(msg)
+
+    @classmethod
+    def open(cls, path: Path) -> "SlideTable":
+        """Memory map a file in the binary format."""
+        with path.open("rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def transcription(self, index: int) -> str:
+        start, end = self._text_offsets[index], self._text_offsets[index + 1]
+        return str(self._texts[start:end], "utf-8")
+
+    def tframe(self, index: int) -> str | None:
+        start, end = self._tframe_offsets[index], self._tframe_offsets[index + 1]
+        return str(self._tframes[start:end], "utf-8") or None
+
+    def number(self, index: int) -> int | None:
+        number = self._numbers[index]
+        return None if number == _no_number else number
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        texts, tframes = self._texts, self._tframes
+        text_offsets, tframe_offsets = self._text_offsets, self._tframe_offsets
+        for i, (start, end, number) in enumerate(
+            zip(self._starts, self._ends, self._numbers, strict=True)
+        ):
+            tframe = tframes[tframe_offsets[i] : tframe_offsets[i + 1]]
+            yield {
+                "transcription": str(
+                    texts[text_offsets[i] : text_offsets[i + 1]], "utf-8"
+                ),
+                "timeframe": {"start": start, "end": end},
+                "tframe": str(tframe, "utf-8") or None,
+                "number": None if number == _no_number else number,
+            }
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            msg = "Slide index out of range"
+            raise IndexError(msg)
+        return {
+            "transcription": self.transcription(index),
+            "timeframe": {
+                "start": self._starts[index],
+                "end": self._ends[index],
+            },
+            "tframe": self.tframe(index),
+            "number": self.number(index),
+        }
@@ -0,0 +1,46 @@
+import logging
+from collections.abc import Iterable
+from pathlib import Path
+
+from .utils import digest
+
+logger = logging.getLogger("superlesson")
+
+
+class Cache:
+    """Content-addressed blobs kept in the lesson's data directory."""
+
+    def __init__(self, root: Path, name: str):
+        self._path = root / ".data" / name
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        return digest(*parts)
+
+    def _get_path(self, key: str) -> Path:
+        return self._path / key
+
+    def __contains__(self, key: str) -> bool:
+        return self._get_path(key).exists()
+
+    def get(self, key: str) -> bytes | None:
+        path = self._get_path(key)
+        if not path.exists():
+            return None
+        return path.read_bytes()
+
+    def put(self, key: str, data: bytes):
+        if not self._path.exists():
+            self._path.mkdir(parents=True)
+        self._get_path(key).write_bytes(data)
+
+    def prune(self, keep: Iterable[str]):
+        """Remove every entry that isn't in keep."""
+        if not self._path.exists():
+            return
+
+        keep = set(keep)
+        for path in self._path.iterdir():
+            if path.name not in keep:
+                logger.debug(f"Removing {path} from cache")
+                path.unlink()
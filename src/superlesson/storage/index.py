@@ -0,0 +1,268 @@
+"""Inverted index for searching what was said across lessons.
+
+Postings are kept in a SQLite database, with one row per term and lesson. A row holds
+the times (in milliseconds) and slide numbers at which the term was said, sorted by
+time and delta encoded as varints, so most postings take two or three bytes.
+
+Word times come from the transcription. Words that only appear in the improved text,
+e.g. fixed spellings, get times interpolated over their slide's timeframe. Slide
+numbers come from the manual revision or the enumerated slides, 0 meaning unknown.
+"""
+
+import logging
+import re
+import sqlite3
+import unicodedata
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from collections.abc import Iterable, Iterator, Sequence
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from superlesson.steps.step import Step
+
+from .library import Library, LibraryStore
+from .store import Store
+from .utils import digest
+
+logger = logging.getLogger("superlesson")
+
+_schema = """
+CREATE TABLE IF NOT EXISTS lessons (
+    id INTEGER PRIMARY KEY,
+    root TEXT NOT NULL UNIQUE,
+    signature TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    lesson INTEGER NOT NULL REFERENCES lessons (id) ON DELETE CASCADE,
+    data BLOB NOT NULL,
+    PRIMARY KEY (term, lesson)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_lesson ON postings (lesson);
+"""
+
+_sources = (Step.transcribe, Step.improve, Step.enumerate, Step.manual)
+
+_word = re.compile(r"\w+")
+# combining diacritical marks, left over after decomposing accented letters
+_marks = dict.fromkeys(range(0x300, 0x370))
+
+Posting = tuple[int, int]
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into terms, ignoring case and accents."""
+    return _word.findall(
+        unicodedata.normalize("NFKD", text.casefold()).translate(_marks)
+    )
+
+
+def _varint(value: int, out: bytearray):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode(postings: Iterable[Posting]) -> bytes:
+    """Delta encode (time, slide) postings, sorted by time."""
+    out = bytearray()
+    previous_time = previous_slide = 0
+    for time, slide in postings:
+        _varint(time - previous_time, out)
+        delta = slide - previous_slide
+        # zigzag, slides may go back
+        _varint(delta << 1 if delta >= 0 else (-delta << 1) - 1, out)
+        previous_time, previous_slide = time, slide
+    return bytes(out)
+
+
+def decode(data: bytes) -> Iterator[Posting]:
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+
+    time = slide = 0
+    for time_delta, slide_delta in zip(values[::2], values[1::2], strict=True):
+        time += time_delta
+        slide += (slide_delta >> 1) ^ -(slide_delta & 1)
+        yield time, slide
+
+
+@dataclass
+class SearchHit:
+    lesson: Path
+    slide: int | None
+    # in milliseconds
+    time: int
+
+
+def _load(store: Store, step: Step) -> Sequence[dict[str, Any]]:
+    assert step.value.filename is not None
+    return store.load(step.value.filename, load_txt=step > Step.enumerate) or []
+
+
+class _SlideNumbers:
+    def __init__(self, store: Store):
+        self._starts: list[float] = []
+        self._numbers: list[int] = []
+        for step in (Step.manual, Step.enumerate):
+            if not (data := _load(store, step)):
+                continue
+            for obj in data:
+                number = obj["number"]
+                self._starts.append(obj["timeframe"]["start"])
+                self._numbers.append(number + 1 if number is not None else 0)
+            break
+
+    def at(self, seconds: float) -> int:
+        i = bisect_right(self._starts, seconds) - 1
+        return self._numbers[i] if i >= 0 else 0
+
+
+def _lesson_postings(store: Store) -> dict[str, list[Posting]]:
+    slides = _SlideNumbers(store)
+    postings: defaultdict[str, set[Posting]] = defaultdict(set)
+
+    for obj in _load(store, Step.transcribe):
+        start = obj["timeframe"]["start"]
+        for term in tokenize(obj["transcription"]):
+            postings[term].add((round(start * 1000), slides.at(start)))
+
+    said = set(postings)
+    for obj in _load(store, Step.improve):
+        terms = tokenize(obj["transcription"])
+        start, end = obj["timeframe"]["start"], obj["timeframe"]["end"]
+        for i, term in enumerate(terms):
+            if term in said:
+                continue
+            seconds = start + (end - start) * i / len(terms)
+            postings[term].add((round(seconds * 1000), slides.at(seconds)))
+
+    return {term: sorted(found) for term, found in postings.items()}
+
+
+def _near(times: Sequence[int], time: int, window: int) -> bool:
+    i = bisect_left(times, time - window)
+    return i < len(times) and times[i] <= time + window
+
+
+class SearchIndex:
+    """Persistent inverted index over the lessons in a library."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=30)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA foreign_keys = ON")
+        self._connection.executescript(_schema)
+
+    def close(self):
+        self._connection.close()
+
+    @staticmethod
+    def _signature(store: Store) -> str:
+        parts = []
+        for step in _sources:
+            assert step.value.filename is not None
+            load_txt = step > Step.enumerate
+            parts.append(store.describe(step.value.filename, load_txt) or "")
+        return digest(*parts)
+
+    def update(self, roots: Iterable[Path], library: Library | None = None) -> int:
+        """Index lessons whose data changed, and forget lessons that aren't in roots.
+
+        Args:
+            roots: The lessons to index
+            library: Where lessons with data in it keep their steps, see LibraryStore
+
+        Returns:
+            The number of lessons that were indexed
+        """
+        indexed = self._connection.execute("SELECT root, signature FROM lessons")
+        signatures = dict(indexed.fetchall())
+        in_library = set(library.roots()) if library is not None else set()
+        seen = set()
+        count = 0
+        for root in roots:
+            key = str(root.resolve())
+            seen.add(key)
+            if library is not None and Path(key) in in_library:
+                store = LibraryStore(root, library)
+            else:
+                store = Store(root)
+            if signatures.get(key) == (signature := self._signature(store)):
+                continue
+            logger.info(f"Indexing {root}")
+            self._index(key, signature, _lesson_postings(store))
+            count += 1
+
+        with self._connection as connection:
+            connection.executemany(
+                "DELETE FROM lessons WHERE root = ?",
+                [(key,) for key in signatures.keys() - seen],
+            )
+        return count
+
+    def _index(self, key: str, signature: str, postings: dict[str, list[Posting]]):
+        with self._connection as connection:
+            connection.execute(
+                "INSERT INTO lessons (root, signature) VALUES (?, ?)"
+                " ON CONFLICT (root) DO UPDATE SET signature = excluded.signature",
+                (key, signature),
+            )
+            (lesson,) = connection.execute(
+                "SELECT id FROM lessons WHERE root = ?", (key,)
+            ).fetchone()
+            connection.execute("DELETE FROM postings WHERE lesson = ?", (lesson,))
+            connection.executemany(
+                "INSERT INTO postings (term, lesson, data) VALUES (?, ?, ?)",
+                ((term, lesson, encode(found)) for term, found in postings.items()),
+            )
+
+    def _postings(self, term: str) -> dict[int, bytes]:
+        rows = self._connection.execute(
+            "SELECT lesson, data FROM postings WHERE term = ?", (term,)
+        )
+        return dict(rows.fetchall())
+
+    def search(
+        self, query: str, window: float = 10, limit: int | None = None
+    ) -> list[SearchHit]:
+        """Find where every term in the query was said within window seconds.
+
+        Hits are given at the times of the query's rarest term, sorted by lesson and
+        time. Only postings of lessons that may still be in the first limit hits are
+        decoded.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        by_term = sorted(
+            (self._postings(term) for term in terms),
+            key=lambda found: sum(map(len, found.values())),
+        )
+        rarest, others = by_term[0], by_term[1:]
+        roots = dict(self._connection.execute("SELECT id, root FROM lessons"))
+        lessons = rarest.keys() & set.intersection(set(roots), *others)
+        window_ms = round(window * 1000)
+
+        hits: list[SearchHit] = []
+        for lesson in sorted(lessons, key=roots.__getitem__):
+            if limit is not None and len(hits) >= limit:
+                break
+            times = [[time for time, _ in decode(found[lesson])] for found in others]
+            hits += [
+                SearchHit(Path(roots[lesson]), slide or None, time)
+                for time, slide in decode(rarest[lesson])
+                if all(_near(other, time, window_ms) for other in times)
+            ]
+        return hits[:limit]
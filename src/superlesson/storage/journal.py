@@ -0,0 +1,124 @@
+import json
+import logging
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Any, BinaryIO
+
+from . import binary
+from .binary import SlideTable
+from .utils import write_atomic
+
+logger = logging.getLogger("superlesson")
+
+
+class Journal:
+    """Append-only log of changes made to slides while a step runs.
+
+    Changes are appended as JSON lines as soon as they're made, so that a step that's
+    interrupted can pick up where it stopped. Once the log grows past `compact_after`
+    changes, it's replaced by a snapshot of the slides.
+
+    The first line of the log holds the fingerprint of the step, and which snapshot the
+    changes apply to, if any. Logs from a different fingerprint are discarded.
+    """
+
+    compact_after = 500
+
+    def __init__(self, path: Path, fingerprint: str):
+        self._path = path
+        self._log_path = path.with_name(f"{path.name}.journal")
+        self._fingerprint = fingerprint
+        self._changes = 0
+        self._generation = 0
+
+    def _get_snapshot_path(self, generation: int) -> Path:
+        return self._path.with_name(f"{self._path.name}.journal.{generation}.bin")
+
+    def load(self) -> tuple[SlideTable | None, list[dict[str, Any]]]:
+        """Load the snapshot and the changes made after it.
+
+        Returns:
+            The snapshot, if any, and the changes logged after it
+        """
+        if not self._log_path.exists():
+            return None, []
+
+        with self._log_path.open("rb+") as f:
+            try:
+                header = json.loads(f.readline() or "{}")
+            except ValueError:
+                # cut short by a crash while starting the log
+                header = {}
+            outdated = header.get("fingerprint") != self._fingerprint
+            if not outdated:
+                changes = self._read_changes(f)
+
+        self._generation = header.get("snapshot", 0)
+        if outdated:
+            logger.info(f"Discarding outdated journal {self._log_path}")
+            # changes from now on are logged under the current fingerprint
+            self.discard()
+            self._start(generation=0)
+            return None, []
+
+        snapshot = None
+        if self._generation:
+            snapshot = SlideTable.open(self._get_snapshot_path(self._generation))
+        logger.info(f"Loaded {len(changes)} changes from {self._log_path}")
+        self._changes = len(changes)
+        return snapshot, changes
+
+    def _read_changes(self, f: BinaryIO) -> list[dict[str, Any]]:
+        """Read the changes after the header, dropping any cut short by a crash."""
+        changes = []
+        end = f.tell()
+        for line in f:
+            try:
+                # a line without its newline was cut short too
+                if not line.endswith(b"\n"):
+                    raise ValueError
+                changes.append(json.loads(line))
+            except ValueError:
+                # the last change may have been cut short by a crash. Changes are
+                # appended after it, so it's dropped
+                logger.warning(f"Ignoring corrupt change in {self._log_path}")
+                f.truncate(end)
+                break
+            end += len(line)
+        return changes
+
+    def _start(self, generation: int):
+        header = {"fingerprint": self._fingerprint, "snapshot": generation}
+        write_atomic(self._log_path, json.dumps(header) + "\n")
+        self._generation = generation
+        self._changes = 0
+
+    def append(self, change: dict[str, Any]) -> bool:
+        """Log a change.
+
+        Returns:
+            Whether the log should be compacted
+        """
+        if not self._log_path.exists():
+            self._start(generation=0)
+
+        with self._log_path.open("a") as f:
+            f.write(json.dumps(change) + "\n")
+        self._changes += 1
+        return self._changes >= self.compact_after
+
+    def compact(self, data: Iterable[dict[str, Any]]):
+        """Replace the log with a snapshot of the slides."""
+        logger.debug(f"Compacting {self._log_path}")
+        previous = self._generation
+        # changes in the current log apply to the previous snapshot, so it has to be
+        # kept until the log is replaced
+        write_atomic(self._get_snapshot_path(previous + 1), binary.dumps(data))
+        self._start(generation=previous + 1)
+        if previous:
+            self._get_snapshot_path(previous).unlink(missing_ok=True)
+
+    def discard(self):
+        self._log_path.unlink(missing_ok=True)
+        if self._generation:
+            self._get_snapshot_path(self._generation).unlink(missing_ok=True)
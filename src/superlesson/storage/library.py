@@ -0,0 +1,326 @@
+"""SQLite database holding the step data of many lessons.
+
+Lessons, their step data and fingerprints are kept in a single database, so questions
+about the whole library don't need to open every lesson's data directory. The database
+is in WAL mode, so it can be read while a lesson is being processed.
+"""
+
+import json
+import logging
+import sqlite3
+from collections.abc import Iterable, Iterator, Sequence
+from dataclasses import dataclass
+from hashlib import sha256
+from pathlib import Path
+from typing import Any
+
+from . import binary
+from .store import Format, Store
+from .utils import describe_path
+
+logger = logging.getLogger("superlesson")
+
+_schema = """
+CREATE TABLE IF NOT EXISTS lessons (
+    id INTEGER PRIMARY KEY,
+    root TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS steps (
+    lesson INTEGER NOT NULL REFERENCES lessons (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (lesson, name)
+);
+CREATE INDEX IF NOT EXISTS steps_name ON steps (name);
+CREATE TABLE IF NOT EXISTS fingerprints (
+    lesson INTEGER NOT NULL REFERENCES lessons (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    PRIMARY KEY (lesson, name)
+);
+CREATE TABLE IF NOT EXISTS slides (
+    id INTEGER PRIMARY KEY,
+    lesson INTEGER NOT NULL,
+    step TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    number INTEGER,
+    start_time REAL NOT NULL,
+    end_time REAL NOT NULL,
+    tframe TEXT,
+    transcription TEXT NOT NULL,
+    FOREIGN KEY (lesson, step) REFERENCES steps (lesson, name) ON DELETE CASCADE
+);
+CREATE UNIQUE INDEX IF NOT EXISTS slides_position ON slides (lesson, step, position);
+CREATE INDEX IF NOT EXISTS slides_number ON slides (lesson, step, number);
+CREATE VIRTUAL TABLE IF NOT EXISTS slides_fts USING fts5 (
+    transcription, content='slides', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS slides_insert AFTER INSERT ON slides BEGIN
+    INSERT INTO slides_fts (rowid, transcription)
+    VALUES (new.id, new.transcription);
+END;
+CREATE TRIGGER IF NOT EXISTS slides_delete AFTER DELETE ON slides BEGIN
+    INSERT INTO slides_fts (slides_fts, rowid, transcription)
+    VALUES ('delete', old.id, old.transcription);
+END;
+"""
+
+
+def _to_dict(row: tuple) -> dict[str, Any]:
+    transcription, start, end, tframe, number = row
+    return {
+        "transcription": transcription,
+        "timeframe": {"start": start, "end": end},
+        "tframe": tframe,
+        "number": number,
+    }
+
+
+@dataclass
+class Hit:
+    lesson: Path
+    step: str
+    number: int | None
+    start: float
+    end: float
+    snippet: str
+
+
+class Library:
+    """Step data of every lesson, in a SQLite database."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=30)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA foreign_keys = ON")
+        self._connection.executescript(_schema)
+
+    def close(self):
+        self._connection.close()
+
+    def lesson_id(self, root: Path) -> int:
+        key = str(root.resolve())
+        with self._connection as connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO lessons (root) VALUES (?)", (key,)
+            )
+            (lesson,) = connection.execute(
+                "SELECT id FROM lessons WHERE root = ?", (key,)
+            ).fetchone()
+        return lesson
+
+    def load(self, lesson: int, name: str) -> Sequence[dict[str, Any]] | None:
+        row = self._connection.execute(
+            "SELECT count FROM steps WHERE lesson = ? AND name = ?", (lesson, name)
+        ).fetchone()
+        if row is None:
+            return None
+        return StepRows(self._connection, lesson, name, row[0])
+
+    def digest(self, lesson: int, name: str) -> str | None:
+        row = self._connection.execute(
+            "SELECT digest FROM steps WHERE lesson = ? AND name = ?", (lesson, name)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def save(self, lesson: int, name: str, data: Iterable[dict[str, Any]]) -> str:
+        """Replace the data of a step, returning its digest."""
+        # data may be read from the rows being replaced
+        data = list(data)
+        digest = sha256(binary.dumps(data)).hexdigest()
+        rows = [
+            (
+                lesson,
+                name,
+                position,
+                obj["number"],
+                obj["timeframe"]["start"],
+                obj["timeframe"]["end"],
+                None if obj.get("tframe") in (None, "None") else obj["tframe"],
+                obj["transcription"],
+            )
+            for position, obj in enumerate(data)
+        ]
+        with self._connection as connection:
+            connection.execute(
+                "DELETE FROM steps WHERE lesson = ? AND name = ?", (lesson, name)
+            )
+            connection.execute(
+                "INSERT INTO steps (lesson, name, digest, count) VALUES (?, ?, ?, ?)",
+                (lesson, name, digest, len(rows)),
+            )
+            connection.executemany(
+                "INSERT INTO slides (lesson, step, position, number, start_time,"
+                " end_time, tframe, transcription) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        return digest
+
+    def load_fingerprint(self, lesson: int, name: str) -> str | None:
+        row = self._connection.execute(
+            "SELECT fingerprint FROM fingerprints WHERE lesson = ? AND name = ?",
+            (lesson, name),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def save_fingerprint(self, lesson: int, name: str, fingerprint: str):
+        with self._connection as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO fingerprints (lesson, name, fingerprint)"
+                " VALUES (?, ?, ?)",
+                (lesson, name, fingerprint),
+            )
+
+    def import_lesson(self, root: Path, filenames: Iterable[str]) -> list[str]:
+        """Copy a lesson's data directory into the library.
+
+        Args:
+            root: The lesson's root
+            filenames: Names of the steps' data files
+
+        Returns:
+            The names of the steps that were imported
+        """
+        store = Store(root)
+        lesson = self.lesson_id(root)
+        imported = []
+        for filename in filenames:
+            data = store.load(filename, load_txt=False)
+            if data is None:
+                continue
+            logger.info(f"Importing {filename} from {root}")
+            self.save(lesson, filename, data)
+            imported.append(filename)
+
+        path = root / ".data" / "fingerprints.json"
+        if path.exists():
+            for name, fingerprint in json.loads(path.read_text()).items():
+                self.save_fingerprint(lesson, name, fingerprint)
+        return imported
+
+    def roots(self) -> list[Path]:
+        """Lessons that have data for any step."""
+        rows = self._connection.execute(
+            "SELECT root FROM lessons WHERE id IN (SELECT lesson FROM steps)"
+            " ORDER BY root"
+        )
+        return [Path(root) for (root,) in rows]
+
+    def lessons_without(self, name: str) -> list[Path]:
+        """Lessons that have no data for a step."""
+        rows = self._connection.execute(
+            "SELECT root FROM lessons WHERE id NOT IN"
+            " (SELECT lesson FROM steps WHERE name = ?) ORDER BY root",
+            (name,),
+        )
+        return [Path(root) for (root,) in rows]
+
+    def duration(self, name: str) -> float:
+        """Total seconds covered by a step's data, across every lesson."""
+        (total,) = self._connection.execute(
+            "SELECT coalesce(sum(length), 0) FROM"
+            " (SELECT max(end_time) AS length FROM slides WHERE step = ?"
+            " GROUP BY lesson)",
+            (name,),
+        ).fetchone()
+        return total
+
+    def search(self, query: str, name: str | None = None, limit: int = 50) -> list[Hit]:
+        """Find slides whose transcription matches a FTS5 query."""
+        rows = self._connection.execute(
+            "SELECT lessons.root, slides.step, slides.number, slides.start_time,"
+            " slides.end_time, snippet(slides_fts, 0, '[', ']', '...', 12)"
+            " FROM slides_fts"
+            " JOIN slides ON slides.id = slides_fts.rowid"
+            " JOIN lessons ON lessons.id = slides.lesson"
+            " WHERE slides_fts MATCH ? AND (? IS NULL OR slides.step = ?)"
+            " ORDER BY rank LIMIT ?",
+            (query, name, name, limit),
+        )
+        return [Hit(Path(root), *rest) for root, *rest in rows]
+
+
+class StepRows(Sequence[dict[str, Any]]):
+    """Slides of a step in the library, only read when accessed."""
+
+    def __init__(
+        self, connection: sqlite3.Connection, lesson: int, name: str, count: int
+    ):
+        self._connection = connection
+        self._lesson = lesson
+        self._name = name
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        rows = self._connection.execute(
+            "SELECT transcription, start_time, end_time, tframe, number FROM slides"
+            " WHERE lesson = ? AND step = ? ORDER BY position",
+            (self._lesson, self._name),
+        )
+        return map(_to_dict, rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            msg = "Slide index out of range"
+            raise IndexError(msg)
+        row = self._connection.execute(
+            "SELECT transcription, start_time, end_time, tframe, number FROM slides"
+            " WHERE lesson = ? AND step = ? AND position = ?",
+            (self._lesson, self._name, index),
+        ).fetchone()
+        return _to_dict(row)
+
+
+class LibraryStore(Store):
+    """Store that keeps step data and fingerprints in a library.
+
+    The editable .txt exports, JSON exports and journals are still files in the
+    lesson's directory.
+    """
+
+    def __init__(self, root: Path, library: Library, export_json: bool = False):
+        super().__init__(root, export_json)
+        self._library = library
+        self._lesson = library.lesson_id(root)
+
+    def _txt(self, filename: str, load_txt: bool) -> Path | None:
+        path = self._get_storage_path(filename, Format.txt)
+        return path if load_txt and path.exists() else None
+
+    def load(self, filename: str, load_txt: bool) -> Sequence[Any] | None:
+        if self._txt(filename, load_txt) is not None:
+            return super().load(filename, load_txt)
+        logger.info(f"Loading {filename} from {self._library.path}")
+        return self._library.load(self._lesson, filename)
+
+    def digest(self, filename: str, load_txt: bool) -> str | None:
+        if (path := self._txt(filename, load_txt)) is not None:
+            return sha256(path.read_bytes()).hexdigest()
+        return self._library.digest(self._lesson, filename)
+
+    def describe(self, filename: str, load_txt: bool) -> str | None:
+        if (path := self._txt(filename, load_txt)) is not None:
+            return describe_path(path)
+        return self._library.digest(self._lesson, filename)
+
+    def load_fingerprint(self, name: str) -> str | None:
+        return self._library.load_fingerprint(self._lesson, name)
+
+    def save_fingerprint(self, name: str, fingerprint: str):
+        self._library.save_fingerprint(self._lesson, name, fingerprint)
+
+    def save(self, filename: str, data: Iterable[dict[str, Any]]):
+        logger.info(f"Saving {filename} to {self._library.path}")
+        self._library.save(self._lesson, filename, data)
+
+        if self._export_json:
+            self.save_json(filename, list(self._library.load(self._lesson, filename)))
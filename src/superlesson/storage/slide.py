@@ -1,14 +1,18 @@
 import logging
 from collections import UserList
-from collections.abc import Sequence
+from collections.abc import Callable, Iterator, MutableSequence, Sequence
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any
+from typing import Any, overload
 
+from superlesson.collection import Manifest
 from superlesson.steps.step import Step
 
+from . import txt, utils
+from .journal import Journal
+from .library import Library, LibraryStore
 from .store import Store
-from .utils import seconds_to_timestamp
+from .utils import describe_path, seconds_to_timestamp
 
 logger = logging.getLogger("superlesson")
 
@@ -43,15 +47,8 @@ class Slide:
         }
 
     def __str__(self):
-        if self.number is None:
-            number = "##"
-        elif self.number == -1:
-            number = "hidden"
-        else:
-            number = self.number + 1
-        return (
-            f"====== SLIDE {number} ({self.timeframe}) ======\n\n{self.transcription}"
-        )
+        start, end = self.timeframe.start, self.timeframe.end
+        return f"{txt.header(self.number, start, end)}\n\n{self.transcription}"
 
 
 @dataclass
@@ -60,15 +57,174 @@ class Page:
     number: int
 
 
+class SlideView(MutableSequence[Slide]):
+    """Slides that are only decoded from step data when accessed.
+
+    Slides accessed through the sequence interface are kept in memory, so they can be
+    modified in place. Slides that are never accessed, or that are only read through
+    stream, are never kept in memory.
+    """
+
+    def __init__(
+        self,
+        source: Sequence[dict[str, Any]],
+        decode: Callable[[dict[str, Any]], Slide],
+    ):
+        self._source = source
+        self._decode = decode
+        # slides that were accessed, by their index in source
+        self._decoded: dict[int, Slide] = {}
+        # source indexes or slides, only tracked once slides are added or removed
+        self._items: list[int | Slide] | None = None
+
+    def _materialize(self) -> list[int | Slide]:
+        if self._items is None:
+            self._items = [self._decoded.get(i, i) for i in range(len(self._source))]
+            self._decoded = {}
+        return self._items
+
+    def _get(self, index: int, keep: bool) -> Slide:
+        ref = index if self._items is None else self._items[index]
+        if isinstance(ref, Slide):
+            return ref
+        if (slide := self._decoded.get(ref)) is not None:
+            return slide
+
+        slide = self._decode(self._source[ref])
+        if keep:
+            if self._items is None:
+                self._decoded[ref] = slide
+            else:
+                self._items[index] = slide
+        return slide
+
+    def _normalize(self, index: int) -> int:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            msg = "Slide index out of range"
+            raise IndexError(msg)
+        return index
+
+    def __len__(self) -> int:
+        if self._items is None:
+            return len(self._source)
+        return len(self._items)
+
+    @overload
+    def __getitem__(self, index: int) -> Slide:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[Slide]:
+        ...
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self._get(self._normalize(index), keep=True)
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            self._materialize()[index] = list(value)
+        else:
+            self._materialize()[self._normalize(index)] = value
+
+    def __delitem__(self, index):
+        del self._materialize()[index]
+
+    def insert(self, index: int, value: Slide):
+        self._materialize().insert(index, value)
+
+    def stream(self) -> Iterator[Slide]:
+        """Iterate over slides without keeping them in memory.
+
+        Changes to slides that weren't accessed before won't be saved.
+        """
+        for i in range(len(self)):
+            yield self._get(i, keep=False)
+
+
 class Slides(UserList):
-    def __init__(self, lesson_root: Path, always_export_txt: bool = False):
+    data: SlideView
+
+    def __init__(
+        self,
+        lesson_root: Path,
+        always_export_txt: bool = False,
+        export_json: bool = False,
+        force: bool = False,
+        library: Library | None = None,
+    ):
         super().__init__()
+        self.data = SlideView([], self._load_slide)
         self.lesson_root = lesson_root
-        self._store = Store(lesson_root)
+        if library is None:
+            self._store = Store(lesson_root, export_json)
+        else:
+            self._store = LibraryStore(lesson_root, library, export_json)
         self._step_in_memory = None
         self._always_export_txt = always_export_txt
+        self._force = force
+        self._journal: Journal | None = None
+
+    def empty(self) -> "Slides":
+        """Slides of the same lesson, kept in the same place, but without data."""
+        slides = Slides.__new__(Slides)
+        slides.__dict__.update(self.__dict__)
+        slides.data = SlideView([], self._load_slide)
+        slides._step_in_memory = None
+        slides._journal = None
+        return slides
 
     def merge(self, start: int, end: int):
+        self._merge(start, end)
+        self._log({"op": "merge", "start": start, "end": end})
+
+    def update(self, index: int, **fields: Any):
+        """Change fields of a slide, logging the change if there's a journal."""
+        slide = self.data[index]
+        for field, value in fields.items():
+            setattr(slide, field, value)
+        self._log({"op": "update", "slide": index, "fields": fields})
+
+    def start_journal(self, step: Step, fingerprint: str) -> bool:
+        """Log every change made through merge and update until the step is saved.
+
+        If a previous run of the same step was interrupted, its changes are applied.
+
+        Args:
+            step: The step that is running
+            fingerprint: The step's fingerprint, changes logged with a different one
+                are discarded
+
+        Returns:
+            Whether changes from a previous run were applied
+        """
+        meta = step.value
+        assert meta.filename is not None
+        self._journal = self._store.journal(meta.filename, fingerprint)
+        snapshot, changes = self._journal.load()
+        if snapshot is not None:
+            self._load_slides(snapshot)
+        for change in changes:
+            self._apply(change)
+        return snapshot is not None or len(changes) != 0
+
+    def _apply(self, change: dict[str, Any]):
+        match change["op"]:
+            case "merge":
+                self._merge(change["start"], change["end"])
+            case "update":
+                slide = self.data[change["slide"]]
+                for field, value in change["fields"].items():
+                    setattr(slide, field, value)
+
+    def _log(self, change: dict[str, Any]):
+        if self._journal is not None and self._journal.append(change):
+            self._journal.compact(slide.to_dict() for slide in self.stream())
+
+    def _merge(self, start: int, end: int):
         if len(self.data) == 0:
             msg = "No slides to merge"
             raise ValueError(msg)
@@ -94,15 +250,22 @@ class Slides(UserList):
             tframe=self.data[start].tframe,
             number=self.data[start].number,
         )
-        self.data = self.data[:start] + [new_slide] + self.data[end + 1 :]
+        self.data[start : end + 1] = [new_slide]
 
     def has_data(self) -> bool:
         return len(self.data) != 0
 
+    def __iter__(self) -> Iterator[Slide]:
+        return iter(self.data)
+
+    def stream(self) -> Iterator[Slide]:
+        """Read slides one at a time, without keeping them in memory."""
+        return self.data.stream()
+
     def as_pages(self) -> Sequence[Page]:
         return [
             Page(slide.transcription, number)
-            for slide in self.data
+            for slide in self.stream()
             if (number := slide.number) and number > 0
         ]
 
@@ -121,18 +284,14 @@ class Slides(UserList):
             number=slide_obj["number"],
         )
 
-    def _load_slides(self, data: list[Any], verbose: bool = False):
-        slides: list[Slide] = []
-        for obj in data:
-            slide = self._load_slide(obj)
-            # HACK: loading from transcribe will show too many segments so let's just skip those
-            if verbose:
+    def _load_slides(self, data: Sequence[Any], verbose: bool = False):
+        self.data = SlideView(data, self._load_slide)
+        # HACK: loading from transcribe will show too many segments so let's just skip those
+        if verbose and logger.isEnabledFor(logging.DEBUG):
+            for slide in self.stream():
                 logger.debug("Loaded slide: %s", repr(slide))
-            slides.append(slide)
-
-        if not verbose:
+        else:
             logger.debug("Loaded raw transcription")
-        self.data = slides
 
     def load_step(self, step: Step) -> bool:
         meta = step.value
@@ -183,19 +342,14 @@ class Slides(UserList):
         return None
 
     def load(self, step: Step, depends_on: Step | None = None) -> Step | None:
-        """Load data.
+        """Load the data a step depends on.
 
-        Checks for data from the current step, if found, it prompts the user if they want to run
-        run again or skip.
-
-        Note that running again will discard previous data, including that from subsequent steps
-        that run.
-
-        If data from the current step is not found, it tries to load from previous steps.
+        Looks for data from the steps before the current one, down to depends_on.
 
         Args:
-            step: The step to load
-            depends_on: The step to stop loading at. Defaults to None.
+            step: The step to load data for
+            depends_on: The earliest step whose data can be used. Defaults to None, for
+                steps that don't depend on any other.
 
         Returns:
             The step that was loaded
@@ -203,18 +357,6 @@ class Slides(UserList):
         Raises:
             Exception: If the step depends on another step that has not been run yet.
         """
-        if step.value.in_storage() and self.load_step(step):
-            if (
-                input(
-                    f'"{step.value.name}" has already been run. Run again? [y/N] '
-                ).lower()
-                != "y"
-            ):
-                return step
-
-            if depends_on is None:
-                return None
-
         if depends_on is None:
             return None
 
@@ -226,23 +368,101 @@ class Slides(UserList):
         msg = f'Step "{step.value.name}" depends on "{depends_on.value.name}", but "{depends_on.value.name}" has not been run yet.'
         raise Exception(msg)
 
-    def save_temp_txt(self) -> Path:
-        return self._store.temp_save(
-            "\n".join([str(slide) + "\n" for slide in self.data])
+    def fingerprint(
+        self, step: Step, upstream: Step | None, inputs: Sequence[Path | str]
+    ) -> str:
+        """Fingerprint everything a step's output depends on.
+
+        Args:
+            step: The step to fingerprint
+            upstream: The step whose data was loaded for it, if any
+            inputs: Files the step reads, and parameters it uses. Files in the lesson
+                folder are described by the hash of their contents, kept in the
+                lesson's manifest, and others by their size and mtime
+
+        Returns:
+            A hash of the upstream data, and of the inputs
+        """
+        parts = [step.name]
+        if upstream is not None:
+            meta = upstream.value
+            assert meta.filename is not None
+            digest = self._store.digest(
+                meta.filename, load_txt=upstream > Step.enumerate
+            )
+            parts += [upstream.name, digest or ""]
+        manifest = None
+        for input in inputs:
+            if not isinstance(input, Path):
+                parts.append(input)
+                continue
+            if input.resolve().parent == self.lesson_root.resolve():
+                manifest = manifest or Manifest(self.lesson_root).refresh()
+                if input.name in manifest.entries:
+                    parts.append(f"{input.name}: {manifest.hash(input.name)}")
+                    continue
+            parts.append(describe_path(input))
+        return utils.digest(*parts)
+
+    def is_up_to_date(
+        self, step: Step, fingerprint: str, outputs: Sequence[Path] = ()
+    ) -> bool:
+        """Check whether a step already ran with the same fingerprint.
+
+        If it did, its data is loaded, so that following steps can use it.
+
+        Args:
+            step: The step to check
+            fingerprint: The step's current fingerprint
+            outputs: Files the step writes, other than its data
+
+        Returns:
+            Whether the step can be skipped
+        """
+        if self._force:
+            return False
+        saved = self._store.load_fingerprint(step.name)
+        if saved is None and self._ran_before_fingerprints(step, outputs):
+            logger.info(f'"{step.value.name}" ran before, keeping its data')
+            self.save_fingerprint(step, fingerprint)
+            return True
+        if saved != fingerprint:
+            logger.debug(f'Inputs for "{step.value.name}" changed')
+            return False
+        if not all(output.exists() for output in outputs):
+            return False
+        return not step.value.in_storage() or self.load_step(step)
+
+    def _ran_before_fingerprints(self, step: Step, outputs: Sequence[Path]) -> bool:
+        """Whether a step's data was saved by a version that didn't fingerprint steps.
+
+        Running those steps again could mean paying for transcription or ChatGPT, or
+        enumerating slides by hand again, so their data is taken as up to date.
+        """
+        return (
+            step.value.in_storage()
+            and all(output.exists() for output in outputs)
+            and self.load_step(step)
         )
 
+    def save_fingerprint(self, step: Step, fingerprint: str):
+        self._store.save_fingerprint(step.name, fingerprint)
+
     def save(self, step: Step):
         self._step_in_memory = step
         meta = step.value
         if meta.in_storage():
             assert meta.filename is not None
-            self._store.save_json(
-                meta.filename, [slide.to_dict() for slide in self.data]
+            self._store.save(
+                meta.filename, (slide.to_dict() for slide in self.stream())
             )
+            # changes are safe in the step's data now
+            if self._journal is not None:
+                self._journal.discard()
+                self._journal = None
             if step is Step.transcribe:
                 return
             if self._always_export_txt or step is Step.improve:
                 self._store.save_txt(
-                    meta.filename,
-                    "\n".join([str(slide) + "\n" for slide in self.data]),
+                    meta.filename, (slide.to_dict() for slide in self.stream())
                 )
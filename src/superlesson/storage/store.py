@@ -1,62 +1,58 @@
 import json as json_lib
 import logging
-import re
-from datetime import time
+from collections.abc import Iterable, Sequence
 from enum import Enum, unique
+from functools import lru_cache
+from hashlib import sha256
 from pathlib import Path
 from typing import Any
 
-from .utils import mktemp
+from . import binary, txt
+from .binary import SlideTable
+from .journal import Journal
+from .utils import describe_path, file_version, open_atomic, write_atomic
 
 logger = logging.getLogger("superlesson")
 
 
 @unique
 class Format(Enum):
+    binary = "bin"
     json = "json"
     txt = "txt"
 
 
+@lru_cache(maxsize=16)
+def _parse(
+    path: Path, version: tuple[int, ...], format: Format
+) -> Sequence[dict[str, Any]]:
+    """Parse a text step file, again only once it changes, see file_version.
+
+    Loaded step data is only read, see SlideView, so loads share it, e.g. those of the
+    commands sl serve runs one after another.
+    """
+    if format is Format.txt:
+        return tuple(Store._parse_txt(path))
+    return tuple(Store._parse_json(path))
+
+
 class Store:
-    def __init__(self, root: Path):
+    def __init__(self, root: Path, export_json: bool = False):
         self._root = root
         self._data_path = root / ".data"
+        self._export_json = export_json
 
     def _get_storage_path(self, filename: str, format: Format) -> Path:
-        if format is Format.json:
-            if not self._data_path.exists():
-                self._data_path.mkdir()
-            return self._data_path / f"{filename}.json"
-        return self._root / f"{filename}.txt"
+        if format is Format.txt:
+            return self._root / f"{filename}.txt"
+        if not self._data_path.exists():
+            self._data_path.mkdir()
+        return self._data_path / f"{filename}.{format.value}"
 
     @staticmethod
     def _parse_txt(txt_path: Path) -> list[dict[str, Any]]:
-        raw_slides = re.split(
-            r"====== SLIDE (\S*) \((\S*) - (\S*)\) ======", txt_path.read_text()
-        )
-
-        def timestamp_to_seconds(timestamp: str) -> float:
-            if len(timestamp.split(":")[0]) == 1:
-                timestamp = "0" + timestamp
-            t = time.fromisoformat(timestamp)
-            return (t.hour * 60 + t.minute) * 60 + t.second + t.microsecond / 1e6
-
-        def parse_to_int(value):
-            if "0" < value[0] < "9":
-                return int(value)
-            return None
-
-        return [
-            {
-                "number": parse_to_int(raw_slides[i]),
-                "timeframe": {
-                    "start": timestamp_to_seconds(raw_slides[i + 1]),
-                    "end": timestamp_to_seconds(raw_slides[i + 2]),
-                },
-                "transcription": raw_slides[i + 3],
-            }
-            for i in range(1, len(raw_slides), 4)
-        ]
+        with txt_path.open(encoding="utf-8") as f:
+            return list(txt.load(f, str(txt_path)))
 
     @staticmethod
     def _parse_json(json_path: Path) -> list[dict[str, Any]]:
@@ -70,40 +66,83 @@ class Store:
 
         return data
 
-    def load(self, filename: str, load_txt: bool) -> list[Any] | None:
-        if load_txt:
-            if (txt_path := self._get_storage_path(filename, Format.txt)).exists():
-                logger.info(f"Loading {txt_path}")
-                return self._parse_txt(txt_path)
+    def _locate(self, filename: str, load_txt: bool) -> tuple[Path, Format] | None:
+        txt_path = self._get_storage_path(filename, Format.txt)
+        if load_txt and txt_path.exists():
+            return txt_path, Format.txt
 
-            logger.info(
-                f"Couldn't load from file {txt_path}, make sure it's properly formatted"
-            )
-
-        json_path = self._get_storage_path(filename, Format.json)
-        if json_path.exists():
-            logger.info(f"Loading {json_path}")
-            return self._parse_json(json_path)
+        # JSON is only used by lessons processed before the binary format was introduced
+        for format in (Format.binary, Format.json):
+            if (path := self._get_storage_path(filename, format)).exists():
+                return path, format
 
         return None
 
-    @staticmethod
-    def temp_save(txt_data: Any) -> Path:
-        with (temp_path := mktemp(suffix=".txt")).open("w") as temp_file:
-            temp_path = Path(temp_file.name)
-            logger.debug(f"Saving temp file to {temp_file.name}")
-            temp_file.write(txt_data)
+    def load(self, filename: str, load_txt: bool) -> Sequence[Any] | None:
+        if (located := self._locate(filename, load_txt)) is None:
+            return None
 
-        return temp_path
+        path, format = located
+        logger.info(f"Loading {path}")
+        if format is Format.binary:
+            return SlideTable.open(path)
+        return _parse(path, file_version(path), format)
+
+    def digest(self, filename: str, load_txt: bool) -> str | None:
+        """Hash the contents of the file that load would read."""
+        if (located := self._locate(filename, load_txt)) is None:
+            return None
+
+        path, _ = located
+        return sha256(path.read_bytes()).hexdigest()
+
+    def describe(self, filename: str, load_txt: bool) -> str | None:
+        """Cheaply describe the file that load would read, see describe_path."""
+        if (located := self._locate(filename, load_txt)) is None:
+            return None
+
+        path, _ = located
+        return describe_path(path)
+
+    def _load_fingerprints(self) -> dict[str, str]:
+        path = self._data_path / "fingerprints.json"
+        if not path.exists():
+            return {}
+        return json_lib.loads(path.read_text())
+
+    def load_fingerprint(self, name: str) -> str | None:
+        return self._load_fingerprints().get(name)
+
+    def save_fingerprint(self, name: str, fingerprint: str):
+        fingerprints = self._load_fingerprints()
+        fingerprints[name] = fingerprint
+        path = self._data_path / "fingerprints.json"
+        if not self._data_path.exists():
+            self._data_path.mkdir()
+        logger.debug(f"Saving fingerprint for {name}")
+        write_atomic(path, json_lib.dumps(fingerprints, indent=2))
+
+    def save(self, filename: str, data: Iterable[dict[str, Any]]):
+        path = self._get_storage_path(filename, Format.binary)
+        logger.info(f"Saving {path}")
+        # previous data may still be memory mapped, so we can't truncate it
+        write_atomic(path, binary.dumps(data))
+
+        if self._export_json:
+            self.save_json(filename, list(SlideTable.open(path)))
 
     def save_json(self, filename: str, data: Any):
         path = self._get_storage_path(filename, Format.json)
         logger.info(f"Saving {path}")
-        with open(str(path), "w") as f:
-            json_lib.dump(data, f)
+        write_atomic(path, json_lib.dumps(data))
 
-    def save_txt(self, filename: str, data: Any):
+    def save_txt(self, filename: str, data: Iterable[dict[str, Any]]):
         path = self._get_storage_path(filename, Format.txt)
         logger.info(f"Saving {path}")
-        with open(str(path), "w") as f:
-            f.write(data)
+        with open_atomic(path) as f:
+            txt.dump(data, f)
+
+    def journal(self, filename: str, fingerprint: str) -> Journal:
+        if not self._data_path.exists():
+            self._data_path.mkdir()
+        return Journal(self._data_path / filename, fingerprint)
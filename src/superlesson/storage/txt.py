@@ -0,0 +1,217 @@
+"""Human-editable text format for step data.
+
+Each slide starts with a header line, followed by a blank line and its transcription:
+
+    ====== SLIDE 3 (0:01:02.500 - 0:01:40) ======
+
+    transcription
+
+Slides are separated by a blank line. The slide number is shown starting from 1, and
+may also be "hidden" (-1) or "##" (no number).
+
+Files are read and written one line at a time, so they're never held in memory as a
+whole.
+"""
+
+from collections.abc import Iterable, Iterator
+from typing import Any, TextIO
+
+from .utils import seconds_to_timestamp
+
+_prefix = "====== SLIDE "
+_suffix = " ======"
+
+
+class ParseError(ValueError):
+    """Raised when a text file isn't properly formatted.
+
+    Attributes:
+        line: 1-based line number of the error.
+        column: 1-based column number of the error.
+    """
+
+    def __init__(self, message: str, line: int, column: int, name: str = "<text>"):
+        super().__init__(f"{name}:{line}:{column}: {message}")
+        self.line = line
+        self.column = column
+
+
+def header(number: int | None, start: float, end: float) -> str:
+    if number is None:
+        shown = "##"
+    elif number == -1:
+        shown = "hidden"
+    else:
+        shown = str(number + 1)
+    start_ts = seconds_to_timestamp(start)
+    end_ts = seconds_to_timestamp(end)
+    return f"{_prefix}{shown} ({start_ts} - {end_ts}){_suffix}"
+
+
+def dump(data: Iterable[dict[str, Any]], f: TextIO):
+    """Write slide dicts, as returned by Slide.to_dict."""
+    for i, obj in enumerate(data):
+        if i:
+            f.write("\n")
+        timeframe = obj["timeframe"]
+        f.write(header(obj["number"], timeframe["start"], timeframe["end"]))
+        f.write("\n\n")
+        f.write(obj["transcription"])
+        f.write("\n")
+
+
+def parse_timestamp(timestamp: str) -> float:
+    """Parse a [D day[s], ]H:MM:SS[.ffffff] timestamp into seconds.
+
+    This is the inverse of seconds_to_timestamp.
+
+    Raises:
+        ValueError: If the timestamp is malformed, with the offending offset as the
+            second argument.
+    """
+    hours, _, rest = timestamp.partition(":")
+    minutes, _, seconds = rest.partition(":")
+    whole, dot, fraction = seconds.partition(".")
+    # fast path for well-formed timestamps under a day
+    if (
+        timestamp.isascii()
+        and len(minutes) == len(whole) == 2
+        and minutes < "60"
+        and whole < "60"
+        and hours.isdigit()
+        and minutes.isdigit()
+        and whole.isdigit()
+        and (not dot or fraction.isdigit())
+    ):
+        total = int(hours) * 3600 + int(minutes) * 60 + int(whole)
+        return total + int(fraction) / 10 ** len(fraction) if dot else total
+    return _parse_timestamp_checked(timestamp)
+
+
+def _parse_timestamp_checked(timestamp: str) -> float:
+    days, comma, clock = timestamp.rpartition(", ")
+    fields = clock.split(":")
+    if len(fields) != 3:
+        msg = "Expected a timestamp like H:MM:SS.mmm"
+        raise ValueError(msg, 0)
+    hours, minutes, seconds = fields
+    whole, dot, fraction = seconds.partition(".")
+
+    total = 0.0
+    offset = 0
+    if comma:
+        count, _, unit = days.partition(" ")
+        if unit not in ("day", "days") or not count.isascii() or not count.isdigit():
+            msg = f"Expected a number of days, got {days!r}"
+            raise ValueError(msg, 0)
+        total += int(count) * 86400
+        offset += len(days) + len(comma)
+
+    for field, limit, scale in (
+        (hours, None, 3600),
+        (minutes, 60, 60),
+        (whole, 60, 1),
+    ):
+        if not field.isascii() or not field.isdigit():
+            msg = f"Invalid number {field!r} in timestamp"
+            raise ValueError(msg, offset)
+        value = int(field)
+        if limit is not None and (len(field) != 2 or value >= limit):
+            msg = f"Expected two digits below {limit}, got {field!r}"
+            raise ValueError(msg, offset)
+        total += value * scale
+        offset += len(field) + 1
+
+    if dot:
+        if not fraction.isascii() or not fraction.isdigit():
+            msg = f"Invalid fraction {fraction!r} in timestamp"
+            raise ValueError(msg, offset)
+        total += int(fraction) / 10 ** len(fraction)
+    return total
+
+
+def _parse_number(shown: str) -> int | None:
+    match shown:
+        case "##":
+            return None
+        case "hidden":
+            return -1
+    if not shown.isascii() or not shown.isdigit() or int(shown) < 1:
+        msg = f"Expected a slide number, 'hidden' or '##', got {shown!r}"
+        raise ValueError(msg, 0)
+    return int(shown) - 1
+
+
+def _parse_header(line: str, lineno: int, name: str) -> tuple[int | None, dict]:
+    if not line.startswith(_prefix):
+        msg = f"Expected a header starting with {_prefix.strip()!r}"
+        raise ParseError(msg, lineno, 1, name)
+    if not line.endswith(_suffix):
+        msg = f"Expected the header to end with {_suffix.strip()!r}"
+        raise ParseError(msg, lineno, max(len(line) - len(_suffix), 0) + 1, name)
+
+    column = len(_prefix)
+    body = line[column : len(line) - len(_suffix)]
+    shown, space, timeframe = body.partition(" ")
+    try:
+        number = _parse_number(shown)
+    except ValueError as e:
+        raise ParseError(e.args[0], lineno, column + 1, name) from None
+
+    column += len(shown) + len(space)
+    if not (timeframe.startswith("(") and timeframe.endswith(")")):
+        msg = "Expected a timeframe like (start - end)"
+        raise ParseError(msg, lineno, column + 1, name)
+    start, separator, end = timeframe[1:-1].partition(" - ")
+    if not separator:
+        msg = "Expected ' - ' between start and end"
+        start = start.partition(" ")[0]
+        raise ParseError(msg, lineno, column + 2 + len(start), name)
+
+    timestamps = {}
+    column += 1
+    for key, timestamp in (("start", start), ("end", end)):
+        try:
+            timestamps[key] = parse_timestamp(timestamp)
+        except ValueError as e:
+            raise ParseError(e.args[0], lineno, column + 1 + e.args[1], name) from None
+        column += len(timestamp) + len(separator)
+    return number, timestamps
+
+
+def load(f: Iterable[str], name: str = "<text>") -> Iterator[dict[str, Any]]:
+    """Parse slide dicts, one slide at a time.
+
+    Args:
+        f: Lines of the file, e.g. an open text file.
+        name: Name used in error messages, usually the file path.
+
+    Raises:
+        ParseError: If the file isn't properly formatted. Nothing is yielded after
+            an error, but slides before it may already have been.
+    """
+    current: dict[str, Any] | None = None
+    lines: list[str] = []
+
+    def finish(obj: dict[str, Any]) -> dict[str, Any]:
+        # the blank lines around transcriptions are part of the format
+        obj["transcription"] = "".join(lines).strip("\r\n")
+        lines.clear()
+        return obj
+
+    for lineno, line in enumerate(f, 1):
+        if not line.startswith("======"):
+            if current is None and line.strip():
+                msg = "Expected a slide header before any text"
+                raise ParseError(msg, lineno, 1, name)
+            lines.append(line)
+            continue
+
+        number, timeframe = _parse_header(line.rstrip("\r\n"), lineno, name)
+        if current is not None:
+            yield finish(current)
+        current = {"number": number, "timeframe": timeframe, "tframe": None}
+        lines.clear()
+
+    if current is not None:
+        yield finish(current)
@@ -1,8 +1,16 @@
 import logging
+import os
 import subprocess
 import tempfile
+import wave
+from collections.abc import Iterator
+from contextlib import contextmanager
 from datetime import timedelta
+from hashlib import sha256
 from pathlib import Path
+from typing import IO
+
+from superlesson import trace
 
 logger = logging.getLogger("superlesson")
 
@@ -14,63 +22,140 @@ def seconds_to_timestamp(s: float) -> str:
     return timestamp
 
 
-def diff_words(before: Path, after: Path):
-    start_red = r"$'\033[30;41m'"
-    start_green = r"$'\033[30;42m'"
-    reset = r"$'\033[0m'"
-
-    subprocess.run(
-        " ".join(
-            [
-                "wdiff",
-                "-n",
-                "-w",
-                start_red,
-                "-x",
-                reset,
-                "-y",
-                start_green,
-                "-z",
-                reset,
-                str(before),
-                str(after),
-            ],
-        ),
-        shell=True,
-    )
+@contextmanager
+def open_atomic(path: Path, mode: str = "w") -> Iterator[IO]:
+    """Open a file for writing, so that it's never left partially written.
+
+    The data is written to a temporary file next to path, which is then renamed over
+    it once the block exits without errors. Readers that already opened (or memory
+    mapped) the previous file keep seeing its old contents.
+    """
+    temp_path = path.with_name(f".{path.name}.tmp")
+    encoding = None if "b" in mode else "utf-8"
+    try:
+        with temp_path.open(mode, encoding=encoding) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    temp_path.replace(path)
+
+
+def write_atomic(path: Path, data: bytes | str):
+    """Replace a file with data, see open_atomic."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    with open_atomic(path, "wb") as f:
+        f.write(data)
+
+
+def digest(*parts: str) -> str:
+    """Hash strings, keeping track of where each one ends."""
+    hash = sha256()
+    for part in parts:
+        data = part.encode("utf-8")
+        # prefix each part with its length so that ("ab", "c") != ("a", "bc")
+        hash.update(len(data).to_bytes(8, "little"))
+        hash.update(data)
+    return hash.hexdigest()
+
+
+def describe_path(path: Path) -> str:
+    """Describe a file, or the files in a directory, by their size and modification time.
+
+    This is much cheaper than hashing the contents of large files, like videos.
+    """
+    if not path.exists():
+        return f"{path.name}: missing"
+    if path.is_dir():
+        return "\n".join(
+            describe_path(child)
+            for child in sorted(path.iterdir())
+            if not child.name.startswith(".")
+        )
+    stat = path.stat()
+    return f"{path.name}: {stat.st_size} {stat.st_mtime_ns}"
+
+
+def file_version(path: Path) -> tuple[int, int, int, int]:
+    """Tell versions of a file apart, for caches of its contents kept in memory.
+
+    Files replaced by write_atomic get a new inode, and files rewritten in place a new
+    ctime, so versions differ even with the same size and mtime.
+    """
+    stat = path.stat()
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns
 
 
 def extract_audio(
     video: Path,
+    output_path: Path,
     audio_codec: str = "pcm_s16le",
     channels: int = 1,
     sample_rate: int = 16000,
 ) -> Path:
-    output_path = mktemp(suffix=".wav")
-
     logger.info(f"Extracting audio from {video}")
-    subprocess.run(
-        [  # noqa: S607
-            "ffmpeg",
-            "-loglevel",
-            "quiet",
-            "-i",
-            video,
-            "-vn",
-            "-acodec",
-            str(audio_codec),
-            "-ac",
-            str(channels),
-            "-ar",
-            str(sample_rate),
-            output_path,
-        ],
-        stdout=subprocess.DEVNULL,
-    )
+    with trace.span("ffmpeg", video=video.name) as span:
+        subprocess.run(
+            [  # noqa: S607
+                "ffmpeg",
+                "-loglevel",
+                "quiet",
+                "-i",
+                video,
+                "-vn",
+                "-acodec",
+                str(audio_codec),
+                "-ac",
+                str(channels),
+                "-ar",
+                str(sample_rate),
+                output_path,
+            ],
+            stdout=subprocess.DEVNULL,
+        )
+
+        if output_path.exists():
+            span.set(bytes=output_path.stat().st_size)
 
     logger.debug(f"Audio saved as {output_path}")
     return output_path
 
 
-def mktemp(suffix: str = "") -> Path:
-    return Path(tempfile.NamedTemporaryFile(suffix=suffix, delete=False).name)
+def split_audio(
+    audio: Path, directory: Path, seconds: float
+) -> list[tuple[Path, float]]:
+    """Split a WAV file into chunks lasting some seconds, the last one possibly less.
+
+    Returns:
+        The path of each chunk, and the time it starts at in the audio
+    """
+    chunks = []
+    with trace.span("split audio") as span, wave.open(str(audio), "rb") as source:
+        params = source.getparams()
+        rate = source.getframerate()
+        frames = int(seconds * rate)
+        start = 0
+        while data := source.readframes(frames):
+            path = directory / f"{audio.stem}-{len(chunks):04d}.wav"
+            with wave.open(str(path), "wb") as chunk:
+                chunk.setparams(params)
+                chunk.writeframes(data)
+            chunks.append((path, start / rate))
+            start += frames
+        span.set(chunks=len(chunks))
+    logger.debug(f"Split {audio} into {len(chunks)} chunks")
+    return chunks
+
+
+@contextmanager
+def scratch_dir() -> Iterator[Path]:
+    """Temporary directory for files that can't be kept in memory.
+
+    The directory and everything in it is removed on exit.
+    """
+    with tempfile.TemporaryDirectory(prefix="superlesson-") as path:
+        logger.debug(f"Using scratch directory {path}")
+        yield Path(path)
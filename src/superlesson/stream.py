@@ -0,0 +1,217 @@
+"""Transcribe, merge, replace and improve a lesson at the same time.
+
+Each step is a stage taking the slides of the one before as they're produced, through
+bounded queues, so a slow stage holds back the ones before it instead of letting their
+output pile up. The video is transcribed in chunks, slides are merged as soon as the
+words pass their transition frames, and each is sent to ChatGPT right after. The
+lesson is then improved soon after it's transcribed, rather than after every step took
+its turn.
+
+Each step's data and fingerprint are saved at the end, as if the steps ran one after
+the other, so later runs skip them as usual. If a stage fails, the stages before it
+still finish, and their data is saved.
+"""
+
+import asyncio
+import logging
+import time
+from collections.abc import AsyncIterator, Callable
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from .collection import Lesson
+from .pipeline import Timing
+from .steps import Improve, Merge, Replace, Transcribe
+from .steps.step import Step
+from .storage import Slide, Slides
+
+logger = logging.getLogger("superlesson")
+
+steps = [Step.transcribe, Step.merge, Step.replace, Step.improve]
+
+_end = object()
+
+
+class _Channel:
+    def __init__(self, size: int):
+        """A bounded queue of slides between two stages."""
+        self._queue: asyncio.Queue = asyncio.Queue(size)
+        self._closed = False
+
+    async def put(self, slide: Slide):
+        await self._queue.put(slide)
+
+    async def close(self):
+        await self._queue.put(_end)
+
+    async def __aiter__(self) -> AsyncIterator[Slide]:
+        while not self._closed:
+            item = await self._queue.get()
+            if item is _end:
+                self._closed = True
+            else:
+                yield item
+
+
+@dataclass
+class StreamReport:
+    # when each step started, and when it produced its last slide
+    timings: dict[Step, Timing] = field(default_factory=dict)
+    # when each step produced its first slide
+    first: dict[Step, float] = field(default_factory=dict)
+    failed: dict[Step, BaseException] = field(default_factory=dict)
+    wall_time: float = 0
+
+
+class Stream:
+    def __init__(
+        self,
+        lesson: Lesson,
+        slides: Slides,
+        chunk_seconds: float = 300,
+        queue_size: int = 16,
+        improve_concurrency: int = 8,
+    ):
+        """Run the steps up to improve as a stream, see the module's docstring.
+
+        Args:
+            lesson: The lesson to process
+            slides: Where step data is kept, each step gets an empty copy
+            chunk_seconds: How long each chunk of audio transcribed at once is
+            queue_size: How many slides may wait between two stages
+            improve_concurrency: How many slides may be waiting for ChatGPT at once
+        """
+        self._lesson = lesson
+        self._slides = slides
+        self._chunk_seconds = chunk_seconds
+        self._queue_size = queue_size
+        self._improve_concurrency = improve_concurrency
+
+    def run(self) -> StreamReport:
+        """Run every step, raising the first failure once the others are saved.
+
+        If the lesson was already transcribed, the other steps run one after the
+        other instead, since there's nothing to wait for.
+        """
+        transcribe = Transcribe(
+            self._slides.empty(), self._lesson.video, self._chunk_seconds
+        )
+        if self._transcribed(transcribe):
+            logger.info("Already transcribed, running the other steps in turn")
+            report = self._run_in_turn()
+        else:
+            report = asyncio.run(self._stream(transcribe))
+        for step in steps:
+            if (error := report.failed.get(step)) is not None:
+                logger.error(f'"{step.value.name}" failed: {error}')
+                raise error
+        return report
+
+    @staticmethod
+    def _transcribed(transcribe: Transcribe) -> bool:
+        slides = transcribe.slides
+        fingerprint = slides.fingerprint(Step.transcribe, None, transcribe.inputs())
+        return slides.is_up_to_date(Step.transcribe, fingerprint)
+
+    def _run_in_turn(self) -> StreamReport:
+        slides = self._slides.empty()
+        runners: dict[Step, Callable[[], None]] = {
+            Step.merge: Merge(slides).segments,
+            Step.replace: Replace(slides).bogus_words,
+            Step.improve: Improve(slides).punctuation,
+        }
+        report = StreamReport()
+        start = time.perf_counter()
+        for step, run in runners.items():
+            step_start = time.perf_counter() - start
+            try:
+                run()
+            except Exception as e:
+                report.failed[step] = e
+                break
+            report.timings[step] = Timing(step_start, time.perf_counter() - start)
+        report.wall_time = time.perf_counter() - start
+        return report
+
+    async def _stream(self, transcribe: Transcribe) -> StreamReport:
+        merge = Merge(self._slides.empty())
+        replace = Replace(self._slides.empty())
+        improve = Improve(self._slides.empty())
+        stages = {
+            Step.transcribe: (transcribe, lambda _: transcribe.stream()),
+            Step.merge: (merge, merge.stream),
+            Step.replace: (replace, replace.stream),
+            Step.improve: (
+                improve,
+                lambda slides: improve.stream(slides, self._improve_concurrency),
+            ),
+        }
+        channels = [_Channel(self._queue_size) for _ in range(len(stages) - 1)]
+        sources: list[_Channel | None] = [None, *channels]
+        sinks: list[_Channel | None] = [*channels, None]
+
+        report = StreamReport()
+        outputs: dict[Step, list[Slide]] = {step: [] for step in stages}
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(
+                self._stage(step, stream, source, sink, outputs[step], report, start)
+                for (step, (_, stream)), source, sink in zip(
+                    stages.items(), sources, sinks, strict=True
+                )
+            )
+        )
+        report.wall_time = time.perf_counter() - start
+
+        upstream = None
+        for step, (instance, _) in stages.items():
+            if step in report.failed:
+                break
+            self._save(
+                step, upstream, instance.slides, instance.inputs(), outputs[step]
+            )
+            upstream = step
+        return report
+
+    @staticmethod
+    async def _stage(
+        step: Step,
+        stream: Callable[[_Channel | None], AsyncIterator[Slide]],
+        source: _Channel | None,
+        sink: _Channel | None,
+        output: list[Slide],
+        report: StreamReport,
+        start: float,
+    ):
+        report.timings[step] = Timing(time.perf_counter() - start, 0)
+        try:
+            async for slide in stream(source):
+                report.first.setdefault(step, time.perf_counter() - start)
+                output.append(slide)
+                if sink is not None:
+                    await sink.put(slide)
+        except Exception as e:
+            report.failed[step] = e
+            if source is not None:
+                # let the stages before finish, so their data is saved
+                async for _ in source:
+                    pass
+        finally:
+            report.timings[step].end = time.perf_counter() - start
+            if sink is not None:
+                await sink.close()
+
+    @staticmethod
+    def _save(
+        step: Step,
+        upstream: Step | None,
+        slides: Slides,
+        inputs: list[Path | str],
+        output: list[Slide],
+    ):
+        slides.clear()
+        slides.extend(output)
+        # fingerprinted after upstream's data was saved, as the step decorator does
+        fingerprint = slides.fingerprint(step, upstream, inputs)
+        slides.save(step)
+        slides.save_fingerprint(step, fingerprint)
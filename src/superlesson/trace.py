@@ -0,0 +1,160 @@
+"""Spans of work, exported in Chrome's trace event format.
+
+Steps and the slow operations within them, like running ffmpeg, uploading to S3 or
+requesting completions, each run in a span, which records how long they took along
+with attributes such as bytes or tokens. Spans started within another are nested
+under it, also from asyncio tasks and asyncio.to_thread, which copy the context.
+
+Spans are only kept while tracing, so they cost next to nothing otherwise. Their
+durations are always added to the span_seconds histogram, see superlesson.metrics. Traces can
+be opened in https://ui.perfetto.dev or chrome://tracing. Only the spans of the process
+that started tracing are kept, e.g. not those of typst workers.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from . import metrics
+
+logger = logging.getLogger("superlesson")
+
+_durations = metrics.histogram("span_seconds", "Time spent in each kind of span.")
+
+
+@dataclass
+class Span:
+    name: str
+    attributes: dict[str, Any] = field(default_factory=dict)
+    id: int = 0
+    parent: int | None = None
+    start: float = 0
+    end: float = 0
+    thread: int = 0
+    # spans in asyncio tasks overlap others in the same thread
+    in_task: bool = False
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    def set(self, **attributes: Any):
+        """Add attributes known once the work is done, e.g. tokens used."""
+        self.attributes.update(attributes)
+
+
+class Tracer:
+    def __init__(self):
+        """Keep every span that ends, until saved."""
+        self.spans: list[Span] = []
+        self._ids = itertools.count(1)
+        self._threads: dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def next_id(self) -> int:
+        with self._lock:
+            return next(self._ids)
+
+    def record(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+            self._threads.setdefault(span.thread, threading.current_thread().name)
+
+    def events(self) -> list[dict[str, Any]]:
+        """The spans as trace events, with times in microseconds."""
+        pid = os.getpid()
+        events: list[dict[str, Any]] = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": thread,
+                "args": {"name": name},
+            }
+            for thread, name in self._threads.items()
+        ]
+        for span in sorted(self.spans, key=lambda span: span.start):
+            event = {
+                "name": span.name,
+                "cat": "superlesson",
+                "pid": pid,
+                "tid": span.thread,
+                "args": {**span.attributes, "parent": span.parent},
+            }
+            if span.in_task:
+                events.append(
+                    {**event, "ph": "b", "id": span.id, "ts": span.start * 1e6}
+                )
+                events.append({**event, "ph": "e", "id": span.id, "ts": span.end * 1e6})
+            else:
+                events.append(
+                    {
+                        **event,
+                        "ph": "X",
+                        "ts": span.start * 1e6,
+                        "dur": span.duration * 1e6,
+                    }
+                )
+        return events
+
+    def save(self, path: Path):
+        data = {"traceEvents": self.events(), "displayTimeUnit": "ms"}
+        path.write_text(json.dumps(data, default=str))
+        logger.info(f"Saved {len(self.spans)} spans to {path}")
+
+
+_tracer: Tracer | None = None
+_current: ContextVar[Span | None] = ContextVar("span", default=None)
+
+
+def start() -> Tracer:
+    """Keep spans from now on, see the module's docstring."""
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def stop():
+    global _tracer
+    _tracer = None
+
+
+def _in_task() -> bool:
+    try:
+        return asyncio.current_task() is not None
+    except RuntimeError:
+        return False
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    """Time the work done within, as part of the current span."""
+    current = Span(name, attributes)
+    tracer = _tracer
+    if tracer is not None:
+        parent = _current.get()
+        current.id = tracer.next_id()
+        current.parent = parent.id if parent is not None else None
+        current.thread = threading.get_native_id()
+        current.in_task = _in_task()
+        token = _current.set(current)
+    current.start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.end = time.perf_counter()
+        logger.debug("%s took %.3fs", name, current.duration)
+        _durations.observe(current.duration, span=name)
+        if tracer is not None:
+            _current.reset(token)
+            tracer.record(current)
@@ -0,0 +1,355 @@
+"""Process lessons as their files land in the lessons directory.
+
+Changes are noticed with inotify where available, or by polling otherwise. Polling
+keeps the mtimes of the lessons directory and of each lesson, so only directories whose
+entries changed are listed again. Files rewritten in place, instead of being created or
+renamed into a lesson, are only noticed by inotify.
+
+A file is complete once it hasn't changed for some seconds. Steps then run as soon as
+the files they need are complete, e.g. a lesson is transcribed as soon as its video
+is, whether or not its presentation is there. The transition frames folder is
+complete once no frames were added to it for some seconds, and only then is the
+lesson merged.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Protocol
+
+from .batch import Batch, LessonProgress
+from .collection import FileType, Lesson
+from .steps.step import Step, dependencies, registry
+
+logger = logging.getLogger("superlesson")
+
+# the files each step reads, besides the data of the steps it depends on
+_inputs = {
+    Step.transcribe: FileType.video,
+    Step.merge: FileType.tframes,
+    Step.annotate: FileType.slides,
+}
+_tframes = "tframes"
+
+_IN_MODIFY = 0x2
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_IGNORED = 0x8000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = os.O_CLOEXEC
+_event = struct.Struct("iIII")
+
+
+def needs(step: Step) -> set[FileType]:
+    """Lesson files a step needs, directly or through the steps it depends on.
+
+    The data of interactive steps is checked before running instead, since a lesson
+    may have been enumerated before its files changed.
+    """
+    files = {_inputs[step]} if step in _inputs else set()
+    for dep in dependencies(step):
+        if not registry[dep].interactive:
+            files |= needs(dep)
+    return files
+
+
+def _file_type(path: Path) -> FileType | None:
+    if path.name == _tframes and path.is_dir():
+        return FileType.tframes
+    try:
+        return Lesson.guess_type(path.name)
+    except ValueError:
+        return None
+
+
+class Watcher(Protocol):
+    def changes(self) -> set[Path]:
+        """Files in lessons that were created or changed since the last call."""
+        ...
+
+    def close(self):
+        ...
+
+
+class PollingWatcher:
+    # directories changed this recently may change again within the same mtime tick
+    _racy = 2
+
+    def __init__(self, lessons: Path):
+        self._lessons = lessons
+        self._mtimes: dict[Path, int | None] = {}
+        self._files: dict[Path, tuple[int, int]] = {}
+
+    def changes(self) -> set[Path]:
+        if self._stale(self._lessons):
+            for path in self._lessons.iterdir():
+                if path.is_dir() and not Lesson.ignored(path):
+                    self._mtimes.setdefault(path, None)
+
+        changed = set()
+        for directory in list(self._mtimes):
+            if directory == self._lessons or not self._stale(directory):
+                continue
+            if directory.parent == self._lessons:
+                changed |= self._rescan(directory)
+            elif self._changed(directory):
+                # a tframes folder, which changes as a whole
+                changed.add(directory)
+        return changed
+
+    def close(self):
+        pass
+
+    def _stale(self, directory: Path) -> bool:
+        try:
+            mtime = directory.stat().st_mtime_ns
+        except FileNotFoundError:
+            self._forget(directory)
+            return False
+        if self._mtimes.get(directory) == mtime and (
+            time.time() - mtime / 1e9 > self._racy
+        ):
+            return False
+        self._mtimes[directory] = mtime
+        return True
+
+    def _rescan(self, directory: Path) -> set[Path]:
+        changed = {path for path in Lesson.get_files(directory) if self._changed(path)}
+        if (tframes := directory / _tframes).is_dir():
+            # frames added later don't change the lesson's mtime
+            self._mtimes.setdefault(tframes, None)
+            if self._changed(tframes):
+                changed.add(tframes)
+        return changed
+
+    def _changed(self, path: Path) -> bool:
+        stat = path.stat()
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if self._files.get(path) == signature:
+            return False
+        self._files[path] = signature
+        return True
+
+    def _forget(self, directory: Path):
+        self._mtimes.pop(directory, None)
+        for path in [path for path in self._files if path.parent == directory]:
+            del self._files[path]
+
+
+class InotifyWatcher:
+    _mask = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+
+    def __init__(self, lessons: Path):
+        """Watch the lessons directory and each lesson in it.
+
+        Raises:
+            OSError: If inotify isn't available
+        """
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            msg = "inotify is not available"
+            raise OSError(msg)
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        self._lessons = lessons
+        self._dirs: dict[int, Path] = {}
+        self._watch(lessons)
+        self._pending: set[Path] = set()
+        for path in lessons.iterdir():
+            if self._is_lesson(path):
+                self._pending |= self._add_lesson(path)
+
+    def changes(self) -> set[Path]:
+        changed, self._pending = self._pending, set()
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            changed |= self._parse(data)
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+    def _watch(self, directory: Path):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), self._mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(directory))
+        self._dirs[wd] = directory
+
+    def _add_lesson(self, directory: Path) -> set[Path]:
+        self._watch(directory)
+        # files written before the lesson was watched
+        changed = set(Lesson.get_files(directory))
+        if (tframes := directory / _tframes).is_dir():
+            self._watch(tframes)
+            changed.add(tframes)
+        return changed
+
+    def _parse(self, data: bytes) -> set[Path]:
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _event.unpack_from(data, offset)
+            offset += _event.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & _IN_IGNORED:
+                # the directory was removed
+                self._dirs.pop(wd, None)
+            if wd not in self._dirs or not name:
+                continue
+
+            changed |= self._handle(self._dirs[wd], os.fsdecode(name), mask)
+        return changed
+
+    def _handle(self, directory: Path, name: str, mask: int) -> set[Path]:
+        path = directory / name
+        if directory.parent != self._lessons and directory != self._lessons:
+            # a frame in a tframes folder, which changes as a whole
+            return {directory}
+        if not mask & _IN_ISDIR:
+            if directory != self._lessons and not Lesson.ignored(path):
+                return {path}
+        elif self._is_lesson(path):
+            return self._add_lesson(path)
+        elif directory != self._lessons and name == _tframes:
+            # only lessons and their tframes are watched, not other subdirectories
+            self._watch(path)
+            return {path}
+        return set()
+
+    def _is_lesson(self, path: Path) -> bool:
+        return (
+            path.parent == self._lessons and path.is_dir() and not Lesson.ignored(path)
+        )
+
+
+class Debouncer:
+    def __init__(self, settle: float):
+        """Hold changed files back until they stop changing.
+
+        Args:
+            settle: Seconds a file must stay the same size to be complete
+        """
+        self._settle = settle
+        self._pending: dict[Path, tuple[float, tuple[int, int] | None]] = {}
+
+    def touch(self, path: Path):
+        self._pending[path] = (time.monotonic(), self._signature(path))
+
+    def settled(self) -> list[Path]:
+        """Files that stopped changing, which are then forgotten."""
+        now = time.monotonic()
+        settled = []
+        for path, (touched, signature) in list(self._pending.items()):
+            if now - touched < self._settle:
+                continue
+            current = self._signature(path)
+            if current is None:
+                del self._pending[path]
+            elif current == signature:
+                del self._pending[path]
+                settled.append(path)
+            else:
+                # still being written, without events if polling
+                self._pending[path] = (now, current)
+        return settled
+
+    @staticmethod
+    def _signature(path: Path) -> tuple[int, int] | None:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+
+def watcher(lessons: Path, poll: bool = False) -> Watcher:
+    """Watch lessons with inotify, or by polling if that isn't available."""
+    if not poll:
+        try:
+            return InotifyWatcher(lessons)
+        except OSError as e:
+            logger.warning(f"Falling back to polling: {e}")
+    return PollingWatcher(lessons)
+
+
+class Watch:
+    def __init__(
+        self,
+        batch: Batch,
+        lessons_watcher: Watcher,
+        settle: float = 5,
+        interval: float = 1,
+    ):
+        """Run steps on lessons as their files become complete.
+
+        Args:
+            batch: What runs the steps
+            lessons_watcher: What notices changed files
+            settle: Seconds a file must stay the same to be complete
+            interval: Seconds between checks for changes
+        """
+        self._batch = batch
+        self._watcher = lessons_watcher
+        self._debouncer = Debouncer(settle)
+        self._interval = interval
+        self._complete: dict[Path, set[FileType]] = {}
+        self._running: dict[Path, asyncio.Task] = {}
+        self._dirty: set[Path] = set()
+
+    async def run(self, on_progress: Callable[[LessonProgress], None]):
+        """Watch for changes until cancelled."""
+        async with self._batch.pools():
+            try:
+                while True:
+                    for path in self._watcher.changes():
+                        self._debouncer.touch(path)
+                    for path in self._debouncer.settled():
+                        self._file_complete(path, on_progress)
+                    await asyncio.sleep(self._interval)
+            finally:
+                for task in self._running.values():
+                    task.cancel()
+
+    def _file_complete(self, path: Path, on_progress: Callable[[LessonProgress], None]):
+        file_type = _file_type(path)
+        if file_type is None:
+            return
+        root = path.parent
+        logger.info(f"{root.name}: {path.name} is complete")
+        self._complete.setdefault(root, set()).add(file_type)
+        if root in self._running:
+            # run again once the current run finishes
+            self._dirty.add(root)
+        else:
+            self._running[root] = asyncio.create_task(self._process(root, on_progress))
+
+    async def _process(self, root: Path, on_progress: Callable[[LessonProgress], None]):
+        try:
+            while True:
+                self._dirty.discard(root)
+                steps = [
+                    step
+                    for step in self._batch.steps
+                    if needs(step) <= self._complete[root]
+                ]
+                await self._batch.lesson(root, on_progress, steps)
+                if root not in self._dirty:
+                    break
+        finally:
+            del self._running[root]
@@ -0,0 +1,57 @@
+import pytest
+from superlesson.steps import Annotate
+from superlesson.storage import Cache
+from superlesson.storage.slide import Page
+
+
+@pytest.fixture()
+def compiled(monkeypatch):
+    calls = []
+    compile_pages = Annotate._compile_pages
+
+    def spy(preamble, texts):
+        calls.append(len(texts))
+        return compile_pages(preamble, texts)
+
+    monkeypatch.setattr(Annotate, "_compile_pages", staticmethod(spy))
+    return calls
+
+
+def test_compile_only_changed_pages(tmp_path, compiled):
+    cache = Cache(tmp_path, "typst")
+    pages = [Page(f"Slide {i}.", i) for i in range(5)]
+
+    assert len(Annotate._compile_with_typst(pages, cache)) == 5
+    pages[2] = Page("Edited slide.", 2)
+    assert len(Annotate._compile_with_typst(pages, cache)) == 5
+    assert len(Annotate._compile_with_typst(pages, cache)) == 5
+
+    assert compiled == [5, 1]
+
+
+def test_compile_keeps_page_order(tmp_path, compiled):
+    cache = Cache(tmp_path, "typst")
+    pages = [Page(f"Slide {i}.", i) for i in range(3)]
+    Annotate._compile_with_typst(pages, cache)
+
+    pages.insert(1, Page("New slide.", 1))
+    compiled_pages = Annotate._compile_with_typst(pages, cache)
+
+    # spacing isn't reliable in extracted text
+    texts = [page.extract_text().replace(" ", "") for page in compiled_pages]
+    assert "Newslide" in texts[1]
+    assert "Slide2" in texts[3]
+
+
+def test_compile_in_shards(tmp_path, monkeypatch):
+    monkeypatch.setattr(Annotate, "_min_shard_pages", 2)
+    cache = Cache(tmp_path, "typst")
+    pages = [Page(f"Slide {i}.", i) for i in range(6)]
+
+    compiled_pages = Annotate._compile_with_typst(pages, cache, workers=3)
+
+    texts = [page.extract_text().replace(" ", "") for page in compiled_pages]
+    assert "Slide0.⇢" in texts[0]
+    for i in range(1, 5):
+        assert f"⇢Slide{i}.⇢" in texts[i]
+    assert "⇢Slide5." in texts[5]
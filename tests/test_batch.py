@@ -0,0 +1,82 @@
+import os
+import time
+
+from superlesson.batch import Batch
+from superlesson.collection import Lesson
+from superlesson.steps.step import Step
+from superlesson.storage import Slide, Slides
+from superlesson.storage.slide import TimeFrame
+
+
+def record(root, step):
+    if root.name == "bad" and step is Step.merge:
+        msg = "no words"
+        raise ValueError(msg)
+    with open(root / "ran", "a") as f:
+        f.write(f"{step.name} {os.getpid()}\n")
+
+
+def wait(root, step):
+    time.sleep(0.2)
+
+
+def test_find_lessons(tmp_path):
+    for name in ["calc", "fis", "notes", ".hidden"]:
+        (tmp_path / name).mkdir()
+    (tmp_path / "calc" / "aula.mp4").touch()
+    (tmp_path / "fis" / "slides.pdf").touch()
+    (tmp_path / "fis" / "aula.mkv").touch()
+    (tmp_path / "notes" / "slides.pdf").touch()
+    (tmp_path / "notes" / "unknown.xyz").touch()
+    (tmp_path / ".hidden" / "aula.mp4").touch()
+
+    assert Lesson.find_lessons(tmp_path) == [tmp_path / "calc", tmp_path / "fis"]
+
+
+def test_failures_stop_only_their_lesson(tmp_path):
+    roots = [tmp_path / name for name in ["bad", "good"]]
+    for root in roots:
+        root.mkdir()
+
+    results = Batch(roots, cpu_workers=2, run=record).run()
+
+    bad, good = results
+    assert (bad.step, bad.done, bad.error) == (
+        Step.merge,
+        [Step.transcribe],
+        "no words",
+    )
+    assert good.done == [Step.transcribe, Step.merge, Step.replace, Step.improve]
+    # not enumerated yet
+    assert good.skipped == [Step.annotate]
+
+    ran = [line.split() for line in (roots[1] / "ran").read_text().splitlines()]
+    pids = {step: int(pid) for step, pid in ran}
+    assert pids["transcribe"] == pids["improve"] == os.getpid()
+    assert pids["merge"] != os.getpid()
+
+
+def test_runs_enumerated_lessons_to_the_end(tmp_path):
+    root = tmp_path / "calc"
+    root.mkdir()
+    slides = Slides(root)
+    slides.append(Slide("integral", TimeFrame(0, 1), number=0))
+    slides.save(Step.enumerate)
+
+    [progress] = Batch([root], cpu_workers=1, run=record).run()
+
+    assert progress.done[-1] is Step.annotate
+    assert not progress.skipped
+
+
+def test_lessons_share_network_slots(tmp_path):
+    roots = [tmp_path / str(i) for i in range(4)]
+    for root in roots:
+        root.mkdir()
+
+    start = time.perf_counter()
+    Batch(roots, cpu_workers=4, network_slots=2, run=wait).run()
+    elapsed = time.perf_counter() - start
+
+    # 4 lessons with 2 network steps each, 2 at a time, plus CPU steps in between
+    assert 0.8 <= elapsed < 1.6
@@ -0,0 +1,45 @@
+import click
+import pytest
+from superlesson.cli import cli
+from superlesson.steps.step import Step
+from superlesson.storage import Library, Slide, Slides
+from superlesson.storage.slide import TimeFrame
+
+
+@pytest.fixture()
+def lessons(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "lessons").mkdir()
+    return tmp_path / "lessons"
+
+
+def test_options_before_library_commands(lessons):
+    with pytest.raises(click.UsageError, match="No lessons found"):
+        cli.main(
+            ["-v", "--metrics-interval", "5", "batch", str(lessons)],
+            standalone_mode=False,
+        )
+
+
+def test_lessons_named_like_library_commands(lessons):
+    (lessons.parent / "search").mkdir()
+    (lessons.parent / "search" / "aula.mp4").write_bytes(b"video")
+
+    with pytest.raises(Exception, match='"merge segments" has not been run yet'):
+        cli.main(["search", "diff", "merge", "replace"], standalone_mode=False)
+
+
+def test_search_lessons_in_a_library(lessons, capsys):
+    library = Library(lessons / "library.db")
+    slides = Slides(lessons / "calc", library=library)
+    slides.append(Slide("integral", TimeFrame(0, 1)))
+    slides.save(Step.transcribe)
+    library.close()
+
+    cli.main(
+        ["search", "-l", str(lessons / "library.db"), "--lessons", str(lessons)]
+        + ["integral"],
+        standalone_mode=False,
+    )
+
+    assert capsys.readouterr().out == "calc\tslide ?\t0 ms (0:00:00)\n"
@@ -1,5 +1,7 @@
+import os
+
 import pytest
-from superlesson.collection import Lesson
+from superlesson.collection import FileType, Lesson, Manifest
 
 
 @pytest.fixture()
@@ -20,3 +22,35 @@ def test_discovery(lesson):
     assert lesson.video.name == "video.mp4"
     assert lesson.presentation.name == "presentation.pdf"
     assert len(lesson.files) == 2
+
+
+def test_manifest_is_refreshed_incrementally(tmp_path):
+    video = tmp_path / "aula.mp4"
+    video.write_bytes(b"video")
+    (tmp_path / "notes.unknown").touch()
+    os.utime(video, ns=(0, 1_000_000_000))
+    manifest = Manifest(tmp_path).refresh()
+    assert manifest.entries["aula.mp4"].type is FileType.video
+    assert manifest.entries["notes.unknown"].type is None
+    hash = manifest.hash("aula.mp4")
+
+    # kept in .data, with the hash
+    manifest = Manifest(tmp_path).refresh()
+    assert manifest.entries["aula.mp4"].hash == hash
+    video.write_bytes(b"other video")
+    os.utime(video, ns=(0, 2_000_000_000))
+    assert Manifest(tmp_path).refresh().hash("aula.mp4") != hash
+
+    video.unlink()
+    assert list(Manifest(tmp_path).refresh().entries) == ["notes.unknown"]
+
+
+def test_find_lessons_leaves_other_folders_alone(tmp_path):
+    for name in ["calc", "notes"]:
+        (tmp_path / name).mkdir()
+    (tmp_path / "calc" / "aula.mp4").touch()
+    (tmp_path / "notes" / "notes.md").touch()
+
+    assert Lesson.find_lessons(tmp_path) == [tmp_path / "calc"]
+    assert (tmp_path / "calc" / ".data" / "manifest.json").exists()
+    assert not (tmp_path / "notes" / ".data").exists()
@@ -0,0 +1,59 @@
+import random
+
+from superlesson.diff import align, diff, render
+from superlesson.storage import Slide
+from superlesson.storage.slide import TimeFrame
+
+
+def lcs_length(a, b):
+    lengths = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    for i, x in enumerate(a):
+        for j, y in enumerate(b):
+            lengths[i + 1][j + 1] = (
+                lengths[i][j] + 1
+                if x == y
+                else max(lengths[i][j + 1], lengths[i + 1][j])
+            )
+    return lengths[-1][-1]
+
+
+def test_diff_is_minimal():
+    rng = random.Random(0)
+    for _ in range(500):
+        a = rng.choices("abcd", k=rng.randint(0, 20))
+        b = rng.choices("abcd", k=rng.randint(0, 20))
+
+        changes = diff(a, b)
+
+        assert [w for change in changes for w in change.before] == a
+        assert [w for change in changes for w in change.after] == b
+        equal = [change for change in changes if change.tag == "equal"]
+        assert all(change.before == change.after for change in equal)
+        assert sum(len(change.before) for change in equal) == lcs_length(a, b)
+
+
+def test_render():
+    changes = diff("a integral de x".split(), "a derivada de x dx".split())
+
+    assert render(changes, color=False) == "a [-integral-] {+derivada+} de x {+dx+}"
+
+
+def test_align_merged_slides():
+    words = [
+        Slide(word, TimeFrame(i, i + 1)) for i, word in enumerate("a b c d e".split())
+    ]
+    merged = [
+        Slide("a b", TimeFrame(0, 2), number=0),
+        Slide("c d e.", TimeFrame(2, 5.0005), number=1),
+    ]
+
+    diffs = list(align(words, merged))
+
+    assert [(d.number, d.start, d.end, d.changed) for d in diffs] == [
+        (0, 0, 2, False),
+        (1, 2, 5.0005, True),
+    ]
+    assert diffs[1].stats == {"equal": 2, "deleted": 1, "inserted": 1}
+    assert diffs[1].to_dict()["changes"] == [
+        {"tag": "replace", "before": ["e"], "after": ["e."]}
+    ]
@@ -0,0 +1,78 @@
+import pytest
+from superlesson.steps.step import Step
+from superlesson.storage import Library, Slide, Slides
+from superlesson.storage.index import SearchIndex, decode, encode, tokenize
+from superlesson.storage.slide import TimeFrame
+
+
+def make_lesson(root, text, numbers=(0, 4), library=None):
+    root.mkdir()
+    slides = Slides(root, library=library)
+    for i, word in enumerate(text.split()):
+        slides.append(Slide(word, TimeFrame(i * 1.5, i * 1.5 + 1)))
+    slides.save(Step.transcribe)
+
+    enumerated = Slides(root, library=library)
+    enumerated.append(Slide(text, TimeFrame(0, 3), number=numbers[0]))
+    enumerated.append(Slide("", TimeFrame(3, 100), number=numbers[1]))
+    enumerated.save(Step.enumerate)
+    return root
+
+
+@pytest.fixture()
+def index(tmp_path):
+    index = SearchIndex(tmp_path / "search.db")
+    yield index
+    index.close()
+
+
+def test_postings_roundtrip():
+    postings = [(0, 0), (1500, 3), (1500, 2), (90_000_000, 2), (90_000_001, 120)]
+
+    assert list(decode(encode(postings))) == postings
+    assert len(encode(postings[:3])) == 7
+
+
+def test_tokenize():
+    assert tokenize("A Posição, é: VELOCIDADE!") == ["a", "posicao", "e", "velocidade"]
+
+
+def test_search(tmp_path, index):
+    calc = make_lesson(tmp_path / "calc", "hoje vamos falar de integral e derivada")
+    fis = make_lesson(tmp_path / "fis", "a derivada da posição é a velocidade")
+    index.update([calc, fis])
+
+    hits = [(hit.lesson.name, hit.slide, hit.time) for hit in index.search("Derivada")]
+    assert hits == [("calc", 5, 9000), ("fis", 1, 1500)]
+    [hit] = index.search("posicao velocidade", window=5)
+    assert (hit.lesson.name, hit.time) == ("fis", 4500)
+    assert index.search("posicao velocidade", window=1) == []
+    assert index.search("integral velocidade") == []
+
+
+def test_update_is_incremental(tmp_path, index):
+    calc = make_lesson(tmp_path / "calc", "integral")
+    fis = make_lesson(tmp_path / "fis", "velocidade")
+    assert index.update([calc, fis]) == 2
+    assert index.update([calc, fis]) == 0
+
+    improved = Slides(fis)
+    improved.append(Slide("velocidade e aceleração", TimeFrame(10, 20)))
+    improved.save(Step.improve)
+    assert index.update([calc, fis]) == 1
+    [hit] = index.search("aceleracao")
+    assert (hit.lesson.name, hit.slide, hit.time) == ("fis", 5, 16667)
+
+    index.update([fis])
+    assert index.search("integral") == []
+
+
+def test_lessons_in_a_library(tmp_path, index):
+    library = Library(tmp_path / "library.db")
+    calc = make_lesson(tmp_path / "calc", "integral", library=library)
+
+    assert library.roots() == [calc.resolve()]
+    assert index.update([calc], library) == 1
+    [hit] = index.search("integral")
+    assert (hit.lesson.name, hit.slide) == ("calc", 1)
+    library.close()
@@ -0,0 +1,97 @@
+import multiprocessing
+import os
+import time
+
+import pytest
+from superlesson.jobs import JobQueue, Worker
+from superlesson.steps.step import Step
+
+
+def record(root, step):
+    if root.name == "bad" and step is Step.replace:
+        msg = "no words"
+        raise ValueError(msg)
+    time.sleep(0.05)
+    with open(root / "ran", "a") as f:
+        f.write(f"{step.name} {os.getpid()}\n")
+
+
+def work(path):
+    queue = JobQueue(path)
+    Worker(queue, lease=5, poll=0.05, run=record).run(drain=True)
+    queue.close()
+
+
+def make_lessons(tmp_path, names):
+    roots = [tmp_path / name for name in names]
+    for root in roots:
+        root.mkdir()
+    return roots
+
+
+@pytest.fixture()
+def queue(tmp_path):
+    queue = JobQueue(tmp_path / ".queue.db")
+    yield queue
+    queue.close()
+
+
+def test_steps_of_a_lesson_run_in_order(tmp_path, queue):
+    [root] = make_lessons(tmp_path, ["calc"])
+    assert queue.submit([root]) == 4
+
+    claimed = queue.claim("a", lease=60)
+    assert (claimed.root, claimed.step, claimed.attempt) == (root, Step.transcribe, 1)
+    assert queue.claim("b", lease=60) is None
+
+    queue.finish(claimed, "a")
+    assert queue.claim("b", lease=60).step is Step.merge
+
+
+def test_expired_leases_are_claimed_again(tmp_path, queue):
+    make_lessons(tmp_path, ["calc"])
+    queue.submit([tmp_path / "calc"])
+    queue.claim("dead", lease=0)
+
+    job = queue.claim("alive", lease=60)
+    assert (job.step, job.attempt) == (Step.transcribe, 2)
+    assert not queue.heartbeat(job, "dead", lease=60)
+    assert queue.heartbeat(job, "alive", lease=60)
+
+
+def test_failures_are_retried_then_skip_the_lesson(tmp_path, queue):
+    roots = make_lessons(tmp_path, ["bad", "good"])
+    queue.submit(roots)
+
+    assert Worker(queue, poll=0, run=record).run(drain=True) == 6
+
+    assert queue.counts() == {"done": 6, "failed": 1, "skipped": 1}
+    [(root, step, error)] = queue.failures()
+    assert (root.name, step, error) == ("bad", Step.replace, "no words")
+
+
+def test_several_workers_share_the_queue(tmp_path, queue):
+    roots = make_lessons(tmp_path, [str(i) for i in range(6)])
+    queue.submit(roots)
+
+    workers = [
+        multiprocessing.Process(target=work, args=(queue.path,)) for _ in range(3)
+    ]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join(30)
+        assert process.exitcode == 0
+
+    assert queue.counts() == {"done": 24}
+    pids = set()
+    for root in roots:
+        ran = [line.split() for line in (root / "ran").read_text().splitlines()]
+        assert [step for step, _ in ran] == [
+            "transcribe",
+            "merge",
+            "replace",
+            "improve",
+        ]
+        pids |= {pid for _, pid in ran}
+    assert pids <= {str(process.pid) for process in workers}
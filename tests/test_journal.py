@@ -0,0 +1,111 @@
+import pytest
+from superlesson.steps.step import Step
+from superlesson.storage import Slide, Slides
+from superlesson.storage.journal import Journal
+from superlesson.storage.slide import TimeFrame
+
+
+@pytest.fixture()
+def root(tmp_path):
+    slides = Slides(tmp_path)
+    for i in range(10):
+        slides.append(Slide(f"slide {i}.", TimeFrame(i, i + 1)))
+    slides.save(Step.merge)
+    return tmp_path
+
+
+def start(root, fingerprint="fingerprint"):
+    slides = Slides(root)
+    slides.load_step(Step.merge)
+    resumed = slides.start_journal(Step.enumerate, fingerprint)
+    return slides, resumed
+
+
+def test_resume_changes(root):
+    slides, resumed = start(root)
+    assert not resumed
+    slides.update(0, number=0)
+    slides.merge(1, 2)
+    slides.update(1, number=-1)
+
+    slides, resumed = start(root)
+
+    assert resumed
+    assert len(slides) == 9
+    assert slides[0].number == 0
+    assert slides[1].number == -1
+    assert slides[1].transcription == "slide 1. slide 2."
+
+
+def test_resume_after_compaction(root, monkeypatch):
+    monkeypatch.setattr(Journal, "compact_after", 3)
+    slides, _ = start(root)
+    for i in range(8):
+        slides.update(i, number=i)
+
+    slides, resumed = start(root)
+
+    assert resumed
+    assert [slide.number for slide in slides] == [*range(8), None, None]
+    assert len(list(root.joinpath(".data").glob("*.journal.*.bin"))) == 1
+
+
+def test_discard_outdated_journal(root):
+    slides, _ = start(root)
+    slides.update(0, number=0)
+
+    slides, resumed = start(root, "other fingerprint")
+
+    assert not resumed
+    assert slides[0].number is None
+    slides.update(1, number=1)
+    slides, resumed = start(root, "other fingerprint")
+    assert resumed
+    assert [slide.number for slide in slides][:2] == [None, 1]
+
+
+def test_discard_outdated_snapshot(root, monkeypatch):
+    monkeypatch.setattr(Journal, "compact_after", 1)
+    slides, _ = start(root)
+    slides.update(0, number=0)
+
+    start(root, "other fingerprint")
+
+    assert not list(root.joinpath(".data").glob("*.journal.*.bin"))
+
+
+def test_ignore_partial_change(root):
+    slides, _ = start(root)
+    slides.update(0, number=0)
+    with root.joinpath(".data", "enumerated.journal").open("a") as f:
+        f.write('{"op": "upd')
+
+    slides, resumed = start(root)
+
+    assert resumed
+    assert slides[0].number == 0
+
+
+def test_resume_changes_after_partial_change(root):
+    slides, _ = start(root)
+    slides.update(0, number=0)
+    with root.joinpath(".data", "enumerated.journal").open("a") as f:
+        f.write('{"op": "update", "slide": 0, "fields": {"number": 5}}')
+    slides, _ = start(root)
+    slides.update(1, number=1)
+    slides.update(2, number=2)
+
+    slides, resumed = start(root)
+
+    assert resumed
+    assert [slide.number for slide in slides][:3] == [0, 1, 2]
+
+
+def test_save_discards_journal(root):
+    slides, _ = start(root)
+    slides.update(0, number=0)
+    slides.save(Step.enumerate)
+
+    assert not list(root.joinpath(".data").glob("*.journal*"))
+    _, resumed = start(root)
+    assert not resumed
@@ -0,0 +1,74 @@
+import pytest
+from superlesson.steps.step import Step
+from superlesson.storage import Library, Slide, Slides
+from superlesson.storage.slide import TimeFrame
+
+
+@pytest.fixture()
+def library(tmp_path):
+    library = Library(tmp_path / "library.db")
+    yield library
+    library.close()
+
+
+def make_lesson(root, words):
+    root.mkdir()
+    slides = Slides(root)
+    for i, word in enumerate(words):
+        slides.append(Slide(f"{word} {i}", TimeFrame(i * 10, i * 10 + 5)))
+    return slides
+
+
+def test_library_roundtrip(tmp_path, library):
+    slides = make_lesson(tmp_path / "lesson", ["integral", "derivada"])
+    slides = Slides(slides.lesson_root, library=library)
+    slides.extend([Slide("limite", TimeFrame(0, 1), number=2)])
+    slides.save(Step.merge)
+    slides.save_fingerprint(Step.merge, "abc")
+
+    loaded = Slides(slides.lesson_root, library=library)
+
+    assert loaded.load_step(Step.merge)
+    assert loaded[0] == Slide("limite", TimeFrame(0, 1), number=2)
+    assert loaded._store.load_fingerprint(Step.merge.name) == "abc"
+    assert not (slides.lesson_root / ".data" / "merged.bin").exists()
+
+
+def test_import_keeps_steps_up_to_date(tmp_path, library):
+    slides = make_lesson(tmp_path / "lesson", ["integral", "derivada"])
+    slides.save(Step.merge)
+    slides.save_fingerprint(Step.merge, "abc")
+    fingerprint = slides.fingerprint(Step.replace, Step.merge, [])
+
+    imported = library.import_lesson(slides.lesson_root, ["merged", "replaced"])
+    slides = Slides(slides.lesson_root, library=library)
+
+    assert imported == ["merged"]
+    assert slides.is_up_to_date(Step.merge, "abc")
+    assert slides[1].transcription == "derivada 1"
+    # the digest of imported data doesn't change, so neither do fingerprints
+    assert slides.fingerprint(Step.replace, Step.merge, []) == fingerprint
+
+
+def test_library_queries(tmp_path, library):
+    for name, words in [("a", ["integral", "derivada"]), ("b", ["limite"])]:
+        slides = make_lesson(tmp_path / name, words)
+        library.save(
+            library.lesson_id(slides.lesson_root),
+            "merged",
+            [slide.to_dict() for slide in slides],
+        )
+    library.save(library.lesson_id(tmp_path / "a"), "enumerated", [])
+
+    assert library.lessons_without("enumerated") == [(tmp_path / "b").resolve()]
+    assert library.duration("merged") == 15 + 5
+    [hit] = library.search("derivada")
+    assert (hit.lesson, hit.start, hit.snippet) == (
+        (tmp_path / "a").resolve(),
+        10,
+        "[derivada] 1",
+    )
+
+    # replaced data doesn't show up in searches
+    library.save(library.lesson_id(tmp_path / "a"), "merged", [])
+    assert library.search("derivada") == []
@@ -0,0 +1,50 @@
+import pytest
+from superlesson.steps import Merge
+from superlesson.storage import Slide, Slides
+from superlesson.storage.slide import TimeFrame
+
+
+@pytest.fixture()
+def slides(tmp_path):
+    slides = Slides(tmp_path)
+    time = 0.0
+    # a sentence of 10 words every 5 seconds, with a 1 second pause between them
+    for _ in range(60):
+        for word in range(10):
+            text = "word." if word == 9 else "word"
+            slides.append(Slide(text, TimeFrame(time, time + 0.4)))
+            time += 0.4
+        time += 1.0
+    return slides
+
+
+def test_segment_by_pauses(slides):
+    Merge(slides)._segment_by_pauses(min_duration=30.0, max_duration=60.0)
+
+    # sentences end at 4s, 9s, ..., so the first to go over 30s is the seventh
+    assert len(slides) == 9
+    for slide in slides:
+        assert slide.transcription.endswith(".")
+    for slide in list(slides)[:-1]:
+        assert len(slide.transcription.split()) == 70
+
+
+def test_segment_without_pauses(slides):
+    for slide in slides:
+        slide.transcription = slide.transcription.rstrip(".")
+
+    Merge(slides)._segment_by_pauses(min_duration=30.0, max_duration=60.0)
+
+    assert len(slides) > 1
+    for slide in slides:
+        timeframe = slide.timeframe
+        assert timeframe.end - timeframe.start <= 60.0
+
+
+def test_segment_single_word(tmp_path):
+    slides = Slides(tmp_path)
+    slides.append(Slide("word", TimeFrame(0.0, 1.0)))
+
+    Merge(slides)._segment_by_pauses()
+
+    assert len(slides) == 1
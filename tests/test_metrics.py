@@ -0,0 +1,99 @@
+import json
+import time
+
+import pytest
+from superlesson import metrics, trace
+from superlesson.batch import Batch
+from superlesson.metrics import Exporter, Registry
+
+
+def count(root, step):
+    metrics.counter("test_steps_total", "Steps run by tests.").inc(step=step.name)
+
+
+@pytest.fixture()
+def registry():
+    return Registry()
+
+
+def test_counters(registry):
+    requests = registry.counter("requests_total", "Requests.")
+    requests.inc(result="completed")
+    requests.inc(2, result="completed")
+    requests.inc(result="rate limited")
+
+    assert requests.value(result="completed") == 3
+    assert registry.counter("requests_total", "Requests.") is requests
+    with pytest.raises(TypeError):
+        registry.histogram("requests_total", "Requests.")
+    assert registry.prometheus() == (
+        "# HELP superlesson_requests_total Requests.\n"
+        "# TYPE superlesson_requests_total counter\n"
+        'superlesson_requests_total{result="completed"} 3\n'
+        'superlesson_requests_total{result="rate limited"} 1\n'
+    )
+
+
+def test_histograms(registry):
+    latency = registry.histogram("latency_seconds", "Latency.")
+    for i in range(100):
+        latency.observe(0.5 + i / 100)
+    latency.observe(5000)
+
+    # half of the values are between 0.5 and 1, and the other half between 1 and 2.5
+    assert latency.quantile(0.5) == pytest.approx(1, abs=0.02)
+    assert latency.quantile(0.99) == pytest.approx(2.5, abs=0.05)
+    assert latency.quantile(1) == 2500
+    assert latency.quantile(0.5, step="other") is None
+    text = registry.prometheus()
+    assert 'superlesson_latency_seconds_bucket{le="1"} 51\n' in text
+    assert 'superlesson_latency_seconds_bucket{le="+Inf"} 101\n' in text
+    assert "superlesson_latency_seconds_count 101\n" in text
+
+
+def test_snapshots_add_up(registry):
+    registry.counter("tokens_total", "Tokens.").inc(10)
+    registry.histogram("latency_seconds", "Latency.").observe(1)
+    other = Registry()
+    other.counter("tokens_total", "Tokens.").inc(5)
+
+    other.merge(registry.snapshot(reset=True))
+
+    assert other.counter("tokens_total", "Tokens.").value() == 15
+    assert other.histogram("latency_seconds", "Latency.").quantile(1) == 1
+    assert registry.counter("tokens_total", "Tokens.").value() == 0
+
+
+def test_spans_observe_durations():
+    with trace.span("test span"):
+        time.sleep(0.01)
+
+    durations = metrics.histogram("span_seconds", "")
+    assert durations.quantile(1, span="test span") >= 0.01
+
+
+def test_batch_adds_up_worker_metrics(tmp_path):
+    (tmp_path / "calc").mkdir()
+    steps = metrics.counter("test_steps_total", "Steps run by tests.")
+
+    Batch([tmp_path / "calc"], cpu_workers=1, run=count).run()
+
+    # merge and replace run in a worker process
+    assert steps.value(step="merge") == 1
+    assert steps.value(step="replace") == 1
+    assert steps.value(step="transcribe") == 1
+
+
+def test_exporter(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "registry", Registry())
+    metrics.counter("tokens_total", "Tokens.").inc(10)
+    path = tmp_path / "metrics.json"
+
+    exporter = Exporter(path, interval=0.01).start()
+    time.sleep(0.1)
+    assert path.exists()
+    metrics.counter("tokens_total", "Tokens.").inc(5)
+    exporter.stop()
+
+    data = json.loads(path.read_text())
+    assert data["superlesson_tokens_total"]["values"] == [{"labels": {}, "value": 15}]
@@ -0,0 +1,76 @@
+import time
+
+import pytest
+from superlesson.pipeline import Pipeline, Task, step_tasks
+from superlesson.steps.step import Step
+
+
+def test_step_tasks_follow_decorators():
+    runners = {step: lambda: None for step in Step if step is not Step.manual}
+
+    tasks = {task.name: task for task in step_tasks(runners)}
+
+    assert tasks["transcribe"].after == []
+    assert tasks["improve"].after == ["merge", "replace"]
+    assert tasks["annotate"].after == ["enumerate"]
+    assert tasks["enumerate"].interactive
+
+
+def test_independent_tasks_run_concurrently():
+    order = []
+
+    def sleep(name):
+        def run():
+            time.sleep(0.2)
+            order.append(name)
+
+        return run
+
+    report = Pipeline(
+        [
+            Task("transcribe", sleep("transcribe")),
+            Task("rescale", sleep("rescale")),
+            Task("merge", sleep("merge"), ["transcribe"]),
+            Task("annotate", sleep("annotate"), ["merge", "rescale"]),
+        ]
+    ).run()
+
+    assert order[2:] == ["merge", "annotate"]
+    assert report.wall_time < 0.75
+    assert report.critical_path[1:] == ["merge", "annotate"]
+    assert report.critical_path_time == pytest.approx(0.6, abs=0.1)
+
+
+def test_interactive_tasks_run_last():
+    order = []
+    report = Pipeline(
+        [
+            Task("a", lambda: order.append("a")),
+            Task("ask", lambda: order.append("ask"), ["a"], interactive=True),
+            Task("b", lambda: order.append("b"), ["a"]),
+            Task("c", lambda: order.append("c"), ["b"]),
+            Task("after", lambda: order.append("after"), ["ask"]),
+        ]
+    ).run()
+
+    assert order == ["a", "b", "c", "ask", "after"]
+    assert not report.failed
+
+
+def test_failures_skip_dependents():
+    def fail():
+        msg = "no video"
+        raise ValueError(msg)
+
+    report = Pipeline(
+        [
+            Task("transcribe", fail),
+            Task("merge", lambda: None, ["transcribe"]),
+            Task("rescale", lambda: None),
+            Task("ask", lambda: None, interactive=True),
+        ]
+    ).run(interactive=False)
+
+    assert list(report.failed) == ["transcribe"]
+    assert sorted(report.skipped) == ["ask", "merge"]
+    assert list(report.timings) == ["rescale"]
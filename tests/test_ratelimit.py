@@ -0,0 +1,100 @@
+import asyncio
+import multiprocessing
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+from superlesson.ratelimit import RateLimiter, limiter
+from superlesson.steps import Improve
+
+
+def call(path, times, queue):
+    # every process reserves at the same time, so waits only depend on the order
+    time.time = lambda: 1000.0
+    limiter = RateLimiter("test", 1200, burst=0, path=path)
+    for _ in range(times):
+        queue.put(limiter.reserve())
+    limiter.close()
+
+
+@pytest.fixture()
+def path(tmp_path):
+    return tmp_path / "ratelimit.db"
+
+
+@pytest.fixture()
+def _frozen(monkeypatch):
+    # waits would otherwise shrink by however long the previous calls took
+    monkeypatch.setattr(time, "time", lambda: 1000.0)
+
+
+@pytest.mark.usefixtures("_frozen")
+def test_requests_wait_in_line(path):
+    limiter = RateLimiter("test", 600, burst=1, path=path)
+
+    waits = [limiter.reserve() for _ in range(12)]
+
+    assert waits[:10] == [0] * 10
+    assert waits[10:] == pytest.approx([0.1, 0.2])
+
+
+@pytest.mark.usefixtures("_frozen")
+def test_tokens_are_limited_too(path):
+    limiter = RateLimiter("test", 600, 60_000, burst=1, path=path)
+
+    assert limiter.reserve(tokens=1500) == pytest.approx(0.5)
+    limiter.refund(1000)
+    assert limiter.reserve(tokens=1000) == pytest.approx(0.5)
+    # services have separate buckets
+    assert RateLimiter("other", 600, 60_000, path=path).reserve(1500) == 0
+
+
+@pytest.mark.usefixtures("_frozen")
+def test_quotas_come_from_the_environment(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setenv("SUPERLESSON_OPENAI_TPM", "60")
+    openai = limiter("openai")
+
+    assert openai.reserve(tokens=10) == 0
+    assert openai.reserve(tokens=1) == pytest.approx(1)
+    assert (tmp_path / "superlesson" / "ratelimit.db").exists()
+
+
+def test_processes_share_the_quota(path):
+    queue = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=call, args=(path, 10, queue)) for _ in range(3)
+    ]
+    for process in processes:
+        process.start()
+    waits = [queue.get(timeout=10) for _ in range(30)]
+    for process in processes:
+        process.join()
+
+    # 20 requests per second, the first one right away, whichever process asked
+    assert sorted(waits) == pytest.approx([i / 20 for i in range(30)])
+
+
+@pytest.mark.usefixtures("_frozen")
+def test_throttled_requests_give_their_tokens_back(path, monkeypatch):
+    class Completions:
+        async def create(self, **kwargs):
+            request = httpx.Request("POST", "https://api.openai.com/v1/chat")
+            response = httpx.Response(429, request=request)
+            msg = "Rate limited"
+            raise openai.RateLimitError(msg, response=response, body=None)
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=Completions()))
+
+    monkeypatch.setattr(Improve, "_count_tokens", staticmethod(len))
+    limiter = RateLimiter("openai", 600, 60_000, burst=1, path=path)
+
+    completion = asyncio.run(
+        Improve._complete_prompt(client, limiter, "x" * 400, "y" * 100)
+    )
+
+    assert completion is None
+    # the request is still counted, but not the 900 tokens it would have used
+    assert limiter.reserve(tokens=1000) == 0
@@ -0,0 +1,131 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+from superlesson.serve import Server, _command, forward, running
+from superlesson.steps.step import Step
+from superlesson.storage import Slide, Slides
+from superlesson.storage.slide import TimeFrame
+from superlesson.storage.store import Store, _parse
+
+
+@pytest.fixture()
+def lesson(tmp_path):
+    root = tmp_path / "calc"
+    root.mkdir()
+    (root / "aula.mp4").write_bytes(b"video")
+    slides = Slides(root)
+    slides.extend(
+        [
+            Slide("a integral de x", TimeFrame(0, 1)),
+            Slide("é fácil", TimeFrame(1, 2)),
+        ]
+    )
+    slides.save(Step.merge)
+    slides[0].transcription = "a derivada de x"
+    slides.save(Step.replace)
+    return root
+
+
+@pytest.fixture()
+def server(tmp_path, monkeypatch):
+    path = tmp_path / "sl.sock"
+    monkeypatch.setenv("SUPERLESSON_SOCKET", str(path))
+    server = Server(path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    while not running(path):
+        time.sleep(0.01)
+    yield server
+    server.stop()
+    thread.join()
+
+
+def sl(*args, cwd):
+    return subprocess.run(
+        [sys.executable, "-m", "superlesson", *args],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+
+
+def test_commands_run_in_the_server(lesson, server, monkeypatch):
+    run = Server._run
+    commands = []
+
+    def counted(request, send):
+        commands.append(request["args"])
+        return run(request, send)
+
+    monkeypatch.setattr(Server, "_run", staticmethod(counted))
+
+    result = sl("calc", "diff", "merge", "replace", cwd=lesson.parent)
+    assert result.returncode == 0
+    assert "{+derivada+}" in result.stdout
+    assert "1 of 2 slides changed, +1 -1 words" in result.stdout
+
+    result = sl("calc", "diff", "merge", "improve", cwd=lesson.parent)
+    assert result.returncode == 1
+    assert 'Step "improve punctuation" has not been run yet.' in result.stderr
+    assert len(commands) == 2
+
+
+def test_only_some_commands_are_forwarded(lesson, server):
+    # these ask questions
+    assert forward(["calc"]) is None
+    assert forward(["calc", "enumerate"]) is None
+    assert forward(["calc", "run"]) is None
+    # and these keep running
+    assert forward(["watch", "lessons"]) is None
+    assert forward(["serve"]) is None
+
+
+def test_lessons_named_like_commands(lesson, server, monkeypatch):
+    monkeypatch.chdir(lesson.parent)
+    lesson.rename(lesson.parent / "diff")
+    (lesson.parent / "search").mkdir()
+
+    # both ask questions
+    assert forward(["diff", "run"]) is None
+    assert forward(["-v", "search", "enumerate"]) is None
+    assert _command(["--trace", "t.json", "-f", "diff", "merge"]) == "merge"
+    assert _command(["-v", "batch", "lessons"]) == "batch"
+
+
+def test_without_a_server(lesson, tmp_path, monkeypatch):
+    monkeypatch.setenv("SUPERLESSON_SOCKET", str(tmp_path / "sl.sock"))
+
+    assert forward(["calc", "diff", "merge", "replace"]) is None
+
+
+def test_text_step_files_are_parsed_once(lesson):
+    slides = Slides(lesson)
+    slides.load_step(Step.replace)
+    slides.save(Step.improve)
+    store = Store(lesson)
+    hits = _parse.cache_info().hits
+
+    assert store.load("improved", load_txt=True)[0]["transcription"] == (
+        "a derivada de x"
+    )
+    store.load("improved", load_txt=True)
+    assert _parse.cache_info().hits == hits + 1
+
+    txt = lesson / "improved.txt"
+    txt.write_text(txt.read_text().replace("derivada", "primitiva"))
+    assert store.load("improved", load_txt=True)[0]["transcription"] == (
+        "a primitiva de x"
+    )
+
+    # rewritten within the same mtime tick, with the same size
+    mtime = txt.stat().st_mtime_ns
+    txt.write_text(txt.read_text().replace("primitiva", "logaritmo"))
+    os.utime(txt, ns=(mtime, mtime))
+    assert store.load("improved", load_txt=True)[0]["transcription"] == (
+        "a logaritmo de x"
+    )
@@ -0,0 +1,63 @@
+import pytest
+from superlesson.steps.step import Step
+from superlesson.storage import Slide, Slides
+from superlesson.storage.slide import TimeFrame
+
+
+@pytest.fixture()
+def root(tmp_path):
+    slides = Slides(tmp_path)
+    for i in range(100):
+        slides.append(Slide(f"slide {i}.", TimeFrame(i, i + 1)))
+    slides.save(Step.merge)
+    return tmp_path
+
+
+def load(root, step=Step.merge):
+    slides = Slides(root)
+    assert slides.load_step(step)
+    return slides
+
+
+def test_lazy_load(root):
+    slides = load(root)
+
+    assert len(slides) == 100
+    assert slides[42].transcription == "slide 42."
+    assert slides.data._decoded.keys() == {42}
+
+
+def test_stream_doesnt_keep_slides(root):
+    slides = load(root)
+
+    assert [slide.transcription for slide in slides.stream()][-1] == "slide 99."
+    assert not slides.data._decoded
+
+
+def test_mutations_are_saved(root):
+    slides = load(root)
+    for slide in slides:
+        slide.transcription = slide.transcription.upper()
+    slides[3].number = 2
+    slides.merge(10, 19)
+    slides.save(Step.enumerate)
+
+    saved = load(root, Step.enumerate)
+
+    assert len(saved) == 91
+    assert saved[0].transcription == "SLIDE 0."
+    assert saved[3].number == 2
+    assert saved[10].transcription.startswith("SLIDE 10. SLIDE 11.")
+    assert saved[10].timeframe.end == 20
+    assert saved[11].transcription == "SLIDE 20."
+
+
+def test_untouched_slides_are_saved(root):
+    slides = load(root)
+    slides.merge(0, 1)
+    slides.save(Step.enumerate)
+
+    saved = load(root, Step.enumerate)
+
+    assert len(saved) == 99
+    assert saved[98].transcription == "slide 99."
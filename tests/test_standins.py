@@ -0,0 +1,79 @@
+import wave
+
+import httpx
+import pytest
+from superlesson.standins import Behavior, StandIns
+from superlesson.steps import Improve, Transcribe
+from superlesson.steps.step import Step
+from superlesson.storage import Slide, Slides
+from superlesson.storage.slide import TimeFrame
+
+
+@pytest.fixture()
+def stand_ins(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    # tiktoken would download its encoding
+    monkeypatch.setattr(
+        Improve, "_count_tokens", staticmethod(lambda text: len(text.split()))
+    )
+    with StandIns(
+        openai=Behavior(latency=0.01, throttle=0.3, retry_after=0.01, seed=1),
+        replicate=Behavior(latency=0.1),
+    ) as stand_ins:
+        for name, value in stand_ins.environment().items():
+            monkeypatch.setenv(name, value)
+        yield stand_ins
+
+
+def test_behavior_parse():
+    behavior = Behavior.parse("latency=2,jitter=0.5,concurrency=4")
+
+    assert behavior == Behavior(latency=2, jitter=0.5, concurrency=4)
+    with pytest.raises(ValueError, match="Unknown setting 'latnecy'"):
+        Behavior.parse("latnecy=2")
+
+
+def test_requests_over_the_rate_are_throttled():
+    with StandIns(replicate=Behavior(rate=2)) as stand_ins:
+        url = f"{stand_ins.replicate.url}/v1/predictions"
+        statuses = [
+            httpx.post(url, json={"version": "v", "input": {}}).status_code
+            for _ in range(3)
+        ]
+
+    assert statuses == [201, 201, 429]
+
+
+def test_improve_retries_throttled_requests(tmp_path, stand_ins):
+    slides = Slides(tmp_path)
+    slides.extend(
+        Slide(f"Slide {i}. Sobre derivadas.", TimeFrame(i, i + 1)) for i in range(10)
+    )
+    slides.save(Step.merge)
+
+    Improve(Slides(tmp_path)).punctuation()
+
+    # the client retried throttled requests, up to twice
+    requests = stand_ins.openai.requests
+    assert requests[("POST", 429)] > 0
+    assert requests[("POST", 200)] >= 10 - requests[("POST", 429)] // 3
+    improved = Slides(tmp_path)
+    improved.load_step(Step.improve)
+    assert improved[3].transcription.split() == ["Slide", "3.", "Sobre", "derivadas."]
+
+
+def test_transcribe_through_stand_ins(tmp_path, stand_ins):
+    audio = tmp_path / "audio.wav"
+    with wave.open(str(audio), "wb") as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(16000)
+        file.writeframes(b"\0\0" * 16000 * 10)
+
+    segments = Transcribe._transcribe_file(audio)
+    assert Transcribe._transcribe_file(audio) == segments
+
+    # as long as the audio, and only uploaded once
+    assert 9 < segments[-1].end < 10
+    assert stand_ins.s3.requests[("PUT", 200)] == 1
+    assert stand_ins.s3.requests[("HEAD", 200)] == 1
@@ -0,0 +1,95 @@
+import os
+
+import pytest
+from superlesson.steps.step import Step, step
+from superlesson.storage import Slide, Slides
+from superlesson.storage.slide import TimeFrame
+
+
+class Counter:
+    def __init__(self, slides, path):
+        self.slides = slides
+        self.path = path
+        self.runs = 0
+
+    def inputs(self):
+        return [self.path, "parameter"]
+
+    @step(Step.replace, Step.merge)
+    def run(self):
+        self.runs += 1
+
+
+@pytest.fixture()
+def root(tmp_path):
+    slides = Slides(tmp_path)
+    slides.append(Slide("palavra", TimeFrame(0, 1)))
+    slides.save(Step.merge)
+    tmp_path.joinpath("replacements.txt").write_text("palavra -> word")
+    return tmp_path
+
+
+def run(root, force=False):
+    counter = Counter(Slides(root, force=force), root / "replacements.txt")
+    counter.run()
+    return counter.runs
+
+
+def test_skip_unchanged(root):
+    assert run(root) == 1
+    assert run(root) == 0
+
+
+def test_rerun_on_changed_input(root):
+    run(root)
+    root.joinpath("replacements.txt").write_text("palavra -> other word")
+
+    assert run(root) == 1
+
+
+def test_rerun_on_changed_upstream(root):
+    run(root)
+    slides = Slides(root)
+    slides.load_step(Step.merge)
+    slides[0].transcription = "outra palavra"
+    slides.save(Step.merge)
+
+    assert run(root) == 1
+
+
+def test_rerun_when_forced(root):
+    run(root)
+
+    assert run(root, force=True) == 1
+
+
+def test_data_without_fingerprint_is_kept(root):
+    slides = Slides(root)
+    slides.load_step(Step.merge)
+    slides.save(Step.replace)
+
+    assert run(root) == 0
+    assert run(root) == 0
+    root.joinpath("replacements.txt").write_text("palavra -> other word")
+    assert run(root) == 1
+
+
+def test_skipped_step_is_loaded(root):
+    run(root)
+    slides = Slides(root)
+    Counter(slides, root / "replacements.txt").run()
+
+    assert slides.in_memory(Step.replace)
+
+
+def test_touched_input_isnt_rerun(root):
+    video = root / "aula.mp4"
+    video.write_bytes(b"video")
+    os.utime(video, ns=(0, 1_000_000_000))
+    counter = Counter(Slides(root), video)
+    counter.run()
+
+    os.utime(video, ns=(0, 2_000_000_000))
+    counter = Counter(Slides(root), video)
+    counter.run()
+    assert counter.runs == 0
@@ -0,0 +1,55 @@
+import pytest
+from superlesson.storage.binary import FormatError, SlideTable, dumps
+from superlesson.storage.store import Store
+
+
+@pytest.fixture()
+def data():
+    return [
+        {
+            "transcription": f"palavra {i} ação",
+            "timeframe": {"start": i * 0.5, "end": i * 0.5 + 0.25},
+            "tframe": "None" if i % 2 else f"tframes/00-00-{i:02}.png",
+            "number": None if i % 3 == 0 else i - 2,
+        }
+        for i in range(10)
+    ]
+
+
+def test_binary_roundtrip(data):
+    table = SlideTable(dumps(data))
+
+    assert len(table) == len(data)
+    for obj, loaded in zip(data, table, strict=True):
+        assert loaded["transcription"] == obj["transcription"]
+        assert loaded["timeframe"] == obj["timeframe"]
+        assert loaded["number"] == obj["number"]
+        assert loaded["tframe"] == (None if obj["tframe"] == "None" else obj["tframe"])
+
+
+def test_binary_rejects_other_formats(data):
+    with pytest.raises(FormatError):
+        SlideTable(b'[{"transcription": ""}]')
+    with pytest.raises(FormatError):
+        SlideTable(dumps(data)[:-1])
+
+
+def test_store_prefers_binary(tmp_path, data):
+    store = Store(tmp_path, export_json=True)
+    store.save("merged", data)
+    data[0]["transcription"] = "outdated"
+    store.save_json("merged", data)
+
+    loaded = store.load("merged", load_txt=False)
+
+    assert isinstance(loaded, SlideTable)
+    assert loaded[0]["transcription"] == "palavra 0 ação"
+
+
+def test_store_loads_json(tmp_path, data):
+    store = Store(tmp_path)
+    store.save_json("merged", data)
+
+    loaded = store.load("merged", load_txt=False)
+
+    assert loaded[1]["tframe"] is None
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import time
+
+import pytest
+from superlesson.collection import Lesson
+from superlesson.steps import Improve, Merge, Transcribe
+from superlesson.steps import transcribe as transcribe_module
+from superlesson.steps.step import Step
+from superlesson.storage import Slide, Slides
+from superlesson.storage.slide import TimeFrame
+from superlesson.stream import Stream
+
+
+def make_words():
+    words = []
+    time = 0.0
+    # a sentence of 10 words every 5 seconds, with a 1 second pause between them
+    for sentence in range(12):
+        for word in range(10):
+            text = f"word{sentence}." if word == 9 else "word"
+            words.append(Slide(text, TimeFrame(time, time + 0.4)))
+            time += 0.4
+        time += 1.0
+    return words
+
+
+async def produce(words, delay=0.0):
+    for word in words:
+        await asyncio.sleep(delay)
+        yield word
+
+
+@pytest.fixture()
+def lesson(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    root = tmp_path / "calc"
+    (root / "tframes").mkdir(parents=True)
+    # the last one is after the lesson ends
+    for name in ["00-00-08", "00-00-09", "00-00-21", "00-00-40", "00-01-30"]:
+        (root / "tframes" / f"{name}.png").touch()
+    (root / "aula.mp4").write_bytes(b"video")
+    return Lesson(str(root))
+
+
+@pytest.fixture()
+def services(monkeypatch):
+    """Fake transcription and ChatGPT, recording when each slide was improved."""
+    improved = []
+
+    async def transcribe(self):
+        async for word in produce(make_words(), delay=0.005):
+            yield word
+
+    async def improve(cls, client, limiter, text):
+        await asyncio.sleep(0.05)
+        improved.append(text)
+        return text.upper()
+
+    monkeypatch.setattr(Transcribe, "stream", transcribe)
+    monkeypatch.setattr(Improve, "_improve_text", classmethod(improve))
+    monkeypatch.setattr(Improve, "_openai_client", staticmethod(lambda: None))
+    return improved
+
+
+def test_merge_stream_matches_segments(lesson):
+    slides = Slides(lesson.root)
+    slides.extend(make_words())
+    slides.save(Step.transcribe)
+    Merge(slides).segments()
+
+    async def stream():
+        merge = Merge(Slides(lesson.root))
+        return [slide async for slide in merge.stream(produce(make_words()))]
+
+    streamed = asyncio.run(stream())
+
+    assert [slide.to_dict() for slide in streamed] == [
+        slide.to_dict() for slide in slides
+    ]
+    # the words after the last transition are left without a frame
+    assert [slide.tframe and slide.tframe.name for slide in streamed] == [
+        "00-00-08.png",
+        "00-00-09.png",
+        "00-00-21.png",
+        "00-00-40.png",
+        None,
+    ]
+
+
+def test_stream(lesson, services, caplog):
+    (lesson.root / "replacements.txt").write_text("word -> palavra")
+
+    report = Stream(lesson, Slides(lesson.root), queue_size=2).run()
+
+    # slides were improved while the lesson was being transcribed
+    assert report.first[Step.improve] < report.timings[Step.transcribe].end
+    assert services[0].startswith("palavra palavra")
+    slides = Slides(lesson.root)
+    slides.load_step(Step.improve)
+    assert slides[0].transcription.startswith("PALAVRA PALAVRA")
+    assert len(slides) == 5
+
+    caplog.set_level(logging.INFO, logger="superlesson")
+    Stream(lesson, Slides(lesson.root)).run()
+    assert '"merge segments" is up to date, skipping' in caplog.text
+    assert '"improve punctuation" is up to date, skipping' in caplog.text
+    assert services[5:] == []
+
+
+def test_failed_stages_keep_the_ones_before(lesson, services, monkeypatch):
+    async def fail(cls, client, limiter, text):
+        msg = "no quota"
+        raise ValueError(msg)
+
+    monkeypatch.setattr(Improve, "_improve_text", classmethod(fail))
+
+    with pytest.raises(ValueError, match="no quota"):
+        Stream(lesson, Slides(lesson.root)).run()
+
+    slides = Slides(lesson.root)
+    assert slides.load_step(Step.replace)
+    assert len(slides) == 5
+    assert not slides.load_step(Step.improve)
+
+
+def test_stream_after_transcribing(lesson, services, monkeypatch, caplog):
+    segments = [
+        transcribe_module.Segment(
+            word.transcription, word.timeframe.start, word.timeframe.end
+        )
+        for word in make_words()
+    ]
+    monkeypatch.setattr(transcribe_module, "extract_audio", lambda video, path: path)
+    for name, fake in [
+        ("_upload_file_to_s3", lambda path: "s3://audio"),
+        ("_check_token", lambda: None),
+        ("_transcribe_with_replicate", lambda url: segments),
+    ]:
+        monkeypatch.setattr(Transcribe, name, staticmethod(fake))
+    Transcribe(Slides(lesson.root), lesson.video).single_file()
+
+    caplog.set_level(logging.INFO, logger="superlesson")
+    Stream(lesson, Slides(lesson.root)).run()
+
+    assert "Already transcribed" in caplog.text
+    slides = Slides(lesson.root)
+    assert slides.load_step(Step.improve)
+    assert len(slides) == 5
+
+
+def test_closed_stream_stops_transcribing(tmp_path, monkeypatch):
+    # more chunks than threads, which are at most 32
+    chunks = 64
+    transcribed = []
+
+    def split(audio, directory, seconds):
+        paths = [directory / f"audio-{i:04d}.wav" for i in range(chunks)]
+        for path in paths:
+            path.write_bytes(b"chunk")
+        return [(path, i * seconds) for i, path in enumerate(paths)]
+
+    def transcribe_file(path):
+        time.sleep(0.05)
+        # still there, for the upload
+        transcribed.append(path.exists())
+        return [transcribe_module.Segment("word", 0, 1)]
+
+    monkeypatch.setattr(transcribe_module, "extract_audio", lambda video, path: path)
+    monkeypatch.setattr(transcribe_module, "split_audio", split)
+    monkeypatch.setattr(Transcribe, "_check_token", staticmethod(lambda: None))
+    monkeypatch.setattr(Transcribe, "_transcribe_file", staticmethod(transcribe_file))
+
+    async def first_word():
+        words = Transcribe(Slides(tmp_path), tmp_path / "aula.mp4", 300).stream()
+        word = await anext(words)
+        await words.aclose()
+        # threads the stream didn't wait for would finish by now
+        await asyncio.sleep(0.2)
+        return word
+
+    assert asyncio.run(first_word()).transcription == "word"
+    assert 0 < len(transcribed) < chunks
+    assert all(transcribed)
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import pstats
+
+import click
+import pytest
+from superlesson import trace
+from superlesson.cli import cli
+from superlesson.steps.step import Step, step
+from superlesson.storage import Slide, Slides
+from superlesson.storage.slide import TimeFrame
+
+
+class Words:
+    def __init__(self, slides):
+        self.slides = slides
+
+    def inputs(self):
+        return []
+
+    @step(Step.transcribe)
+    def run(self):
+        with trace.span("replicate") as span:
+            self.slides.append(Slide("palavra", TimeFrame(0, 1)))
+            span.set(words=1)
+
+
+@pytest.fixture()
+def tracer():
+    yield trace.start()
+    trace.stop()
+
+
+def test_spans_nest(tracer):
+    with trace.span("step", slides=3) as outer:
+        with trace.span("ffmpeg") as inner:
+            pass
+        outer.set(bytes=10)
+
+    assert [span.name for span in tracer.spans] == ["ffmpeg", "step"]
+    assert inner.parent == outer.id
+    assert outer.parent is None
+    assert outer.attributes == {"slides": 3, "bytes": 10}
+    assert outer.start <= inner.start <= inner.end <= outer.end
+
+
+def test_spans_are_only_kept_while_tracing():
+    with trace.span("step") as span:
+        pass
+
+    assert span.duration >= 0
+    assert trace.start().spans == []
+    trace.stop()
+
+
+def test_concurrent_requests_are_async_events(tracer):
+    async def request():
+        with trace.span("openai request"):
+            await asyncio.sleep(0.01)
+
+    async def improve():
+        with trace.span("improve"):
+            await asyncio.gather(request(), request())
+
+    asyncio.run(improve())
+
+    improve_span = next(span for span in tracer.spans if span.name == "improve")
+    requests = [span for span in tracer.spans if span.name == "openai request"]
+    assert [span.parent for span in requests] == [improve_span.id] * 2
+    phases = [event["ph"] for event in tracer.events() if event["ph"] != "M"]
+    assert sorted(phases) == ["b", "b", "b", "e", "e", "e"]
+
+
+def test_steps_are_traced(tmp_path, tracer):
+    Words(Slides(tmp_path)).run()
+    Words(Slides(tmp_path)).run()
+
+    ran, skipped = (span for span in tracer.spans if span.name == "transcribe")
+    assert ran.attributes == {"skipped": False, "slides": 1}
+    assert skipped.attributes == {"skipped": True}
+    [replicate] = (span for span in tracer.spans if span.name == "replicate")
+    assert replicate.parent == ran.id
+
+
+def test_diagnostics_options(tmp_path):
+    (tmp_path / "lessons").mkdir()
+    trace_path = tmp_path / "out.json"
+    profile_path = tmp_path / "out.prof"
+
+    # saved even if the command fails, and before library commands too
+    with pytest.raises(click.UsageError):
+        cli.main(
+            [
+                f"--trace={trace_path}",
+                "--profile",
+                str(profile_path),
+                "batch",
+                str(tmp_path / "lessons"),
+            ],
+            standalone_mode=False,
+        )
+    trace.stop()
+
+    assert json.loads(trace_path.read_text())["traceEvents"] == []
+    assert pstats.Stats(str(profile_path)).total_calls > 0
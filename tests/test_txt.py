@@ -0,0 +1,61 @@
+import io
+
+import pytest
+from superlesson.storage.store import Store
+from superlesson.storage.txt import ParseError, dump, load, parse_timestamp
+
+
+@pytest.fixture()
+def data():
+    return [
+        {
+            "transcription": f"palavra {i}\n\nação",
+            "timeframe": {"start": i * 20000.5, "end": i * 20000.5 + 30},
+            "tframe": None,
+            "number": [None, -1, 0, 41][i % 4],
+        }
+        for i in range(8)
+    ]
+
+
+def test_txt_roundtrip(data):
+    f = io.StringIO()
+    dump(data, f)
+    f.seek(0)
+
+    assert list(load(f)) == data
+
+
+def test_parse_timestamp():
+    assert parse_timestamp("0:00:00") == 0
+    assert parse_timestamp("1:02:03.5") == 3723.5
+    assert parse_timestamp("12:00:59.250") == 43259.25
+    assert parse_timestamp("1 day, 0:00:01") == 86401
+
+
+@pytest.mark.parametrize(
+    ("text", "line", "column"),
+    [
+        ("stray text\n====== SLIDE 1 (0:00:00 - 0:00:01) ======\n", 1, 1),
+        ("====== SLIDE one (0:00:00 - 0:00:01) ======\n", 1, 14),
+        ("\n====== SLIDE 1 (0:00:00 - 0:00:01) =====\n", 2, 34),
+        ("====== SLIDE 1 (0:00:00 0:00:01) ======\n", 1, 24),
+        ("====== SLIDE 1 (0:00:00 - 0:0a:01) ======\n", 1, 29),
+        ("====== SLIDE 12 (0:00:00.x - 0:00:01) ======\n", 1, 26),
+        ("====== SLIDE 1 (0:00:00 - 0:00:01) ======\n\nok\n======\n", 4, 1),
+    ],
+)
+def test_txt_errors(text, line, column):
+    with pytest.raises(ParseError) as e:
+        list(load(io.StringIO(text)))
+
+    assert (e.value.line, e.value.column) == (line, column)
+
+
+def test_store_raises_on_malformed_txt(tmp_path, data):
+    store = Store(tmp_path)
+    store.save("improved", data)
+    (tmp_path / "improved.txt").write_text("====== SLIDE 1 (0:00 - 0:01) ======\n")
+
+    with pytest.raises(ParseError, match="improved.txt:1:17"):
+        store.load("improved", load_txt=True)
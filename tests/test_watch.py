@@ -0,0 +1,122 @@
+import asyncio
+import time
+
+import pytest
+from superlesson.batch import Batch
+from superlesson.collection import FileType
+from superlesson.steps.step import Step
+from superlesson.watch import (
+    Debouncer,
+    InotifyWatcher,
+    PollingWatcher,
+    Watch,
+    needs,
+)
+
+
+def record(root, step):
+    with open(root / "ran", "a") as f:
+        f.write(f"{step.name}\n")
+
+
+@pytest.fixture()
+def lessons(tmp_path):
+    (tmp_path / "calc").mkdir()
+    (tmp_path / "calc" / "aula.mp4").write_bytes(b"video")
+    return tmp_path
+
+
+def test_needs():
+    assert needs(Step.transcribe) == {FileType.video}
+    assert needs(Step.merge) == {FileType.video, FileType.tframes}
+    assert needs(Step.improve) == {FileType.video, FileType.tframes}
+    # enumerate is interactive, so its data is checked when annotating instead
+    assert needs(Step.annotate) == {FileType.slides}
+
+
+def test_debouncer(tmp_path):
+    path = tmp_path / "aula.mp4"
+    path.write_bytes(b"vid")
+    debouncer = Debouncer(settle=0.1)
+    debouncer.touch(path)
+    assert debouncer.settled() == []
+
+    time.sleep(0.15)
+    path.write_bytes(b"video")
+    assert debouncer.settled() == []
+    time.sleep(0.15)
+    assert debouncer.settled() == [path]
+    assert debouncer.settled() == []
+
+
+@pytest.mark.parametrize("watcher_class", [PollingWatcher, InotifyWatcher])
+def test_watchers(lessons, watcher_class):
+    watcher = watcher_class(lessons)
+    assert watcher.changes() == {lessons / "calc" / "aula.mp4"}
+    assert watcher.changes() == set()
+
+    (lessons / "fis").mkdir()
+    (lessons / "fis" / "aula.mp4").touch()
+    (lessons / "fis" / "transcription.txt").touch()
+    (lessons / "fis" / "annotations.pdf").touch()
+    (lessons / ".search.db").touch()
+    assert watcher.changes() == {lessons / "fis" / "aula.mp4"}
+
+    (lessons / "calc" / "slides.pdf").write_bytes(b"slides")
+    assert watcher.changes() == {lessons / "calc" / "slides.pdf"}
+
+    (lessons / "calc" / "tframes").mkdir()
+    assert watcher.changes() == {lessons / "calc" / "tframes"}
+    (lessons / "calc" / "tframes" / "00-01-00.png").touch()
+    assert watcher.changes() == {lessons / "calc" / "tframes"}
+    watcher.close()
+
+
+def run_until(watch, done):
+    progress = []
+
+    async def run():
+        task = asyncio.create_task(watch.run(progress.append))
+        while not any(done in p.done for p in progress):
+            await asyncio.sleep(0.02)
+        task.cancel()
+
+    asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def test_steps_start_when_their_files_are_complete(lessons):
+    (lessons / "calc" / "tframes").mkdir()
+    (lessons / "fis").mkdir()
+    (lessons / "fis" / "slides.pdf").touch()
+    watch = Watch(
+        Batch((), cpu_workers=1, run=record),
+        PollingWatcher(lessons),
+        settle=0.1,
+        interval=0.02,
+    )
+
+    run_until(watch, Step.improve)
+
+    ran = (lessons / "calc" / "ran").read_text().split()
+    assert ran == ["transcribe", "merge", "replace", "improve"]
+    # neither transcribed, since there's no video, nor annotated, since not enumerated
+    assert not (lessons / "fis" / "ran").exists()
+
+
+@pytest.mark.parametrize("watcher_class", [PollingWatcher, InotifyWatcher])
+def test_merge_waits_for_tframes(lessons, watcher_class):
+    watch = Watch(
+        Batch((), cpu_workers=1, run=record),
+        watcher_class(lessons),
+        settle=0.1,
+        interval=0.02,
+    )
+    run_until(watch, Step.transcribe)
+    assert (lessons / "calc" / "ran").read_text().split() == ["transcribe"]
+
+    (lessons / "calc" / "tframes").mkdir()
+    (lessons / "calc" / "tframes" / "00-01-00.png").touch()
+    run_until(watch, Step.improve)
+
+    ran = (lessons / "calc" / "ran").read_text().split()
+    assert ran[-3:] == ["merge", "replace", "improve"]